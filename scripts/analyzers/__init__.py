@@ -1 +1 @@
-__all__ = ["cbt_fio_analyzer", "cbt_rados_analyzer", "cbt_pbench_analyzer"]
\ No newline at end of file
+__all__ = ["cbt_fio_analyzer", "cbt_rados_analyzer", "cbt_pbench_analyzer", "cbt_smallfile_analyzer"]
\ No newline at end of file
@@ -2,6 +2,7 @@ import os, sys, json, time, types, csv, copy
 import logging, statistics, yaml 
 import datetime, socket
 from scribes import *
+from utils.pipeline_stats import stats
 from . import cbt_pbench_analyzer
 
 logger = logging.getLogger("index_cbt")
@@ -13,11 +14,12 @@ def analyze_cbt_fio_results(tdir, cbt_config_obj, test_metadata):
     fiojson_results_transcriber_generator = cbt_fiojson_scribe.fiojson_results_transcriber(copy.deepcopy(test_metadata))
     metadata = {}
     metadata = test_metadata
-    for dirpath, dirs, files in os.walk(tdir):
+    for dirpath, dirs, files in stats.timed_iter("walk", os.walk(tdir)):
         for filename in files:
             fname = os.path.join(dirpath, filename)
             if 'benchmark_config.yaml' in fname:
-                benchmark_data = yaml.load(open(fname))
+                with open(fname) as f, stats.timer("yaml_parse", source=fname):
+                    benchmark_data = yaml.safe_load(f)
                 metadata['ceph_benchmark_test']['test_config'] = benchmark_data['cluster']
             
                 
@@ -2,9 +2,21 @@ import os, sys, json, time, types, csv, copy
 import logging, statistics, yaml 
 import datetime, socket
 from scribes import *
+from utils.pipeline_stats import stats
 
 logger = logging.getLogger("index_cbt")
 
+#every csv file of a host looks its address up again, unresolvable hosts are slow to fail
+host_address_cache = {}
+
+def host_address(hostname):
+    if hostname not in host_address_cache:
+        try:
+            host_address_cache[hostname] = socket.gethostbyname(hostname)
+        except Exception:
+            host_address_cache[hostname] = "UNKNOWN"
+    return host_address_cache[hostname]
+
 def analyze_cbt_Pbench_data(tdir, cbt_config_obj, test_metadata):
 
     logger.info("Processing pbench data...")
@@ -14,7 +26,7 @@ def analyze_cbt_Pbench_data(tdir, cbt_config_obj, test_metadata):
         for host in os.listdir(hosts_dir):
             host_dir_fullpath = "%s/%s" % (hosts_dir, host) 
             if os.path.isdir(host_dir_fullpath):
-                for pdirpath, pdirs, pfiles in os.walk(host_dir_fullpath.strip()):
+                for pdirpath, pdirs, pfiles in stats.timed_iter("walk", os.walk(host_dir_fullpath.strip())):
                     for pfilename in pfiles:
                         pfname = os.path.join(pdirpath, pfilename)
                         #for ever tool collect csvs and...  tool name, tool dir and metadata 
@@ -25,10 +37,7 @@ def analyze_cbt_Pbench_data(tdir, cbt_config_obj, test_metadata):
                             hostname = host
                             tool = pfname.split("/")[-3]
                             metadata['ceph_benchmark_test']['common']['hardware']['hostname'] = hostname
-                            try:
-                                metadata['ceph_benchmark_test']['common']['hardware']['ipaddress'] = socket.gethostbyname(hostname)
-                            except:
-                                metadata['ceph_benchmark_test']['common']['hardware']['ipaddress'] = "UNKNOWN"
+                            metadata['ceph_benchmark_test']['common']['hardware']['ipaddress'] = host_address(hostname)
                             metadata['ceph_benchmark_test']['application_config']['ceph_config']['ceph_node_type'] = cbt_config_obj.get_host_type(hostname)
                             metadata['ceph_benchmark_test']['common']['test_info']['tool'] = tool
                             metadata['ceph_benchmark_test']['common']['test_info']['file_name'] = os.path.basename(pfname)
@@ -2,6 +2,7 @@ import os, sys, json, time, types, csv, copy
 import logging, statistics, yaml 
 import datetime, socket, itertools
 from scribes import *
+from utils.pipeline_stats import stats
 from . import cbt_pbench_analyzer
 from datetime import timedelta
 
@@ -14,11 +15,12 @@ def analyze_cbt_rados_results(tdir, cbt_config_obj, test_metadata):
     metadata = {}
     metadata = test_metadata
     rados_json_results_transcriber_generator = cbt_rados_scribe.rados_json_results_transcriber(metadata)
-    for dirpath, dirs, files in os.walk(tdir):
+    for dirpath, dirs, files in stats.timed_iter("walk", os.walk(tdir)):
         for filename in files:
             fname = os.path.join(dirpath, filename)
             if 'benchmark_config.yaml' in fname:
-                benchmark_data = yaml.load(open(fname))
+                with open(fname) as f, stats.timer("yaml_parse", source=fname):
+                    benchmark_data = yaml.safe_load(f)
                 metadata['ceph_benchmark_test']['test_config'] = benchmark_data['cluster']
                 logger.debug(json.dumps(metadata, indent=1))
                 
@@ -68,7 +70,7 @@ def analyze_cbt_rados_results(tdir, cbt_config_obj, test_metadata):
                             
 def analyze_cbt_rados_files(tdir, json_results_scribe, metadata):
     logger.info("Processing rados json files...")
-    for dirpath, dirs, files in os.walk(tdir):
+    for dirpath, dirs, files in stats.timed_iter("walk", os.walk(tdir)):
         for filename in files:
             fname = os.path.join(dirpath, filename)
             if "output" in fname and "json" not in fname:
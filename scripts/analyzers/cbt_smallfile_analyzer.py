@@ -1,7 +1,8 @@
 import os, sys, json, time, types, csv, copy
-import logging, statistics, yaml 
+import logging, statistics, yaml
 import datetime, socket, itertools
 from scribes import *
+from utils.pipeline_stats import stats
 from . import cbt_pbench_analyzer
 from datetime import timedelta
 
@@ -9,23 +10,37 @@ from datetime import timedelta
 logger = logging.getLogger("index_cbt")
 
 def analyze_cbt_smallfile_results(tdir, cbt_config_obj, test_metadata):
-    
-    logger.info("Processing Rados benchmark results.")
+
+    logger.info("Processing smallfile benchmark results.")
     metadata = {}
     metadata = test_metadata
-    for dirpath, dirs, files in os.walk(tdir):
+    smallfile_results_transcriber_generator = cbt_smallfile_scribe.smallfile_results_transcriber(copy.deepcopy(test_metadata))
+    for dirpath, dirs, files in stats.timed_iter("walk", os.walk(tdir)):
         for filename in files:
             fname = os.path.join(dirpath, filename)
             if 'benchmark_config.yaml' in fname:
-                benchmark_data = yaml.load(open(fname))
+                with open(fname) as f, stats.timer("yaml_parse", source=fname):
+                    benchmark_data = yaml.safe_load(f)
                 metadata['ceph_benchmark_test']['test_config'] = benchmark_data['cluster']
                 logger.debug(json.dumps(metadata, indent=1))
-                
+
                 if "smallfile" in metadata['ceph_benchmark_test']['test_config']['benchmark']:
-                    
-                    smallfile_transcriber_obj_generator = cbt_smallfile_scribe.smallfile_transcriber(dirpath, "smfresult.json", copy.deepcopy(metadata))
-                    yield smallfile_transcriber_obj_generator 
-                    
-                    analyze_cbt_Pbench_data_generator = cbt_pbench_analyzer.analyze_cbt_Pbench_data(write_path, cbt_config_obj, copy.deepcopy(metadata))
+
+                    for result_dir in find_smallfile_results(dirpath):
+                        smallfile_transcriber_obj_generator = cbt_smallfile_scribe.smallfile_transcriber(result_dir, "smfresult.json", copy.deepcopy(metadata))
+                        smallfile_results_transcriber_generator.add_transcriber(smallfile_transcriber_obj_generator)
+                        yield smallfile_transcriber_obj_generator
+
+                    analyze_cbt_Pbench_data_generator = cbt_pbench_analyzer.analyze_cbt_Pbench_data(dirpath, cbt_config_obj, copy.deepcopy(metadata))
                     for pbench_obj in analyze_cbt_Pbench_data_generator:
-                        yield pbench_obj
\ No newline at end of file
+                        yield pbench_obj
+
+    yield smallfile_results_transcriber_generator
+
+def find_smallfile_results(tdir):
+    for dirpath, dirs, files in stats.timed_iter("walk", os.walk(tdir)):
+        if "smfresult.json" in files:
+            if os.path.getsize(os.path.join(dirpath, "smfresult.json")) > 0:
+                yield dirpath
+            else:
+                logger.warn("Found empty smallfile result, %s/smfresult.json." % dirpath)
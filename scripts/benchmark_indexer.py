@@ -0,0 +1,282 @@
+#! /usr/bin/python
+
+import os, sys, json, time, shutil, tempfile, threading, resource
+import logging, getopt
+
+from utils.common_logging import setup_loggers
+from utils.synthetic_archive import cbt_archive_writer, cosbench_archive_writer
+from utils.pipeline_stats import stats
+
+logger = logging.getLogger("benchmark_indexer")
+
+es_log = logging.getLogger("elasticsearch")
+es_log.setLevel(logging.CRITICAL)
+
+def main():
+    arguments = argument_handler()
+
+    archive_dir = arguments.archive_dir
+    generated = False
+    if not archive_dir:
+        archive_dir = tempfile.mkdtemp(prefix="%s-archive-" % arguments.kind)
+        generated = True
+        start = time.time()
+        write_archive(arguments, archive_dir)
+        logger.info("Generated %s archive in %s, %.2fs" % (arguments.kind, archive_dir, time.time() - start))
+
+    if arguments.stats:
+        stats.enable()
+
+    report = {
+        "kind": arguments.kind,
+        "archive_dir": archive_dir,
+        "archive": archive_size(archive_dir),
+        "runs": []
+        }
+    try:
+        for run in range(arguments.runs):
+            result = benchmark(pipeline_generator(arguments, archive_dir), arguments.sample_interval, arguments.output_file)
+            report['runs'].append(result)
+            logger.info("run %s - %s documents, %.2f MB in %.2fs, %.0f docs/sec, %.2f MB/sec, peak rss %.1f MB" % (
+                run + 1, result['documents'], result['bytes'] / 1048576.0, result['seconds'],
+                result['docs_per_sec'], result['mb_per_sec'], result['peak_rss'] / 1048576.0))
+    finally:
+        if generated and not arguments.keep:
+            shutil.rmtree(archive_dir, ignore_errors=True)
+
+    if arguments.stats:
+        report['stages'] = stats.report()
+        for stage, entry in sorted(report['stages']['stages'].items(), key=lambda item: -item[1]['seconds']):
+            logger.info("  %-12s %10.3fs %10s calls %10.2f MB" % (
+                stage, entry['seconds'], entry['count'], entry['bytes'] / 1048576.0))
+    if arguments.report_file:
+        with open(arguments.report_file, 'w') as f:
+            f.write(json.dumps(report, indent=4, sort_keys=True))
+
+def write_archive(arguments, archive_dir):
+    if arguments.kind == "cosbench":
+        cosbench_archive_writer(archive_dir, workloads=arguments.workloads, duration=arguments.duration,
+                                seed=arguments.seed).write()
+    else:
+        writer = cbt_archive_writer(archive_dir, clients=arguments.clients, volumes=arguments.volumes,
+                                    iterations=arguments.iterations, duration=arguments.duration,
+                                    rados_instances=arguments.rados_instances, pbench_hosts=arguments.pbench_hosts,
+                                    seed=arguments.seed)
+        writer.write()
+        #the synthetic hosts don't resolve, keep the resolver's negative lookups out of the timings
+        from analyzers import cbt_pbench_analyzer
+        for index, host in enumerate(writer.clients + writer.osd_hosts):
+            cbt_pbench_analyzer.host_address_cache[host] = "192.0.2.%s" % (index + 1)
+
+def archive_size(archive_dir):
+    files = 0
+    size = 0
+    for dirpath, dirs, file_names in os.walk(archive_dir):
+        for file_name in file_names:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, file_name))
+    return {"files": files, "bytes": size}
+
+def pipeline_generator(arguments, archive_dir):
+    #the same generators index_cbt and index_cosbench hand to streaming_bulk
+    if arguments.kind == "cosbench":
+        import index_cosbench
+        if arguments.jobs > 1:
+            argv = ['-t', arguments.test_id, '-T', '-a', archive_dir, '-j', str(arguments.jobs)]
+            cosbench_arguments = index_cosbench.argument_handler(argv + (['-W'] if arguments.wide else []))
+            return index_cosbench.parallel_data_generator(cosbench_arguments, {})
+        return index_cosbench.process_data_generator(arguments.test_id, None, arguments.wide, archive_dir)
+
+    import index_cbt
+    return cbt_generator(index_cbt, arguments.test_id, archive_dir)
+
+def cbt_generator(index_cbt, test_id, archive_dir):
+    #index_cbt walks the current directory
+    cwd = os.getcwd()
+    os.chdir(archive_dir)
+    try:
+        for action in index_cbt.process_data_generator(test_id):
+            yield action
+    finally:
+        os.chdir(cwd)
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        #ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class rss_sampler(threading.Thread):
+    #rss and progress every interval seconds while the pipeline runs
+    def __init__(self, interval, progress):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.progress = progress
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.start_time = time.time()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.sample()
+            self.stop_event.wait(self.interval)
+
+    def sample(self):
+        self.samples.append({
+            "elapsed": round(time.time() - self.start_time, 3),
+            "rss": current_rss(),
+            "documents": self.progress['documents']
+            })
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.sample()
+
+def benchmark(generator, sample_interval=1.0, output_file=None):
+    #a local sink in place of elasticsearch, every action is serialized the way
+    #a bulk request body is and written out or dropped
+    progress = {"documents": 0, "bytes": 0}
+    output = open(output_file, 'w') if output_file else None
+    sampler = rss_sampler(sample_interval, progress)
+    sampler.start()
+    start = time.time()
+    try:
+        for action in generator:
+            source = action.get('_source', {})
+            header = {action.get('_op_type', "index"): {"_index": action.get('_index'), "_id": action.get('_id')}}
+            line = "%s\n%s\n" % (json.dumps(header), json.dumps(source))
+            progress['documents'] += 1
+            progress['bytes'] += len(line)
+            if output is not None:
+                output.write(line)
+    finally:
+        seconds = time.time() - start
+        sampler.stop()
+        if output is not None:
+            output.close()
+
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return {
+        "documents": progress['documents'],
+        "bytes": progress['bytes'],
+        "seconds": seconds,
+        "docs_per_sec": progress['documents'] / seconds if seconds else 0.0,
+        "mb_per_sec": progress['bytes'] / 1048576.0 / seconds if seconds else 0.0,
+        "peak_rss": max([sample['rss'] for sample in sampler.samples] + [resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024]),
+        "children_peak_rss": children_peak,
+        "rss_samples": sampler.samples
+        }
+
+class argument_handler():
+    def __init__(self):
+        self.kind = "cbt"
+        self.archive_dir = ""
+        self.test_id = "benchmark"
+        self.runs = 1
+        self.jobs = 1
+        self.wide = False
+        self.stats = False
+        self.report_file = None
+        self.output_file = None
+        self.sample_interval = 1.0
+        self.keep = False
+        self.clients = 2
+        self.volumes = 2
+        self.iterations = 1
+        self.duration = 60
+        self.rados_instances = 1
+        self.pbench_hosts = None
+        self.workloads = 4
+        self.seed = 0
+        self.log_level = logging.INFO
+
+        usage = """
+                Usage:
+                    benchmark_indexer.py [-k cbt|cosbench] [-a <archive dir>] [-j <report file>]
+
+                    -k or --kind - cbt (default) or cosbench
+                    -a or --archive_dir - existing archive to index, a synthetic one is generated otherwise
+                    -n or --runs - number of times the archive is indexed (default 1)
+                    -P or --jobs - cosbench workloads processed in parallel (default 1)
+                    -W or --wide - cosbench wide stage documents
+                    -S or --stats - per stage timings of the pipeline
+                    -j or --json - write the benchmark report to this file
+                    -o or --output - write the documents to this ndjson file instead of dropping them
+                    -I or --interval - seconds between rss samples (default 1)
+                    -K or --keep - keep the generated archive
+                    -d or --debug - enables debug (verbose) logging output
+
+                    synthetic archive scale:
+                    -c or --clients - cbt client hosts (default 2)
+                    -v or --volumes - rbd volumes per client (default 2)
+                    -i or --iterations - cbt iterations (default 1)
+                    -t or --time - seconds every test runs for (default 60)
+                    -r or --rados_instances - rados bench instances per client (default 1)
+                    -H or --pbench_hosts - hosts with pbench data (default every client and osd host)
+                    -w or --workloads - cosbench workloads (default 4)
+                    -s or --seed - random seed (default 0)
+                """
+        try:
+            opts, _ = getopt.getopt(sys.argv[1:], 'k:a:n:P:WSj:o:I:Kdc:v:i:t:r:H:w:s:',
+                                    ['kind=', 'archive_dir=', 'runs=', 'jobs=', 'wide', 'stats', 'json=', 'output=',
+                                     'interval=', 'keep', 'debug', 'clients=', 'volumes=', 'iterations=', 'time=',
+                                     'rados_instances=', 'pbench_hosts=', 'workloads=', 'seed='])
+        except getopt.GetoptError:
+            print (usage)
+            sys.exit(2)
+
+        for opt, arg in opts:
+            if opt in ('-k', '--kind'):
+                self.kind = arg
+            if opt in ('-a', '--archive_dir'):
+                self.archive_dir = os.path.abspath(arg)
+            if opt in ('-n', '--runs'):
+                self.runs = int(arg)
+            if opt in ('-P', '--jobs'):
+                self.jobs = max(1, int(arg))
+            if opt in ('-W', '--wide'):
+                self.wide = True
+            if opt in ('-S', '--stats'):
+                self.stats = True
+            if opt in ('-j', '--json'):
+                self.report_file = arg
+            if opt in ('-o', '--output'):
+                self.output_file = arg
+            if opt in ('-I', '--interval'):
+                self.sample_interval = float(arg)
+            if opt in ('-K', '--keep'):
+                self.keep = True
+            if opt in ('-d', '--debug'):
+                self.log_level = logging.DEBUG
+            if opt in ('-c', '--clients'):
+                self.clients = int(arg)
+            if opt in ('-v', '--volumes'):
+                self.volumes = int(arg)
+            if opt in ('-i', '--iterations'):
+                self.iterations = int(arg)
+            if opt in ('-t', '--time'):
+                self.duration = int(arg)
+            if opt in ('-r', '--rados_instances'):
+                self.rados_instances = int(arg)
+            if opt in ('-H', '--pbench_hosts'):
+                self.pbench_hosts = int(arg)
+            if opt in ('-w', '--workloads'):
+                self.workloads = int(arg)
+            if opt in ('-s', '--seed'):
+                self.seed = int(arg)
+
+        setup_loggers("benchmark_indexer", self.log_level)
+        #the pipeline logs through the indexers' own loggers
+        setup_loggers("index_cbt", logging.WARNING if self.log_level == logging.INFO else self.log_level)
+
+        if self.kind not in ("cbt", "cosbench") or (self.archive_dir and not os.path.isdir(self.archive_dir)):
+            logger.error(usage)
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
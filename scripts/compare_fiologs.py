@@ -0,0 +1,152 @@
+#! /usr/bin/python
+
+import os, sys, json, logging, getopt
+import yaml
+
+from analyzers import cbt_fio_analyzer
+from utils.common_logging import setup_loggers
+from utils.fio_timeseries import cluster_series, steady_state, compare_steady_state, log_metric
+
+logger = logging.getLogger("compare_fiologs")
+
+def main():
+    arguments = argument_handler()
+
+    baseline = collect_steady_state(arguments.baseline_dir, arguments)
+    candidate = collect_steady_state(arguments.candidate_dir, arguments)
+
+    report = {}
+    regressions = 0
+    for key in sorted(set(baseline) & set(candidate)):
+        comparison = compare_steady_state(baseline[key], candidate[key])
+        comparison['regression'] = is_regression(comparison, arguments.threshold)
+        report["%s-%s" % key] = comparison
+        log_comparison(key, comparison)
+        if comparison['regression']:
+            regressions += 1
+
+    for key in sorted(set(baseline) ^ set(candidate)):
+        logger.warn("%s %s only found in %s" % (key[0], key[1], "baseline" if key in baseline else "candidate"))
+
+    if arguments.json_file:
+        with open(arguments.json_file, 'w') as f:
+            f.write(json.dumps(report, indent=4, sort_keys=True))
+
+    logger.info("%s of %s test configurations regressed" % (regressions, len(report)))
+    sys.exit(1 if regressions else 0)
+
+def collect_steady_state(archive_dir, arguments):
+    #{(mode, op_size): steady_state} over every librbdfio test in a cbt archive
+    test_metadata = {
+        "ceph_benchmark_test": {
+            "application_config": {"ceph_config": {}},
+            "common": {"hardware": {}, "test_info": {}},
+            "test_config": {}
+            }
+        }
+
+    results = {}
+    for dirpath, dirs, files in os.walk(archive_dir):
+        if 'benchmark_config.yaml' not in files:
+            continue
+        with open(os.path.join(dirpath, 'benchmark_config.yaml')) as f:
+            benchmark_data = yaml.safe_load(f)['cluster']
+        if "librbdfio" not in benchmark_data.get('benchmark', ""):
+            continue
+
+        iops_logs = []
+        lat_logs = []
+        #the same fio logs index_cbt picks up
+        for fiolog_obj in cbt_fio_analyzer.analyze_cbt_fiologs(dirpath, None, test_metadata):
+            metric = log_metric(fiolog_obj.csv_file)
+            if metric == "iops":
+                iops_logs.append(fiolog_obj.csv_file)
+            elif metric == "lat":
+                lat_logs.append(fiolog_obj.csv_file)
+        if not iops_logs:
+            continue
+
+        key = (benchmark_data.get('mode'), benchmark_data.get('op_size'))
+        if key not in results:
+            results[key] = steady_state(arguments.warmup, arguments.cooldown, arguments.stall_fraction)
+        iops, latency = cluster_series(iops_logs, lat_logs)
+        results[key].add_series(iops, latency)
+
+    return results
+
+def is_regression(comparison, threshold):
+    #a drop in the mean or in the low percentile, or stalls the baseline did not have
+    iops_delta = comparison['delta'].get('iops', {})
+    return bool(comparison['new_stalls'] or
+                iops_delta.get('mean', 0) < -threshold or
+                iops_delta.get('p5', 0) < -threshold)
+
+def log_comparison(key, comparison):
+    baseline = comparison['baseline']
+    candidate = comparison['candidate']
+    iops_delta = comparison['delta'].get('iops', {})
+    latency_delta = comparison['delta'].get('latency', {})
+    log = logger.warn if comparison['regression'] else logger.info
+    log("%s %s - iops mean %s%%, p5 %s%%, cv %s%%, latency p99 %s%%, stalls %s -> %s, ks %s" % (
+        key[0], key[1], iops_delta.get('mean'), iops_delta.get('p5'), iops_delta.get('cv'),
+        latency_delta.get('p99'), baseline['stall_count'], candidate['stall_count'],
+        None if comparison['ks_iops'] is None else round(comparison['ks_iops'], 3)))
+
+class argument_handler():
+    def __init__(self):
+        self.baseline_dir = ""
+        self.candidate_dir = ""
+        self.warmup = None
+        self.cooldown = None
+        self.stall_fraction = 0.1
+        self.threshold = 5.0
+        self.json_file = None
+        self.log_level = logging.INFO
+
+        usage = """
+                Usage:
+                    compare_fiologs.py -b <baseline archive> -c <candidate archive>
+
+                    -b or --baseline - cbt archive directory of the baseline run
+                    -c or --candidate - cbt archive directory of the run to compare
+                    -w or --warmup - seconds trimmed from the start of every test (default is detected)
+                    -C or --cooldown - seconds trimmed from the end of every test (default is detected)
+                    -s or --stall - a second below this fraction of the median iops is a stall (default 0.1)
+                    -t or --threshold - percent drop in mean or p5 iops reported as a regression (default 5)
+                    -j or --json - write the full comparison report to this file
+                    -d or --debug - enables debug (verbose) logging output
+                """
+        try:
+            opts, _ = getopt.getopt(sys.argv[1:], 'b:c:w:C:s:t:j:d',
+                                    ['baseline=', 'candidate=', 'warmup=', 'cooldown=', 'stall=', 'threshold=', 'json=', 'debug'])
+        except getopt.GetoptError:
+            print (usage)
+            sys.exit(2)
+
+        for opt, arg in opts:
+            if opt in ('-b', '--baseline'):
+                self.baseline_dir = arg
+            if opt in ('-c', '--candidate'):
+                self.candidate_dir = arg
+            if opt in ('-w', '--warmup'):
+                self.warmup = int(arg)
+            if opt in ('-C', '--cooldown'):
+                self.cooldown = int(arg)
+            if opt in ('-s', '--stall'):
+                self.stall_fraction = float(arg)
+            if opt in ('-t', '--threshold'):
+                self.threshold = float(arg)
+            if opt in ('-j', '--json'):
+                self.json_file = arg
+            if opt in ('-d', '--debug'):
+                self.log_level = logging.DEBUG
+
+        setup_loggers("compare_fiologs", self.log_level)
+
+        if not os.path.isdir(self.baseline_dir) or not os.path.isdir(self.candidate_dir):
+            logger.error(usage)
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
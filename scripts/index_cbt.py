@@ -8,6 +8,8 @@ from elasticsearch import Elasticsearch, helpers
 from proto_py_es_bulk import *
 from scribes import *
 from utils.common_logging import setup_loggers
+from utils.summary_store import summary_store
+from utils.pipeline_stats import stats, transcriber_source
 from analyzers import *
 
 logger = logging.getLogger("index_cbt")
@@ -20,15 +22,37 @@ urllib3_log.setLevel(logging.CRITICAL)
 def main():
     #es, test_id, test_mode = argument_handler()
     arguments = argument_handler()
+    if arguments.stats:
+        stats.enable()
+        if not arguments.test_mode:
+            stats.instrument_client(arguments.es)
+
+    generator = process_data_generator(arguments.test_id)
+    store = None
+    if arguments.store_file:
+        store = summary_store(arguments.store_file)
+        generator = store.record_actions(generator)
+
+    try:
+        index_results(arguments, generator)
+    finally:
+        if store is not None:
+            store.close()
+        if arguments.stats:
+            stats.log_summary()
+            if arguments.stats_file:
+                stats.write_report(arguments.stats_file)
+
+def index_results(arguments, generator):
     if arguments.test_mode:
         logger.info("*********** TEST MODE **********")
-        for i in process_data_generator(arguments.test_id):
+        for i in generator:
             if arguments.verbose:
                 logger.debug(json.dumps(i, indent=4))
         logger.info("*********** TEST MODE **********")
     else:
         try:
-            res_beg, res_end, res_suc, res_dup, res_fail, res_retry  = proto_py_es_bulk.streaming_bulk(arguments.es, process_data_generator(arguments.test_id))
+            res_beg, res_end, res_suc, res_dup, res_fail, res_retry  = proto_py_es_bulk.streaming_bulk(arguments.es, generator)
                
             FMT = '%Y-%m-%dT%H:%M:%SGMT'
             start_t = time.strftime('%Y-%m-%dT%H:%M:%SGMT', gmtime(res_beg))
@@ -45,13 +69,16 @@ def main():
 
 def process_data_generator(test_id):
     
-    object_generator = process_data(test_id)
+    #discover covers the walk and the analyzers, emit everything a transcriber does
+    object_generator = stats.timed_iter("discover", process_data(test_id))
 
     for obj in object_generator:
-        for action in obj.emit_actions():
+        stats.set_context(type(obj).__name__, transcriber_source(obj))
+        for action in stats.timed_iter("emit", obj.emit_actions()):
             #generate index name and id 
             #I.E add elasticsearch specific information to emitted data. 
             yield action
+        stats.set_context("pipeline")
 
 def process_data(test_id):
     test_metadata = {}
@@ -69,7 +96,7 @@ def process_data(test_id):
     test_metadata['ceph_benchmark_test']['common']['test_info']['test_id'] = test_id
     
     #parse cbt achive dir and call process method
-    for dirpath, dirs, files in os.walk("."):
+    for dirpath, dirs, files in stats.timed_iter("walk", os.walk(".")):
         for filename in files:
             fname = os.path.join(dirpath,filename)
             #capture cbt configuration 
@@ -91,6 +118,12 @@ def process_data(test_id):
                     for rados_obj in analyze_cbt_rados_results_generator:
                         yield rados_obj
 
+                #if smallfile test, process data
+                if "smallfile" in cbt_config_gen.config['benchmarks']:
+                    analyze_cbt_smallfile_results_generator = cbt_smallfile_analyzer.analyze_cbt_smallfile_results(dirpath, cbt_config_gen, copy.deepcopy(test_metadata))
+                    for smallfile_obj in analyze_cbt_smallfile_results_generator:
+                        yield smallfile_obj
+
 class argument_handler():
     def __init__(self):
         self.test_id = ""
@@ -100,6 +133,9 @@ class argument_handler():
         self.test_mode = False
         self.output_file=None
         self.verbose=False
+        self.store_file=None
+        self.stats=False
+        self.stats_file=None
         
         usage = """ 
                 Usage:
@@ -109,9 +145,12 @@ class argument_handler():
                     -h or --host - Elasticsearch host ip or hostname
                     -p or --port - Elasticsearch port (elasticsearch default is 9200)
                     -d or --debug - enables debug (verbose) logging output
+                    -s or --store - also keep the summary results in a local sqlite file
+                    --stats - log the time spent in every stage, transcriber and source file
+                    --stats_file - also write that report to this file as json
                 """
         try:
-            opts, _ = getopt.getopt(sys.argv[1:], 't:h:p:o:dvT', ['output_file', 'test_id=', 'host=', 'port=', 'debug', 'test_mode', 'verbose'])
+            opts, _ = getopt.getopt(sys.argv[1:], 't:h:p:o:s:dvT', ['output_file', 'test_id=', 'host=', 'port=', 'store=', 'stats', 'stats_file=', 'debug', 'test_mode', 'verbose'])
         except getopt.GetoptError:
             print (usage) 
             exit(1)
@@ -131,6 +170,13 @@ class argument_handler():
                 self.log_level = logging.DEBUG
             if opt in ('-v', '--verbose'):
                 self.verbose = True
+            if opt in ('-s', '--store'):
+                self.store_file = arg
+            if opt == '--stats':
+                self.stats = True
+            if opt == '--stats_file':
+                self.stats = True
+                self.stats_file = arg
                            
         setup_loggers("index_cbt", self.log_level)    
         
@@ -1,9 +1,10 @@
 #! /usr/bin/python
 
 import os, sys, json, time, types, csv, copy
-import xmltodict
 import logging
 import datetime
+import multiprocessing, queue
+from collections import Counter
 from time import gmtime, strftime
 from datetime import timedelta
 from elasticsearch import Elasticsearch, helpers
@@ -13,6 +14,7 @@ import getopt
 from proto_py_es_bulk import *
 from scribes import cosbench_scribe
 from utils.common_logging import setup_loggers
+from utils.pipeline_stats import stats as pipeline_stats
 
 logger = logging.getLogger("index_cosbench")
 
@@ -21,56 +23,93 @@ es_log.setLevel(logging.CRITICAL)
 urllib3_log = logging.getLogger("urllib3")
 urllib3_log.setLevel(logging.CRITICAL)
 
-def main():
-    es, test_id, workload_list, test_mode = argument_handler()
-    
-    if test_mode:
+def main(argv=None):
+    arguments = argument_handler(argv)
+    workload_stats = {}
+    if arguments.stats:
+        pipeline_stats.enable()
+        if not arguments.test_mode:
+            pipeline_stats.instrument_client(arguments.es)
+
+    if arguments.jobs > 1:
+        generator = parallel_data_generator(arguments, workload_stats)
+    else:
+        generator = process_data_generator(arguments.test_id, arguments.workload_list, arguments.wide, arguments.archive_dir)
+    generator = count_documents(generator, workload_stats)
+
+    if arguments.test_mode:
         logger.info("***********TEST MODE***********")
-        for i in process_data_generator(test_id, workload_list):
+        for i in generator:
             logger.debug(json.dumps(i, indent=4))
     else:
         try:
-            res_beg, res_end, res_suc, res_dup, res_fail, res_retry  = proto_py_es_bulk.streaming_bulk(es, process_data_generator(test_id, workload_list))
-                 
+            res_beg, res_end, res_suc, res_dup, res_fail, res_retry  = proto_py_es_bulk.streaming_bulk(arguments.es, generator,
+                                                                                                         stats_key=workload_key, key_stats=workload_stats)
+
             FMT = '%Y-%m-%dT%H:%M:%SGMT'
             start_t = time.strftime('%Y-%m-%dT%H:%M:%SGMT', gmtime(res_beg))
             end_t = time.strftime('%Y-%m-%dT%H:%M:%SGMT', gmtime(res_end))
-                 
+
             start_t = datetime.datetime.strptime(start_t, FMT)
             end_t = datetime.datetime.strptime(end_t, FMT)
             tdelta = end_t - start_t
             logger.info("Duration of indexing - %s" % tdelta)
             logger.info("Indexed results - %s success, %s duplicates, %s failures, with %s retries." % (res_suc, res_dup, res_fail, res_retry))
-        except e as exception:
-            logger.error(e.message) 
+        except Exception as e:
+            logger.error(e)
             sys.exit(1)
-    
-def process_data_generator(test_id, workload_list):
-    
-    object_generator = process_data(test_id, workload_list)
-    
+
+    if arguments.stats:
+        pipeline_stats.log_summary(log=logger)
+        if arguments.stats_file:
+            pipeline_stats.write_report(arguments.stats_file)
+
+    for workload, stats in sorted(workload_stats.items()):
+        parse_time = ", parsed in %.2fs" % stats['parse_time'] if stats['parse_time'] else ""
+        logger.info("%s - %s documents%s, %s success, %s duplicates, %s failures, with %s retries." % (
+            workload, stats['documents'], parse_time,
+            stats['successes'], stats['duplicates'], stats['failures'], stats['retries']))
+
+def workload_key(action):
+    #run-history documents do not belong to a single workload
+    return action['_source'].get('Workload', "run-history")
+
+def count_documents(generator, workload_stats):
+    for action in generator:
+        key = workload_key(action)
+        if key not in workload_stats:
+            workload_stats[key] = Counter()
+        workload_stats[key]['documents'] += 1
+        yield action
+
+def process_data_generator(test_id, workload_list, wide=False, archive_dir="."):
+
+    object_generator = process_data(test_id, workload_list, wide, archive_dir)
+
     for obj in object_generator:
-        for action in obj.emit_actions():
+        pipeline_stats.set_context(type(obj).__name__)
+        for action in pipeline_stats.timed_iter("doc_build", obj.emit_actions()):
             yield action
 
-def process_data(test_id, workload_list):
-    if os.path.isfile("run-history.csv"):
-        abspath_runhistory = os.path.abspath("run-history.csv")
-        archive_dir = os.getcwd()
-        
+def process_data(test_id, workload_list, wide=False, archive_dir="."):
+    run_history_file = os.path.join(archive_dir, "run-history.csv")
+    if os.path.isfile(run_history_file):
+        abspath_runhistory = os.path.abspath(run_history_file)
+        archive_dir = os.path.abspath(archive_dir)
+
         cosbench_runhistory_scribe_generator = cosbench_scribe.cosbench_runhistory_transcriber(test_id, abspath_runhistory, workload_list)
         yield cosbench_runhistory_scribe_generator
-        
+
         cosbench_workload_scribe_generoator = cosbench_scribe.cosbench_workload_transcriber(test_id, archive_dir, workload_list)
         yield cosbench_workload_scribe_generoator
- 
+
         workstage_doc = cosbench_workload_scribe_generoator.ws_doc
         logger.debug(json.dumps(workstage_doc, indent=4))
-        
-        workload_doc_list = cosbench_workload_scribe_generoator.workload_doc_list
-        logger.debug(json.dumps(workload_doc_list, indent=4))
-        
-        cosbench_stage_scribe_generator = cosbench_scribe.cosbench_stage_transcriber(test_id, workstage_doc, workload_doc_list)
+
+        stage_index = cosbench_workload_scribe_generoator.stage_index
+        logger.debug("%s workload stages indexed" % len(stage_index))
+
+        cosbench_stage_scribe_generator = cosbench_scribe.cosbench_stage_transcriber(test_id, workstage_doc, stage_index, wide, archive_dir)
         yield cosbench_stage_scribe_generator
 
 
@@ -78,67 +117,197 @@ def process_data(test_id, workload_list):
         logger.error("Unable to find run-history")
         sys.exit(1)
 
-def argument_handler():
-    log_level = logging.INFO   
-    test_id = ""
-    host = ""
-    port = ""
-    workload_list = []
-    test_mode=False
-    output_file=None
-
-    usage = """ 
-            Usage:
-                index_cosbench.py -t <test id> -h <host> -p <port> -w <1,2,3,4-8,45,50-67>
-                
-                -t or --test_id - test identifier
-                -h or --host - Elasticsearch host ip or hostname
-                -p or --port - Elasticsearch port (elasticsearch default is 9200)
-                -w or --workloads - a list of workloads that should be imported 
-            """
+def process_workload(test_id, archive_dir, wdirID, wdir, wide):
+    #everything one workload directory contributes: its csv, xml and stage csvs
+    workload_scribe = cosbench_scribe.cosbench_workload_transcriber(test_id, archive_dir, [wdirID], [(wdirID, wdir)])
+    pipeline_stats.set_context(type(workload_scribe).__name__, wdir)
+    for action in pipeline_stats.timed_iter("doc_build", workload_scribe.emit_actions()):
+        yield action
+
+    stage_scribe = cosbench_scribe.cosbench_stage_transcriber(test_id, workload_scribe.ws_doc, workload_scribe.stage_index, wide, archive_dir)
+    pipeline_stats.set_context(type(stage_scribe).__name__, wdir)
+    for action in pipeline_stats.timed_iter("doc_build", stage_scribe.emit_actions()):
+        yield action
+
+def workload_worker(task_queue, result_queue, chunk_size, collect_stats=False):
+    if collect_stats:
+        pipeline_stats.enable()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        test_id, archive_dir, wdirID, wdir, wide = task
+
+        #the stage timings of every workload go back to the parent with its last chunk
+        pipeline_stats.reset()
+        start = time.time()
+        chunk = []
+        try:
+            for action in process_workload(test_id, archive_dir, wdirID, wdir, wide):
+                chunk.append(action)
+                if len(chunk) >= chunk_size:
+                    result_queue.put((wdir, chunk, None, None))
+                    chunk = []
+        except Exception as e:
+            logger.error("Failed to process workload %s: %s" % (wdir, e))
+        stage_stats = pipeline_stats.snapshot() if collect_stats else None
+        result_queue.put((wdir, chunk, {"parse_time": time.time() - start}, stage_stats))
+
+#seconds between checks that the workers are still alive
+worker_poll_interval = 5
+
+def parallel_data_generator(arguments, workload_stats, chunk_size=1000):
+    #each workload directory is parsed in its own worker, the actions come
+    #back in chunks over a bounded queue and are merged into one stream
+    archive_dir = os.path.abspath(arguments.archive_dir)
+    run_history_file = os.path.join(archive_dir, "run-history.csv")
+    if not os.path.isfile(run_history_file):
+        logger.error("Unable to find run-history")
+        sys.exit(1)
+
+    runhistory_scribe = cosbench_scribe.cosbench_runhistory_transcriber(arguments.test_id, run_history_file, arguments.workload_list)
+    pipeline_stats.set_context(type(runhistory_scribe).__name__)
+    for action in pipeline_stats.timed_iter("doc_build", runhistory_scribe.emit_actions()):
+        yield action
+
+    workload_dirs = cosbench_scribe.find_workload_dirs(archive_dir, arguments.workload_list)
+    jobs = min(arguments.jobs, len(workload_dirs))
+    if not jobs:
+        logger.warn("No workload directories found in %s" % archive_dir)
+        return
+
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue(jobs * 4)
+    for wdirID, wdir in workload_dirs:
+        task_queue.put((arguments.test_id, archive_dir, wdirID, wdir, arguments.wide))
+    for _ in range(jobs):
+        task_queue.put(None)
+
+    logger.info("Processing %s workloads with %s workers" % (len(workload_dirs), jobs))
+    worker_list = [multiprocessing.Process(target=workload_worker, args=(task_queue, result_queue, chunk_size, pipeline_stats.enabled))
+                   for _ in range(jobs)]
+    for worker in worker_list:
+        worker.daemon = True
+        worker.start()
+
+    remaining = len(workload_dirs)
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], 't:h:p:w:o:dT', ['test_id=', 'host=', 'port=', 'workloads', 'debug', 'output_file' , 'test_mode'])
-    except getopt.GetoptError:
-        sys.exit(2)
-
-    for opt, arg in opts:
-        if opt in ('-t', '--test_id'):
-            test_id = arg
-        if opt in ('-h', '--host'):
-            host = arg
-        if opt in ('-p', '--port'):
-            esport = arg
-        if opt in ('-T', '--test_mode'):
-            test_mode = True
-        if opt in ('-o', '--output_file'):
-            output_file = arg
-        if opt in ('-d', '--debug'):
-            log_level = logging.DEBUG
-        if opt in ('-w', '--workloads'):
-            tmp_list = arg.split(',')
-            for i in tmp_list:
-                if "-" in i:
-                    a, b = i.split("-")
-                    for x in xrange(int(a), int(b)+1):
-                        workload_list.append(x)
-                else:
-                    workload_list.append(int(i))
-        
-    setup_loggers("index_cosbench", log_level, output_file)
-
-    if host and test_id and esport and workload_list:
-        logger.info("Test ID: %s, Host: %s, Port: %s " % (test_id, host, esport))
-    else:
-        logger.info(usage)
-        exit (1)
+        while remaining:
+            try:
+                wdir, chunk, stats, stage_stats = result_queue.get(timeout=worker_poll_interval)
+            except queue.Empty:
+                #a worker killed by a signal or the oom killer never sends its last chunk
+                dead_workers = [worker for worker in worker_list if worker.exitcode not in (None, 0)]
+                if dead_workers or not any(worker.is_alive() for worker in worker_list):
+                    raise RuntimeError("%s workload(s) unfinished, worker exit codes: %s" % (
+                        remaining, ", ".join(str(worker.exitcode) for worker in worker_list)))
+                continue
+            for action in chunk:
+                yield action
+            if stats is not None:
+                remaining -= 1
+                workload_stats.setdefault(wdir, Counter()).update(stats)
+                if stage_stats is not None:
+                    pipeline_stats.merge(stage_stats)
+    finally:
+        for worker in worker_list:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+
+def parse_workload_list(arg):
+    workload_list = []
+    tmp_list = arg.split(',')
+    for i in tmp_list:
+        if "-" in i:
+            a, b = i.split("-")
+            for x in range(int(a), int(b)+1):
+                workload_list.append(x)
+        else:
+            workload_list.append(int(i))
+    return workload_list
+
+class argument_handler():
+    def __init__(self, argv=None):
+        self.log_level = logging.INFO
+        self.test_id = ""
+        self.host = ""
+        self.esport = ""
+        self.workload_list = None
+        self.archive_dir = "."
+        self.jobs = 1
+        self.test_mode = False
+        self.wide = False
+        self.output_file = None
+        self.stats = False
+        self.stats_file = None
+        self.es = None
+
+        usage = """
+                Usage:
+                    index_cosbench.py -t <test id> -h <host> -p <port> -w <1,2,3,4-8,45,50-67>
+
+                    -t or --test_id - test identifier
+                    -h or --host - Elasticsearch host ip or hostname
+                    -p or --port - Elasticsearch port (elasticsearch default is 9200)
+                    -w or --workloads - a list of workloads that should be imported (default is every workload in the archive)
+                    -a or --archive_dir - cosbench archive directory (default is current working directory)
+                    -j or --jobs - number of workloads processed in parallel (default 1)
+                    -W or --wide - one stage document per timestamp, with the metrics grouped by op-type
+                    -T or --test_mode - log the documents instead of indexing them
+                    --stats - log the time spent in every stage and transcriber, across all workers
+                    --stats_file - also write that report to this file as json
+                    -d or --debug - enables debug (verbose) logging output
+                """
+        try:
+            opts, _ = getopt.getopt(sys.argv[1:] if argv is None else argv, 't:h:p:w:a:j:o:dTW',
+                                    ['test_id=', 'host=', 'port=', 'workloads=', 'archive_dir=', 'jobs=', 'debug', 'output_file=', 'test_mode', 'wide',
+                                     'stats', 'stats_file='])
+        except getopt.GetoptError:
+            print (usage)
+            sys.exit(2)
+
+        for opt, arg in opts:
+            if opt in ('-t', '--test_id'):
+                self.test_id = arg
+            if opt in ('-h', '--host'):
+                self.host = arg
+            if opt in ('-p', '--port'):
+                self.esport = arg
+            if opt in ('-T', '--test_mode'):
+                self.test_mode = True
+            if opt in ('-o', '--output_file'):
+                self.output_file = arg
+            if opt in ('-d', '--debug'):
+                self.log_level = logging.DEBUG
+            if opt in ('-W', '--wide'):
+                self.wide = True
+            if opt in ('-a', '--archive_dir'):
+                self.archive_dir = arg
+            if opt in ('-j', '--jobs'):
+                self.jobs = max(1, int(arg))
+            if opt in ('-w', '--workloads'):
+                self.workload_list = parse_workload_list(arg)
+            if opt == '--stats':
+                self.stats = True
+            if opt == '--stats_file':
+                self.stats = True
+                self.stats_file = arg
+
+        setup_loggers("index_cosbench", self.log_level, self.output_file)
 
-    es = Elasticsearch(
-        [host],
-        scheme="http",
-        port=esport,
-        ) 
+        if self.test_id and (self.test_mode or (self.host and self.esport)):
+            logger.info("Test ID: %s, Host: %s, Port: %s " % (self.test_id, self.host, self.esport))
+        else:
+            logger.info(usage)
+            exit (1)
 
-    return es, test_id, workload_list, test_mode
+        if not self.test_mode:
+            self.es = Elasticsearch(
+                [self.host],
+                scheme="http",
+                port=self.esport,
+                )
 
 
 if __name__ == '__main__':
@@ -1,25 +1,31 @@
 #! /usr/bin/python
 
-import yaml, os, time, json, hashlib, paramiko, ast, sys
-import socket, datetime, logging, rados, ipaddress, getopt
-import multiprocessing
-from paramiko import SSHClient
+import yaml, os, time, json, hashlib, sys, gzip
+import socket, datetime, logging, ipaddress, getopt
+import multiprocessing, queue, threading
 from datetime import date
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import remote_session
+from utils.perf_counters import counter_processor, histogram_processor, admin_socket_script, parse_admin_socket_frames
+from utils.ceph_client import ceph_client
+
+logger = logging.getLogger("index_cbt")
+
+try:
+    from elasticsearch import Elasticsearch
+    from proto_py_es_bulk import *
+except ImportError:
+    Elasticsearch = None
+
 def main():
 #    setup_loggers("index_perf_dump", logging.DEBUG)
     arguments = argument_handler()
     #setup client connection to ceph
     acitve_ceph_client = ceph_client()
-    #setup ssh remote command 
-    remoteclient = ssh_remote_command()
-    
     #get metadata list of all osds
     osd_metadata_list = acitve_ceph_client.issue_command("osd metadata")
     
-    start_time = datetime.datetime.now() 
-    elapsed_time = 0 
-    
     host_list = []
     osd_host_dict = {}
     #create mapping of each osd and the host it is deployed on
@@ -33,152 +39,391 @@ def main():
 
 #########
             
-    #for each host run the collect measurement method
-    td_duration = datetime.timedelta(seconds=arguments.duration)
-    print (td_duration.seconds)
-
-    manager = multiprocessing.Manager()
-    return_list = manager.list()
-
-    monitor_status = True
-    while monitor_status:
-        collection_time = datetime.datetime.now()
-#        elapsed_time = collection_time - start_time
-        print (elapsed_time)
-        
-        #For each host spwan a subprocess and retrive perf dump
-        process_list = []
-        for host in osd_host_dict:
-            p = multiprocessing.Process(target=collect_measurement, args=(remoteclient, host, osd_host_dict[host], return_list))
-            process_list.append(p)
+    #for each host start a collector that lives for the whole run
+    result_queue = multiprocessing.Queue()
+    collector_dict = {}
+    for host in osd_host_dict:
+        collector = host_collector(host, osd_host_dict[host], result_queue,
+                                   raw=arguments.raw, whitelist=arguments.whitelist, histograms=arguments.histograms)
+        collector.start()
+        collector_dict[host] = collector
 
-        for process in process_list:
-            process.start()
+    #samples are written out as they arrive instead of being held until the end
+    output = sample_writer(arguments.output_dir, max_file_size=arguments.max_file_size)
+    if arguments.es is not None:
+        output = sample_tee([output, es_sink(arguments.es)])
 
-        for process in process_list:
-            process.join()
+    scheduler = sample_scheduler(arguments.sample_period, arguments.duration)
+    while True:
+        tick = scheduler.next_tick()
+        if tick is None:
+            print ("all done monitoring")
+            break
+        tick_id, scheduled_time = tick
 
-       # print "finished collecting sample"
-        collection_delta_time = datetime.datetime.now() - collection_time
-        
-        #collection period - collection time delta
-        remainder = datetime.timedelta(seconds=arguments.sample_period) - collection_delta_time
-        elapsed_time = datetime.datetime.now() - start_time
-
-        print ("going to sleep for %s seconds" % remainder.seconds)
-        if remainder.seconds < 0:
-            print ("taking too ling")
-            time.sleep(remainder.seconds)
-        else:
-            time.sleep(remainder.seconds) #time_interval
+        #results are picked up as they arrive until the tick is due
+        finished_hosts = receive_results(result_queue, collector_dict, output, scheduled_time)
+        check_collectors(collector_dict, finished_hosts, result_queue)
 
-        #if the elapsed time is greater than the specified duration quit. 
-        if elapsed_time.seconds > td_duration.seconds:
-            print ("all done monitoring")
-            monitor_status = False
+        #signal every collector, they all sample at the same time. a collector
+        #still working on an earlier tick is not queued another one, the
+        #missed tick is coalesced into the one it is already collecting
+        scheduled_date = scheduler.wall_time(scheduled_time)
+        for host, collector in collector_dict.items():
+            if collector.pending_tick is not None:
+                collector.overruns += 1
+                logger.warn("%s is still collecting tick %s, skipping tick %s" % (host, collector.pending_tick, tick_id))
+                continue
+            collector.tick(tick_id, scheduled_date)
+
+    stop_collectors(collector_dict, result_queue, output)
+
+    print ("%s ticks scheduled, %s skipped by the scheduler" % (scheduler.tick_count, scheduler.skipped_ticks))
+    for host, collector in sorted(collector_dict.items()):
+        if collector.overruns:
+            print ("%s overran %s ticks" % (host, collector.overruns))
+
+    output.close()
+
+class sample_writer():
+    #newline delimited json, gzip compressed. the file is flushed after every
+    #batch so a crash loses at most the batch being written, and a new file
+    #is started once max_file_size bytes of json have gone into the current one
+    def __init__(self, output_dir, prefix="ceph-osd-perf-dump", max_file_size=256 * 1024 * 1024):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_file_size = max_file_size
+        self.run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.file_index = 0
+        self.file = None
+        self.file_size = 0
+        self.sample_count = 0
+
+    def open_next(self):
+        if self.file is not None:
+            self.file.close()
+        file_name = os.path.join(self.output_dir, "%s-%s-%03d.ndjson.gz" % (self.prefix, self.run_id, self.file_index))
+        logger.info("writing samples to %s" % file_name)
+        self.file = gzip.open(file_name, 'wb')
+        self.file_index += 1
+        self.file_size = 0
+
+    def write(self, sample_list):
+        if self.file is None or self.file_size >= self.max_file_size:
+            self.open_next()
+        for sample in sample_list:
+            line = (json.dumps(sample["_source"]) + "\n").encode('utf-8')
+            self.file.write(line)
+            self.file_size += len(line)
+        self.file.flush()
+        self.sample_count += len(sample_list)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        print ("%s samples written to %s file(s)" % (self.sample_count, self.file_index))
+
+class es_sink():
+    #feeds samples to proto_py_es_bulk.streaming_bulk from a background thread,
+    #the bounded queue keeps memory flat if elasticsearch falls behind. write
+    #runs on the scheduler's thread, so samples that don't fit are dropped
+    #rather than waited on
+    def __init__(self, es, max_pending=10000):
+        self.es = es
+        self.pending = queue.Queue(max_pending)
+        self.dropped = 0
+        self.result = None
+        self.thread = threading.Thread(target=self.run, name="es_sink")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def generator(self):
+        while True:
+            sample = self.pending.get()
+            if sample is None:
+                break
+            yield sample
+
+    def run(self):
+        try:
+            self.result = proto_py_es_bulk.streaming_bulk(self.es, self.generator())
+        except Exception as e:
+            logger.error("Indexing samples into elasticsearch failed: %s" % e)
+            #keep draining so the monitor is never blocked on a dead sink
+            for sample in self.generator():
+                self.dropped += 1
+
+    def write(self, sample_list):
+        for sample in sample_list:
+            try:
+                self.pending.put_nowait(sample)
+            except queue.Full:
+                self.dropped += 1
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        if self.result is not None:
+            beg, end, suc, dup, fail, retry = self.result
+            print ("indexed %s samples, %s duplicates, %s failed, %s retries" % (suc, dup, fail, retry))
+        if self.dropped:
+            logger.warn("%s samples were not sent to elasticsearch" % self.dropped)
+
+class sample_tee():
+    def __init__(self, output_list):
+        self.output_list = output_list
+
+    def write(self, sample_list):
+        for output in self.output_list:
+            output.write(sample_list)
+
+    def close(self):
+        for output in self.output_list:
+            output.close()
+
+class sample_scheduler():
+    #ticks are due at absolute offsets from the start on the monotonic clock,
+    #so a late tick never pushes the following ones back. ticks that were
+    #missed completely are skipped rather than fired back to back
+    def __init__(self, sample_period, duration):
+        self.sample_period = sample_period
+        self.duration = duration
+        self.start_monotonic = time.monotonic()
+        self.start_wall = time.time()
+        self.tick_id = 0
+        self.tick_count = 0
+        self.skipped_ticks = 0
+
+    def wall_time(self, monotonic_time):
+        return self.start_wall + (monotonic_time - self.start_monotonic)
+
+    def next_tick(self):
+        offset = self.tick_id * self.sample_period
+        now = time.monotonic() - self.start_monotonic
+        if now - offset >= self.sample_period:
+            missed = int((now - offset) // self.sample_period)
+            logger.warn("scheduler fell behind, skipping %s ticks" % missed)
+            self.skipped_ticks += missed
+            self.tick_id += missed
+            offset = self.tick_id * self.sample_period
+
+        if offset > self.duration:
+            return None
+        tick = (self.tick_id, self.start_monotonic + offset)
+        self.tick_id += 1
+        self.tick_count += 1
+        return tick
+
+def receive_results(result_queue, collector_dict, output, until):
+    finished_hosts = []
+    while True:
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            host, tick_id, sample_list = result_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if tick_id is None:
+            finished_hosts.append(host)
         else:
-            print ("keep on monitoring")
+            if host in collector_dict:
+                collector_dict[host].pending_tick = None
+            output.write(sample_list)
+    return finished_hosts
 
-    f = open("ceph-osd-perf-dump.txt", 'w')
-    f.write(json.dumps(list(return_list), indent=1))
-    f.close()
+def check_collectors(collector_dict, finished_hosts, result_queue, max_restarts=3):
+    #a collector that raised reports itself finished, one killed by a signal or
+    #the oom killer just goes away. either way its pending tick never completes,
+    #so it is started again, and given up on after max_restarts
+    for host, collector in list(collector_dict.items()):
+        if host in finished_hosts:
+            collector.join(0.1)
+        if collector.is_alive():
+            continue
+        logger.error("collector for %s stopped with exit code %s while collecting tick %s" % (
+            host, collector.exitcode, collector.pending_tick))
+        if collector.restarts >= max_restarts:
+            logger.error("no more samples will be collected from %s, its collector failed %s times" % (host, collector.restarts + 1))
+            del collector_dict[host]
+            continue
+        replacement = host_collector(host, collector.osd_list, result_queue,
+                                     raw=collector.raw, whitelist=collector.whitelist, histograms=collector.histograms)
+        replacement.restarts = collector.restarts + 1
+        replacement.overruns = collector.overruns
+        replacement.start()
+        collector_dict[host] = replacement
 
-    
-def collect_measurement(remoteclient, host, osd_list, return_list):
-    print ("started collection") 
-    perf_dump_data = {
-            "_index": "ceph_perf_dump_data_index",
-            "_type": "ceph_perf_dump_data",
-            "_op_type": "create",
-            "_source": {}
-            }
-    
-    print ("working on host %s " % host)
-        #collect the performance measurements 
+def stop_collectors(collector_dict, result_queue, output, timeout=60):
+    for collector in collector_dict.values():
+        collector.stop()
+
+    #keep the results still in flight, each collector reports when it is done
+    running = set(collector_dict)
+    deadline = time.monotonic() + timeout
+    while running and time.monotonic() < deadline:
+        for host in receive_results(result_queue, collector_dict, output, min(deadline, time.monotonic() + 0.1)):
+            running.discard(host)
+
+    for collector in collector_dict.values():
+        collector.join(1)
+        if collector.is_alive():
+            logger.warn("collector for %s did not stop, terminating it" % collector.host)
+            collector.terminate()
+
+class host_collector(multiprocessing.Process):
+    #one long lived worker per osd host, the remote connection is opened once
+    #and reused on every tick instead of being set up again each period
+    def __init__(self, host, osd_list, result_queue, raw=False, whitelist=None, histograms=False):
+        multiprocessing.Process.__init__(self, name="collector-%s" % host)
+        self.daemon = True
+        self.host = host
+        self.osd_list = osd_list
+        self.raw = raw
+        self.whitelist = whitelist
+        self.histograms = histograms
+        self.tick_queue = multiprocessing.Queue()
+        self.result_queue = result_queue
+        #bookkeeping for the scheduler, only used in the parent process
+        self.pending_tick = None
+        self.overruns = 0
+        self.restarts = 0
+
+    def tick(self, tick_id, scheduled_date):
+        self.pending_tick = tick_id
+        self.tick_queue.put((tick_id, scheduled_date, self.overruns))
+
+    def stop(self):
+        self.tick_queue.put(None)
+
+    def run(self):
+        remoteclient = ssh_remote_command()
+        #each osd lives on exactly one host, so its previous sample can stay here
+        processor = None if self.raw else counter_processor(self.whitelist)
+        hist_processor = histogram_processor(self.whitelist) if self.histograms and not self.raw else None
+        try:
+            while True:
+                tick = self.tick_queue.get()
+                if tick is None:
+                    break
+                tick_id, scheduled_date, overruns = tick
+                sample_list = collect_measurement(remoteclient, self.host, self.osd_list, tick_id, scheduled_date, overruns, processor, hist_processor)
+                self.result_queue.put((self.host, tick_id, sample_list))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            remoteclient.close()
+            self.result_queue.put((self.host, None, None))
+
+def format_date(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def collect_measurement(remoteclient, host, osd_list, tick_id, scheduled_date, overruns, processor=None, hist_processor=None):
+    sample_list = []
+    #the schema tells counters apart from gauges, it is fetched once per osd
+    request_list = []
     for osd in osd_list:
-        
-        perf_dump = remoteclient.issue_command(host, "ceph daemon osd.%s perf dump" % osd)
-        tmp_doc = { "data": perf_dump }
-        collection_time = datetime.datetime.now()
-        tmp_doc["date"] = collection_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        if processor is not None and not processor.has_schema(osd):
+            request_list.append((osd, "perf schema"))
+        request_list.append((osd, "perf dump"))
+        if hist_processor is not None:
+            request_list.append((osd, "perf histogram dump"))
+
+    #one remote call returns the dumps of every osd on the host
+    frames = remoteclient.collect(host, request_list)
+    collection_time = time.time()
+
+    for osd in osd_list:
+        if processor is not None and not processor.has_schema(osd):
+            processor.set_schema(osd, frames.get((str(osd), "perf schema")))
+
+        perf_dump = frames.get((str(osd), "perf dump"))
+        histograms = None
+        if hist_processor is not None:
+            #processed before the counters so the first tick sets its baseline too
+            histograms = hist_processor.process(osd, frames.get((str(osd), "perf histogram dump")))
+        if processor is None:
+            index = "ceph_perf_dump_data"
+            tmp_doc = { "data": perf_dump }
+        else:
+            if perf_dump is None:
+                continue
+            index = "ceph_perf_counter_data"
+            tmp_doc = processor.process(osd, perf_dump, collection_time)
+            if tmp_doc is None:
+                continue
+            if histograms:
+                tmp_doc["histograms"] = histograms
+        tmp_doc["date"] = format_date(collection_time)
+        tmp_doc["scheduled_date"] = format_date(scheduled_date)
+        tmp_doc["collection_lag"] = collection_time - scheduled_date
+        tmp_doc["tick"] = tick_id
+        tmp_doc["overruns"] = overruns
         tmp_doc["hostname"] = host
         tmp_doc["osd_id"] = osd
-        perf_dump_data["_source"] = tmp_doc
-        return_list.append(perf_dump_data)
+        perf_dump_data = {
+            "_index": "%s_index" % index,
+            "_type": index,
+            "_op_type": "create",
+            "_source": tmp_doc
+            }
+        perf_dump_data["_id"] = hashlib.md5(str(perf_dump_data).encode()).hexdigest()
+        sample_list.append(perf_dump_data)
+    return sample_list
 
 class ssh_remote_command():
     def __init__(self):
-          self.sshclient = SSHClient()
+          self.session_pool = remote_session.remote_session_pool(username="root")
     
     def issue_command(self, host, command):
-        combinded_ouput = []
-        try:
-            self.sshclient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key_path = os.path.expanduser("~/.ssh/authorized_keys")
-            self.sshclient.connect(host, username="root", key_filename=key_path)
-            stdin, stdout, stderr = self.sshclient.exec_command(command)
-            
-            output = stdout.readlines()
-
-            for line in output:
-                combinded_ouput.append(line.strip())
-            
-            newstuff = ''.join(combinded_ouput)
-            self.sshclient.close()
-            brandnewstuff = ast.literal_eval(newstuff)
-            return brandnewstuff
-        
-        except Exception as e:
-            self.sshclient.close()
-            logger.warn("Connection Failed: %s" % e)
-    
-class ceph_client():
-    def __init__(self):
-        
-        self.Connection_status = False
-        
-        if not os.path.isfile("/etc/ceph/ceph.conf"):
-            logger.warn("/etc/ceph/ceph.conf not found!")
-        elif not os.path.isfile("/etc/ceph/ceph.client.admin.keyring"):
-            logger.warn("/etc/ceph/ceph.client.admin.keyring not found!")
-        else:
-            self.cluster = rados.Rados(conffile="/etc/ceph/ceph.conf",
-                                       conf=dict(keyring='/etc/ceph/ceph.client.admin.keyring'),
-                                       )
-            try:
-                self.cluster.connect(timeout=1)
-                self.Connection_status = True
-            except Exception as e:
-                logger.warn("Connection error: %s" % e.message )
-            
-                
-            self.osd_host_list = []
-            self.osd_list = []
+        output = self.session_pool.issue_command(host, command)
+        if output is None:
+            return None
         
-    def issue_command(self, command):
-        cmd = json.dumps({"prefix": command, "format": "json"})
         try:
-            _, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
-            return json.loads(output)
-        except Exception as e:
-            logger.error("Error issuing command, %s" % command)
+            return json.loads("".join(output))
+        except ValueError as e:
+            logger.warn("Unable to parse output from %s: %s" % (host, e))
+
+    def collect(self, host, request_list):
+        output = self.session_pool.issue_command(host, admin_socket_script(request_list), label="perf")
+        if output is None:
+            return {}
+        return parse_admin_socket_frames(output, host)
+
+    def close(self):
+        self.session_pool.close()
     
 class argument_handler():
     def __init__(self):
         self.duration = 0
         self.sample_period = 0
-        self.output_file=None
+        self.output_dir = "./"
+        self.max_file_size = 256 * 1024 * 1024
+        self.host = ""
+        self.esport = ""
+        self.es = None
+        self.raw = False
+        self.whitelist = None
+        self.histograms = False
         
         usage = """ 
                 Usage:
-                    index_cbt.py -t <test id> -h <host> -p <port>
+                    perf_dump_monitor.py -d <duration> -s <sample period> [-o <output dir>] [-h <host> -p <port>]
                     
                     -d or --duration - test duration
                     -s or --sample_period - sample period 
                     -o or --output_dir - output directory (default is current working directory)
+                    -m or --max_file_size - MB of samples per output file before a new one is started (default 256)
+                    -h or --host - Elasticsearch host ip or hostname, samples are indexed as they are collected
+                    -p or --port - Elasticsearch port (elasticsearch default is 9200)
+                    -w or --whitelist - comma separated counters to keep, e.g. "osd.op_*,bluestore.*_lat"
+                    -r or --raw - store the complete perf dump of every sample instead of per interval rates
+                    -H or --histograms - also collect "perf histogram dump", stored as sparse per interval histograms with percentiles (not with --raw)
                 """
         try:
-            opts, _ = getopt.getopt(sys.argv[1:], 'd:s:o:', ['output_file', 'duration=', 'sample_period_'])
+            opts, _ = getopt.getopt(sys.argv[1:], 'd:s:o:m:h:p:w:rH', ['output_dir=', 'duration=', 'sample_period=', 'max_file_size=', 'host=', 'port=', 'whitelist=', 'raw', 'histograms'])
         except getopt.GetoptError:
             print (usage) 
             exit(1)
@@ -186,10 +431,28 @@ class argument_handler():
         for opt, arg in opts:
             if opt in ('-d', '--duration'):
                 self.duration = int(arg)
-            if opt in ('-s', '--sample'):
-                self.sample_period = int(arg)
+            if opt in ('-s', '--sample_period'):
+                self.sample_period = float(arg)
             if opt in ('-o', '--output_dir'):
-                self.output_dir = "./"
+                self.output_dir = arg
+            if opt in ('-m', '--max_file_size'):
+                self.max_file_size = int(arg) * 1024 * 1024
+            if opt in ('-h', '--host'):
+                self.host = arg
+            if opt in ('-p', '--port'):
+                self.esport = arg
+            if opt in ('-w', '--whitelist'):
+                self.whitelist = [pattern.strip() for pattern in arg.split(",") if pattern.strip()]
+            if opt in ('-r', '--raw'):
+                self.raw = True
+            if opt in ('-H', '--histograms'):
+                self.histograms = True
+
+        #histograms are only turned into per interval documents, raw mode stores perf dump as is
+        if self.raw and self.histograms:
+            print(usage)
+            print ("--raw and --histograms can not be used together")
+            exit (1)
         
         if self.duration and self.sample_period:
             print("monitoring duration %s, Sample Period, %s" % (self.duration, self.sample_period))
@@ -198,6 +461,16 @@ class argument_handler():
             print (self.duration, self.sample_period)
     #        print "Invailed arguments:\n \tevaluatecosbench_pushes.py -t <test id> -h <host> -p <port> -w <1,2,3,4-8,45,50-67>"
             exit (1)
+
+        if self.host:
+            if Elasticsearch is None:
+                print ("elasticsearch is not available, samples will only be written to %s" % self.output_dir)
+            else:
+                self.es = Elasticsearch(
+                    [self.host],
+                    scheme="http",
+                    port=self.esport or 9200,
+                    )
     
 
         
@@ -5,6 +5,7 @@ from random import SystemRandom
 from collections import deque, Counter
 from elasticsearch import Elasticsearch, helpers
 import time, logging, json
+from utils.pipeline_stats import stats, client_context
 
 logger = logging.getLogger("index_cbt")
 
@@ -22,7 +23,7 @@ def tstos(ts=None):
     return time.strftime("%Y-%m-%dT%H:%M:%S-%Z", time.gmtime(ts))
     
 
-def streaming_bulk(es, actions):
+def streaming_bulk(es, actions, stats_key=None, key_stats=None):
     
     
     """
@@ -31,6 +32,10 @@ def streaming_bulk(es, actions):
          es - An Elasticsearch client object already constructed
         actions - An iterable for the documents to be indexed
         errorsfp - A file pointer for where to write 400 errors
+        stats_key - optional function of an action, the outcome of each
+        action is also counted under its key in key_stats
+        key_stats - dict filled with a Counter of successes, duplicates,
+        failures and retries per key
      Returns:
          A tuple with the start and end times, the # of successfully indexed,
         duplicate, and failed documents, along with number of times a bulk
@@ -88,7 +93,8 @@ def streaming_bulk(es, actions):
             # start yielding those actions until we drain the retry queue.
             backoff = 1
             while len(actions_retry_deque) > 0:
-                time.sleep(calc_backoff_sleep(backoff))
+                with stats.timer("retry_wait", context=client_context):
+                    time.sleep(calc_backoff_sleep(backoff))
                 retries_tracker['retries'] += 1
                 ## log ouput retries_tracker['retries']
                 logger.debug(json.dumps(retries_tracker['retries'], indent=1))
@@ -105,6 +111,8 @@ def streaming_bulk(es, actions):
                 # pounding on the ES instance.
                 backoff += 1
             
+    if stats_key is not None and key_stats is None:
+        key_stats = {}
     beg, end = time.time(), None
     successes = 0
     duplicates = 0
@@ -119,6 +127,13 @@ def streaming_bulk(es, actions):
            es, generator,chunk_size=100000, max_chunk_bytes=1048576, thread_count=8, raise_on_error=False,
            raise_on_exception=False, request_timeout=_request_timeout)
 
+    def count(action, outcome):
+        if stats_key is not None:
+            key = stats_key(action)
+            if key not in key_stats:
+                key_stats[key] = Counter()
+            key_stats[key][outcome] += 1
+
     for ok, resp_payload in streaming_bulk_generator:
        retry_count, action = actions_deque.popleft()
        try:
@@ -133,6 +148,7 @@ def streaming_bulk(es, actions):
 #            assert action['_id'] == resp['_id']
        if ok:
            successes += 1
+           count(action, 'successes')
        else:
            if status == 409:
                if retry_count == 0:
@@ -140,9 +156,11 @@ def streaming_bulk(es, actions):
                    #logger.debug("Duplicate record detected.")
                    #logger.debug(json.dumps(action, indent=1))
                    duplicates += 1
+                   count(action, 'duplicates')
                else:
                    # ... otherwise consider it successful.
                    successes += 1
+                   count(action, 'successes')
            elif status == 400:
                doc = {
                         "action": action,
@@ -155,10 +173,12 @@ def streaming_bulk(es, actions):
                logger.error(jsonstr)
 #              errorsfp.flush()
                failures += 1
+               count(action, 'failures')
            else:
                # Retry all other errors
                print(resp)
                actions_retry_deque.append((retry_count + 1, action))
+               count(action, 'retries')
     end = time.time()
     assert len(actions_deque) == 0
     assert len(actions_retry_deque) == 0
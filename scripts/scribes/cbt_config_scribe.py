@@ -1,30 +1,37 @@
 
 import yaml, os, time, json, hashlib
 import socket, datetime, logging, ipaddress
-import subprocess
+import subprocess, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from elasticsearch.client.remote import RemoteClient
+from utils import remote_session, host_inventory, host_directory, host_map_cache
+from utils.ceph_client import ceph_client
+from utils.pipeline_stats import stats
 
 logger = logging.getLogger("index_cbt")
 
-try: 
-    import paramiko
-    from paramiko import SSHClient
-    import rados
-except:
-    logger.warn("paramiko and rados not available")
-
-
 
 class cbt_config_transcriber:
     
-    def __init__(self, UID, cbt_yaml_config, hostmap=None):
+    def __init__(self, UID, cbt_yaml_config, hostmap=None, discovery_workers=16, host_timeout=120, use_host_map_cache=True, pid_ttl=3600):
         self.UID = UID 
-        self.config = yaml.load(open(cbt_yaml_config))   
+        self.host_map_cache = None
+        if use_host_map_cache:
+            self.host_map_cache = host_map_cache.host_map_cache(pid_ttl=pid_ttl)
+        self.discovery_workers = discovery_workers
+        self.host_timeout = host_timeout
+        self.discovery_failures = {}
+        with open(cbt_yaml_config) as f, stats.timer("yaml_parse", source=cbt_yaml_config):
+            self.config = yaml.safe_load(f)
         self.config_file = cbt_yaml_config
         self.host_map = {}
         self.fqdn_map = {}
         self.cpu_info_map = {}
         self.interface_map = {}
+        self.inventory_map = {}
+        self.remoteclient = None
+        self.build_host_directory()
         
         if 'cbt' in cbt_yaml_config: 
             if hostmap:
@@ -38,6 +45,9 @@ class cbt_config_transcriber:
             
                     
                     self.make_host_map()
+                    self.acitve_ceph_client.log_latency_stats()
+                    self.remoteclient.session_pool.log_stats()
+                    self.remoteclient.session_pool.close()
                 else:
                     logger.warn("Ceph host to role mapping was not performed.")
                 
@@ -47,8 +57,14 @@ class cbt_config_transcriber:
         with open(hostmap_file) as f:
             self.host_map = json.loads(f.read())
         
+        self.build_host_directory()
         #print json.dumps(self.host_map, indent=4)
             
+    def build_host_directory(self):
+        #names used during discovery (e.g. clients from cbt_config.yaml) become aliases
+        self.host_directory = host_directory.host_directory(self.host_map, self.fqdn_map)
+        self.unresolved_hosts = set()
+            
     def set_host_type_list(self):
         
         host_type_list = ""
@@ -61,194 +77,263 @@ class cbt_config_transcriber:
                     
             self.host_map[host]['host_type_list'] = host_type_list
     
-    def get_host_info(self, hostname_or_ip):
+    def resolve_host(self, hostname_or_ip):
+        host = self.host_directory.resolve(hostname_or_ip)
+        if host is not None or hostname_or_ip in self.unresolved_hosts:
+            return host
         
-        empty_dict = {}
-        if self.acitve_ceph_client.Connection_status:
+        #unknown name, ask the host itself for its fqdn once and remember the answer
+        if self.remoteclient is not None:
             host_fqdn = self.get_fqdn(self.remoteclient, hostname_or_ip)
-            if host_fqdn is not None:
-                for host in self.host_map:
-                    if host_fqdn in host:
-                        return self.host_map[host]
-            else: 
-                return empty_dict               
-        else:
-            return empty_dict
+            host = self.host_directory.resolve(host_fqdn)
+            if host is not None:
+                self.host_directory.add_alias(hostname_or_ip, host)
+                return host
+        self.unresolved_hosts.add(hostname_or_ip)
+        return None
+    
+    def get_host_info(self, hostname_or_ip):
+        
+        host = self.resolve_host(hostname_or_ip)
+        if host is None:
+            return {}
+        return self.host_map[host]
         
     def get_host_type(self, host):
         
-        if self.acitve_ceph_client.Connection_status:
-            try:
-                host_fqdn = self.get_fqdn(self.remoteclient, host)
-                host_info = self.get_host_info(host_fqdn)
-                return host_info['host_type_list']
-            except:
-                return "UNKNOWN"
-        else:
-            return "UNKNOWN"
+        host_info = self.get_host_info(host)
+        return host_info.get('host_type_list', "UNKNOWN")
+    
+    def get_service_id(self, host, service_pid):
+        
+        host = self.resolve_host(host)
+        return self.host_directory.get_service_id(host, service_pid)
         
     def make_host_map(self):
-        logger.debug("getting ceph node map")
-        ceph_node_map = self.acitve_ceph_client.issue_command("node ls")
         logger.debug("getting client list")
         client_list = self.config['cluster']['clients']
         
-        ceph_role_list = ['mds', 'mon', 'osd', 'mgr']
-        for role in ceph_role_list:
-            host_role_list = self.acitve_ceph_client.issue_command("%s metadata" % role)
-            #print json.dumps(host_role_list, indent=4)
-            
-            if len(host_role_list) > 0:
-                for role_info in host_role_list:
-                    #logger.debug("host role: %s" % role)
-                    #logger.debug(json.dumps(role_info, indent=1))
-                    #print role_info['hostname']
-                    host_fqdn = self.get_fqdn(self.remoteclient, role_info['hostname'])
-                    
-                    child = {}
-                    child['service_type'] = role
-                    
-#                     if "mon" in role:
-#                         service_id = str(role_info['name'])
-#                     elif "osd" in role or "mgr" in role:
-#                         service_id = str(role_info['id'])
-
-                    if "id" in role_info:
-                        service_id = str(role_info['id'])
-                    elif "name" in role_info:
-                        service_id = str(role_info['name'])
-                    else:
-                        service_id = "UNKNOWN"
-                        
-                    child['service_id'] = service_id
-                    child['service_pid'] = self.get_ceph_service_pid(self.remoteclient, host_fqdn, role, service_id)                
-                    
-                    if host_fqdn not in self.host_map:
-                        self.host_map[host_fqdn] = {}
-                        self.host_map[host_fqdn]['children'] = [] 
-                        #get interface dict
-                        self.host_map[host_fqdn]['interfaces'] = self.get_interfaces(self.remoteclient, host_fqdn)
-                        #get cpuinfo dict
-                        self.host_map[host_fqdn]['cpu_info'] = self.get_cpu_info(self.remoteclient, host_fqdn)
+        layout_unchanged = False
+        if self.host_map_cache is not None:
+            fingerprint = host_map_cache.cluster_fingerprint(self.acitve_ceph_client, client_list)
+            layout_unchanged = self.host_map_cache.load(fingerprint)
+        
+        if layout_unchanged and self.host_map_cache.all_fresh():
+            logger.info("Cluster fingerprint matches the host map cache, skipping discovery")
+            host_daemon_map = OrderedDict(self.host_map_cache.get_daemon_map())
+            client_host_list = self.host_map_cache.get_client_list()
+        else:
+            #group every daemon by the host it reports, discovery is done per host
+            host_daemon_map = OrderedDict()
+            ceph_role_list = ['mds', 'mon', 'osd', 'mgr']
+            role_metadata = self.acitve_ceph_client.issue_commands(["%s metadata" % role for role in ceph_role_list])
+            for role in ceph_role_list:
+                host_role_list = role_metadata["%s metadata" % role]
+                
+                if host_role_list:
+                    for role_info in host_role_list:
+                        if "id" in role_info:
+                            service_id = str(role_info['id'])
+                        elif "name" in role_info:
+                            service_id = str(role_info['name'])
+                        else:
+                            service_id = "UNKNOWN"
                         
+                        host_daemon_map.setdefault(role_info['hostname'], []).append((role, service_id))
+            
+            client_host_list = []
+            if client_list:
+                for client in client_list:
+                    client_host_list.append(client)
+                    host_daemon_map.setdefault(client, [])
+        
+        #only hosts that are new, changed or carry expired pids are rediscovered
+        discovery_results = {}
+        stale_host_list = []
+        for host, daemon_list in host_daemon_map.items():
+            if self.host_map_cache is not None and self.host_map_cache.is_fresh(host, daemon_list, host in client_host_list):
+                discovery_results[host] = self.host_map_cache.get(host)
+            else:
+                stale_host_list.append(host)
+        
+        logger.info("Discovering %s of %s hosts with %s workers" % (len(stale_host_list), len(host_daemon_map), self.discovery_workers))
+        self.discovery_failures = {}
+        pool = ThreadPoolExecutor(max_workers=self.discovery_workers)
+        try:
+            future_map = {}
+            for host in stale_host_list:
+                future = pool.submit(self.discover_host, host, host_daemon_map[host], host in client_host_list)
+                future_map[future] = host
+            
+            for future in as_completed(future_map):
+                host = future_map[future]
+                try:
+                    discovery_results[host] = future.result()
+                except Exception as e:
+                    self.discovery_failures[host] = str(e)
+        finally:
+            pool.shutdown(wait=True)
+        
+        if self.host_map_cache is not None:
+            for host in stale_host_list:
+                if host in discovery_results:
+                    self.host_map_cache.update(host, host_daemon_map[host], host in client_host_list, discovery_results[host])
+            self.host_map_cache.prune(host_daemon_map)
+            self.host_map_cache.save()
+        
+        #merge in the original host order so host_map.json stays stable between runs
+        for host in host_daemon_map:
+            if host not in discovery_results:
+                continue
+            host_fqdn, host_entry, errors = discovery_results[host]
+            if errors:
+                self.discovery_failures[host] = ", ".join(errors)
+            if host_fqdn is None:
+                continue
+            
+            if host_fqdn not in self.host_map:
+                self.host_map[host_fqdn] = host_entry
+            else:
+                for child in host_entry['children']:
                     if child not in self.host_map[host_fqdn]['children']:
                         self.host_map[host_fqdn]['children'].append(child)
-                    
         
-        if client_list:
-            for client in client_list:
-                
-                client_fqdn = self.get_fqdn(self.remoteclient, client)
-                
-                if client_fqdn is not None:
-                    child = {}
-                    child['service_type'] = "client"
-                    child['service_pid'] = "-1"
-                    child['service_id'] = -1
-                        
-                    if client_fqdn not in self.host_map:
-                        self.host_map[client_fqdn] = {}                
-                        self.host_map[client_fqdn]['children'] = []
-                        try:
-                            #get interface dict
-                            self.host_map[client_fqdn]['interfaces'] = self.get_interfaces(self.remoteclient, client_fqdn)
-                            #get cpuinfo dict
-                            self.host_map[client_fqdn]['cpu_info'] = self.get_cpu_info(self.remoteclient, client_fqdn)
-                        except:
-                            logger.debug("unable to reach client - %s" % client_fqdn) 
-                    
-                    
-                        
-                    self.host_map[client_fqdn]['children'].append(child)
+        if self.discovery_failures:
+            logger.warn("Host discovery incomplete for %s of %s hosts" % (len(self.discovery_failures), len(host_daemon_map)))
+            for host, reason in self.discovery_failures.items():
+                logger.warn("%s - %s" % (host, reason))
+        
         self.set_host_type_list()
+        self.build_host_directory()
         
         dataWriter = open("host_map.json", 'w')
         dataWriter.write(json.dumps(self.host_map, indent=4))
         dataWriter.close()
             
         logger.debug(json.dumps(self.host_map, indent=4))
+    
+    def discover_host(self, host, daemon_list, is_client):
+        #runs in a discovery worker, every remote command shares the host's time budget
+        deadline = time.time() + self.host_timeout
+        errors = []
+        
+        def remaining():
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                raise RuntimeError("timed out after %s seconds" % self.host_timeout)
+            return time_left
+        
+        host_fqdn = self.get_fqdn(self.remoteclient, host, timeout=remaining())
+        if host_fqdn is None:
+            if is_client and not daemon_list:
+                return None, None, ["unable to resolve fqdn, client skipped"]
+            #keep ceph daemons in the map under the name the cluster reports
+            errors.append("unable to resolve fqdn")
+            host_fqdn = host
+        
+        host_entry = {}
+        host_entry['children'] = []
+        host_entry['interfaces'] = {}
+        host_entry['cpu_info'] = {}
+        
+        try:
+            for role, service_id in daemon_list:
+                child = {}
+                child['service_type'] = role
+                child['service_id'] = service_id
+                child['service_pid'] = self.get_ceph_service_pid(self.remoteclient, host_fqdn, role, service_id, timeout=remaining())
+                if child['service_pid'] == "-1":
+                    errors.append("no pid found for %s.%s" % (role, service_id))
+                if child not in host_entry['children']:
+                    host_entry['children'].append(child)
+            
+            #get interface dict
+            host_entry['interfaces'] = self.get_interfaces(self.remoteclient, host_fqdn, timeout=remaining())
+            #get cpuinfo dict
+            host_entry['cpu_info'] = self.get_cpu_info(self.remoteclient, host_fqdn, timeout=remaining())
+        except RuntimeError as e:
+            errors.append(str(e))
+            #daemons that were not reached yet are still part of the map
+            for role, service_id in daemon_list:
+                child = {'service_type': role, 'service_id': service_id}
+                if not [c for c in host_entry['children'] if c['service_type'] == role and c['service_id'] == service_id]:
+                    child['service_pid'] = "-1"
+                    host_entry['children'].append(child)
         
-    def get_fqdn(self, remoteclient, host):
+        if not host_entry['interfaces'] or not host_entry['cpu_info']:
+            errors.append("incomplete hardware inventory")
+        
+        if is_client:
+            child = {}
+            child['service_type'] = "client"
+            child['service_pid'] = "-1"
+            child['service_id'] = -1
+            host_entry['children'].append(child)
+        
+        return host_fqdn, host_entry, errors
+        
+    def get_inventory(self, remoteclient, host, timeout=None):
+        #fqdn, cpu info, interfaces and daemon pids all come from one remote call
+        if host in self.inventory_map:
+            return self.inventory_map[host]
+        
+        inventory = host_inventory.probe_host(remoteclient, host, timeout=timeout)
+        if inventory is not None:
+            self.inventory_map[host] = inventory
+            if inventory['fqdn']:
+                self.inventory_map[inventory['fqdn']] = inventory
+        return inventory
+        
+    def get_fqdn(self, remoteclient, host, timeout=None):
        # logger.debug(self.fqdn_map)
-        for k in self.fqdn_map:
-            if host in k:
-                output = self.fqdn_map[k]
-                return output
+        if host in self.fqdn_map:
+            return self.fqdn_map[host]
         else:
-            try:
-                output = remoteclient.issue_command(host, "hostname -f")
-                output = output[0].strip()
-                self.fqdn_map[host] = output
-                return output
-            except:
+            inventory = self.get_inventory(remoteclient, host, timeout=timeout)
+            if inventory is None or not inventory['fqdn']:
                 return None
+            self.fqdn_map[host] = inventory['fqdn']
+            return inventory['fqdn']
         
-    def get_cpu_info(self, remoteclient, host):
+    def get_cpu_info(self, remoteclient, host, timeout=None):
         cpu_info_dict = {}
         
         if host in self.cpu_info_map:
             cpu_info_dict = self.cpu_info_map[host]
             return cpu_info_dict 
         else:
-            try:
-                output = remoteclient.issue_command(host, "lscpu")
-                for line in output:
-                    #print line
-                    seperated_line = line.split(":")
-                    #print seperated_line
-                    cpu_prop = seperated_line[0].strip()
-                    cpu_prop_value = seperated_line[1].strip()
-                    
-                    if "NUMA node" in cpu_prop and "CPU(s)" in cpu_prop:
-                        cpu_info_dict[cpu_prop] = []
-                        split_values = cpu_prop_value.split(",")
-                        for value in split_values:
-                            cpu_info_dict[cpu_prop].append(value)
-                    elif "Flags" not in cpu_prop:
-                        cpu_info_dict[cpu_prop] = cpu_prop_value  
-            
-            except:
+            inventory = self.get_inventory(remoteclient, host, timeout=timeout)
+            if inventory is not None:
+                cpu_info_dict = inventory['cpu_info']
+            else:
                 logger.warn("Unable to retrive cpu info for %s" % host)
             
             self.cpu_info_map[host] = cpu_info_dict
             return cpu_info_dict    
     
-    def get_interfaces(self, remoteclient, host):
+    def get_interfaces(self, remoteclient, host, timeout=None):
         interface_dict = {}
         
         if host in self.interface_map:
             interface_dict = self.interface_map[host]
             return interface_dict
         else:
-            try:
-                output = remoteclient.issue_command(host, "ip a")
-                
-                for line in output:
-                    seperated_line = line.split(" ")
-                    
-                    #Get interface name
-                    if seperated_line[0].strip(":").isdigit():
-                        interface_name = seperated_line[1]
-                        interface_dict[interface_name] = []
-                    
-                    #Get IPv4 for interface 
-                    if "inet" in line and not "inet6" in line:
-                        ipindex = seperated_line.index("inet") + 1
-                        ip_address = seperated_line[ipindex]
-                        interface_dict[interface_name].append(ip_address)
-            except:
+            inventory = self.get_inventory(remoteclient, host, timeout=timeout)
+            if inventory is not None:
+                interface_dict = inventory['interfaces']
+            else:
                 logger.warn("Unable to retrive network in for %s" % host)
             self.interface_map[host] = interface_dict    
             #return a dict of all interfaces:IPaddresses
             return interface_dict
 
-    def get_ceph_service_pid(self, remoteclient, host, service, id):
-        pid_grep_command = "ps -eaf | grep %s | grep 'id %s ' | grep -v grep| awk '{print $2}'" % (service, id)
-        output = remoteclient.issue_command(host, pid_grep_command)
-        if output:
-            return output[0]
-        else:
-            return str("-1")
+    def get_ceph_service_pid(self, remoteclient, host, service, id, timeout=None):
+        inventory = self.get_inventory(remoteclient, host, timeout=timeout)
+        if inventory is not None:
+            pid = inventory['daemons'].get(service, {}).get(str(id))
+            if pid:
+                return pid
+        return str("-1")
     
     def emit_actions(self):
         
@@ -275,66 +360,23 @@ class cbt_config_transcriber:
         file_time = datetime.datetime.fromtimestamp(file_time)
         importdoc['_source']['date'] = file_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
         
-        importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+        importdoc["_id"] = stats.document_id(importdoc)
         yield importdoc    
         
 
 class ssh_remote_command():
-    def __init__(self):
+    def __init__(self, session_pool=None):
           self.sshcounter = 0
+          self.counter_lock = threading.Lock()
+          #one multiplexed ssh session per host, shared by every command
+          if session_pool is None:
+              session_pool = remote_session.remote_session_pool()
+          self.session_pool = session_pool
     
-    def issue_command(self, host, command):
+    def issue_command(self, host, command, timeout=None, label=None):
         
-        try:
-
-            #logger.debug("ssh: host %s comand %s" % (host, command))
-            proc = subprocess.Popen(['ssh', host, command],
-                                    stdin=subprocess.PIPE,stdout=subprocess.PIPE)
-            
+        with self.counter_lock:
             self.sshcounter = self.sshcounter + 1
-
-            output = proc.stdout.readlines()
-            if output:
-                #remove trailing \n
-                formated_output = []
-                for i in output:
-                    i = i.decode('utf-8')
-                    formated_output.append(i.strip('\n'))
-                
-                return formated_output
-            else:
-                logger.warn("nothing returned from ssh command")
-        
-        except Exception as e:
-            logger.warn("SSH Connection Failed: %s" % e)
-    
-class ceph_client():
-    def __init__(self):
         
-        self.Connection_status = False
-        
-        if not os.path.isfile("/etc/ceph/ceph.conf"):
-            logger.warn("/etc/ceph/ceph.conf not found!")
-        elif not os.path.isfile("/etc/ceph/ceph.client.admin.keyring"):
-            logger.warn("/etc/ceph/ceph.client.admin.keyring not found!")
-        else:
-            self.cluster = rados.Rados(conffile="/etc/ceph/ceph.conf",
-                                       conf=dict(keyring='/etc/ceph/ceph.client.admin.keyring'),
-                                       )
-            try:
-                self.cluster.connect(timeout=1)
-                self.Connection_status = True
-            except Exception as e:
-                logger.warn("Ceph Client Connection error: %s" % e.message )
-            
-                
-            self.osd_host_list = []
-            self.osd_list = []
-        
-    def issue_command(self, command):
-        cmd = json.dumps({"prefix": command, "format": "json"})
-        try:
-            _, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
-            return json.loads(output)
-        except Exception as e:
-            logger.error("Error issuing command, %s" % command)
+        #logger.debug("ssh: host %s comand %s" % (host, command))
+        return self.session_pool.issue_command(host, command, timeout, label)
@@ -1,6 +1,7 @@
 import yaml, os, time, json, hashlib
 import socket, datetime, statistics, logging
 from collections import defaultdict
+from utils.pipeline_stats import stats
 
 logger = logging.getLogger("index_cbt")
 
@@ -25,7 +26,8 @@ class fiojson_file_transcriber:
                   }
             }
         
-        json_doc = json.load(open(self.json_file))
+        with stats.timer("json_parse"):
+            json_doc = json.load(open(self.json_file))
         #create header dict based on top level objects
         importdoc['_source']['date'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.localtime(json_doc['timestamp']))
         
@@ -44,7 +46,7 @@ class fiojson_file_transcriber:
             tmp_doc['fio']['fio_json']['total_iops'] = int(tmp_doc['fio']['fio_json']['job']['write']['iops']) + int(tmp_doc['fio']['fio_json']['job']['read']['iops'])
             
             importdoc['_source']['ceph_benchmark_test']['test_data'] = tmp_doc
-            importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+            importdoc["_id"] = stats.document_id(importdoc)
             yield importdoc
             
 class fiojson_results_transcriber:
@@ -83,7 +85,8 @@ class fiojson_results_transcriber:
             
             #get measurements
         for json_data in self.json_data_list:
-            json_doc = json.load(open(json_data['jfile']))
+            with stats.timer("json_parse", source=json_data['jfile']):
+                json_doc = json.load(open(json_data['jfile']))
             
             iteration = json_data['metadata']['ceph_benchmark_test']['test_config']['iteration']
             op_size = json_data['metadata']['ceph_benchmark_test']['test_config']['op_size']
@@ -153,6 +156,8 @@ class fiojson_results_transcriber:
                     tmp_doc['write-iops'] = 0
         
                 tmp_doc['total-iops'] = (tmp_doc['write-iops'] + tmp_doc['read-iops'])
+                #per iteration values, in iteration order, for regression analysis
+                tmp_doc['iteration-iops'] = [write + read for write, read in zip(waver_ary, raver_ary)]
                 
                 if calcuate_percent_std_dev:
                     if "read" in oper:
@@ -163,5 +168,5 @@ class fiojson_results_transcriber:
                         tmp_doc['std-dev-%s' % obj_size] = round((((statistics.stdev(raver_ary) + statistics.stdev(waver_ary)) / tmp_doc['total-iops'])* 100), 3)
                 
                 importdoc["_source"]['ceph_benchmark_test']['test_data'] = tmp_doc
-                importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+                importdoc["_id"] = stats.document_id(importdoc)
                 yield importdoc   
\ No newline at end of file
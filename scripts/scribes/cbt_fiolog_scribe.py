@@ -1,5 +1,6 @@
 import yaml, os, time, json, hashlib
 import socket, datetime, csv, logging
+from utils.pipeline_stats import stats
 
 logger = logging.getLogger("index_cbt")
 
@@ -20,7 +21,8 @@ class fiolog_transcriber:
         
         #logger.debug("Indexing %s" % self.csv_file)
         try:
-            jsondoc = json.load(open(self.json_file))
+            with stats.timer("json_parse", source=self.json_file):
+                jsondoc = json.load(open(self.json_file))
             test_time_ms = int(jsondoc['timestamp_ms'])
             test_duration_sec = jsondoc['global options']['runtime']
             try:
@@ -51,7 +53,7 @@ class fiolog_transcriber:
             
             with open(self.csv_file) as csvfile:
                 readCSV = csv.reader(csvfile, delimiter=',')
-                for row in (readCSV):
+                for row in stats.timed_iter("csv_parse", readCSV):
     
                     ms = float(row[0]) + float(start_time)
                     newtime = datetime.datetime.fromtimestamp(ms / 1000.0)
@@ -66,7 +68,7 @@ class fiolog_transcriber:
                     #importdoc['_source']['test_data']['fio_thread'] = thread 
                     
                     importdoc["_source"]['ceph_benchmark_test']["test_data"] = tmp_doc
-                    importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+                    importdoc["_id"] = stats.document_id(importdoc)
                     yield importdoc  # XXX: TODO change to yield a
         except Exception as e:
             logger.warn(e)    
\ No newline at end of file
@@ -1,6 +1,7 @@
 
 import yaml, os, time, json, hashlib, sys
 import socket, datetime, csv, logging
+from utils.pipeline_stats import stats
 
 
 logger = logging.getLogger("index_cbt")
@@ -11,17 +12,14 @@ class pbench_transcriber:
         self.csv_file = csv_file
         self.metadata = metadata
         
-        host = self.metadata['ceph_benchmark_test']['common']['hardware']['hostname']
-        self.host_info = cbt_config_obj.get_host_info(host)
+        self.host = self.metadata['ceph_benchmark_test']['common']['hardware']['hostname']
+        self.cbt_config_obj = cbt_config_obj
+        self.host_info = cbt_config_obj.get_host_info(self.host)
+        if not self.host_info:
+            self.host_info = None
         
     def get_service_id(self, service_pid):
-        instance = -1
-        if self.host_info is not None:
-            for child in self.host_info['children']:
-                if service_pid in child['service_pid']:
-                    instance = child['service_id']
-        
-        return instance
+        return self.cbt_config_obj.get_service_id(self.host, service_pid)
 
     def emit_actions(self):
         importdoc = {}
@@ -46,7 +44,7 @@ class pbench_transcriber:
             first_row = True
             col_ary = []
             
-            for row in readCSV:
+            for row in stats.timed_iter("csv_parse", readCSV):
                 if first_row:
                     col_num = len(row)
                     for col in range(col_num):
@@ -138,7 +136,7 @@ class pbench_transcriber:
                                 a = importdoc
                         if a:
                                 importdoc["_source"]['ceph_benchmark_test']["test_data"] = tmp_doc
-                                importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+                                importdoc["_id"] = stats.document_id(importdoc)
                                 yield a
                     
                     
\ No newline at end of file
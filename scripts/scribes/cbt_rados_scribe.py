@@ -1,9 +1,10 @@
-import yaml, os, time, json, hashlib
+import yaml, os, time, json, hashlib, re, math
 import socket, datetime, csv, logging, copy
 from datetime import timedelta
 from collections import defaultdict
 import itertools
 import statistics
+from utils.pipeline_stats import stats
 
 logger = logging.getLogger("index_cbt")
 
@@ -64,7 +65,7 @@ class rados_transcriber():
                         cur_time = start_time + timedelta(seconds=current_seconds_since_start)
                         importdoc["_source"]["date"] = cur_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
                         importdoc["_source"]['ceph_benchmark_test']['test_data']['rados_logs'] = tmp_doc
-                        importdoc["_id"] = hashlib.md5(json.dumps(importdoc)).hexdigest()
+                        importdoc["_id"] = stats.document_id(importdoc)
                         yield importdoc 
                     else:
                         placeholder_list.append(tmp_doc)
@@ -90,15 +91,16 @@ class rados_transcriber():
                             cur_time = start_time + timedelta(seconds=current_seconds_since_start)
                             importdoc["_source"]["date"] = cur_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
                             importdoc["_source"]['ceph_benchmark_test']['test_data']['rados_logs'] = current_item
-                            importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+                            importdoc["_id"] = stats.document_id(importdoc)
                             yield importdoc
                         time_set = True 
                                 
 class rados_json_transcriber():
-    def __init__(self, json_file, start_time, metadata):
+    def __init__(self, json_file, start_time, metadata, json_doc=None):
         self.json_file = json_file
         self.start_time = start_time
         self.metadata = metadata
+        self.json_doc = json_doc
         
     def emit_actions(self):
         
@@ -110,19 +112,56 @@ class rados_json_transcriber():
         importdoc["_op_type"] = "create"
         importdoc["_source"] = self.metadata
         importdoc["_source"]['date'] = self.start_time
-        with open(self.json_file, 'r') as myfile:
-            data=myfile.read()
+        
+        #reuse the document parsed by the results transcriber when available
+        if self.json_doc is None:
+            with open(self.json_file, 'r') as myfile, stats.timer("json_parse"):
+                self.json_doc = json.loads(myfile.read())
         
         tmpdoc = {
-            "rados_json": json.loads(data)
+            "rados_json": self.json_doc
             }
         importdoc["_source"]['ceph_benchmark_test']['test_data'] = tmpdoc
-        importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+        importdoc["_id"] = stats.document_id(importdoc)
         yield importdoc 
         
-                         
+
+def normalize_rados_metric(key):
+    #rados bench has reported its summary as "Average Latency(s)" and as
+    #"average_latency" depending on the release, map both to the latter
+    key = re.sub(r'\(.*?\)', '', key)
+    return "_".join(key.strip().lower().split())
+
+def parse_rados_json(json_doc):
+    metrics = {}
+    for key, value in json_doc.items():
+        try:
+            metrics[normalize_rados_metric(key)] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return metrics
+
+def pooled_stdev(mean_list, stdev_list):
+    #standard deviation of the union of equally sized samples
+    if not mean_list:
+        return 0
+    mean_variance = sum(s ** 2 for s in stdev_list) / float(len(stdev_list))
+    return math.sqrt(mean_variance + statistics.pvariance(mean_list))
+
 class rados_json_results_transcriber:
     
+    #metric name : how instances of one iteration are combined
+    instance_aggregation = {
+        "average_iops": "sum",
+        "stddev_iops": "sum_variance",
+        "bandwidth": "sum",
+        "stddev_bandwidth": "sum_variance",
+        "average_latency": "mean",
+        "stddev_latency": "pooled",
+        "max_latency": "max",
+        "min_latency": "min"
+        }
+    
     def __init__(self, metadata):
         self.json_data_list = []
         self.iteration_list = []
@@ -132,15 +171,25 @@ class rados_json_results_transcriber:
         self.metadata = metadata
         
     def add_json_file(self, json_file, metadata):
+        try:
+            with open(json_file) as f, stats.timer("json_parse", source=json_file):
+                json_doc = json.load(f)
+        except ValueError:
+            logger.warn("Found corrupted JSON file, %s." % json_file)
+            return
+        
         json_data = {}
         json_data['jfile'] = json_file
         file_time = os.path.getmtime(json_file)
         json_data['start_time'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(file_time))
         json_data['metadata'] = metadata 
+        json_data['json_doc'] = json_doc
+        json_data['metrics'] = parse_rados_json(json_doc)
         self.json_data_list.append(json_data)
         
     def calculate_iops_sum(self):
         
+        instance_metrics = defaultdict(list)
         for json_data in self.json_data_list:
             iteration = json_data['metadata']['ceph_benchmark_test']['test_config']['iteration']
             op_size = json_data['metadata']['ceph_benchmark_test']['test_config']['op_size']
@@ -150,6 +199,8 @@ class rados_json_results_transcriber:
             if mode not in self.operation_list: self.operation_list.append(mode)
             if op_size not in self.block_size_list: self.block_size_list.append(op_size)
             
+            instance_metrics[(iteration, mode, op_size)].append(json_data)
+            
         for iteration in self.iteration_list:
             self.sumdoc[iteration] = {}
             for mode in self.operation_list:
@@ -157,18 +208,29 @@ class rados_json_results_transcriber:
                 for op_size in self.block_size_list:
                     self.sumdoc[iteration][mode][op_size] = {}
                     
-        for json_data in self.json_data_list:
-            json_doc = json.load(open(json_data['jfile']))
-            
-            iteration = json_data['metadata']['ceph_benchmark_test']['test_config']['iteration']
-            op_size = json_data['metadata']['ceph_benchmark_test']['test_config']['op_size']
-            mode = json_data['metadata']['ceph_benchmark_test']['test_config']['mode']
+        for (iteration, mode, op_size), json_data_list in instance_metrics.items():
+            summary = self.sumdoc[iteration][mode][op_size]
+            summary['date'] = min(json_data['start_time'] for json_data in json_data_list)
+            summary['instances'] = len(json_data_list)
             
-            if not self.sumdoc[iteration][mode][op_size]:
-                self.sumdoc[iteration][mode][op_size]['date'] = json_data['start_time']
-                self.sumdoc[iteration][mode][op_size]['average_iops'] = 0
+            for metric, aggregation in self.instance_aggregation.items():
+                values = [json_data['metrics'][metric] for json_data in json_data_list if metric in json_data['metrics']]
+                if not values:
+                    continue
                 
-            self.sumdoc[iteration][mode][op_size]['average_iops'] += int(json_data['metadata']['ceph_benchmark_test']['test_data']['rados_json']['Average IOPS'])
+                if aggregation == "sum":
+                    summary[metric] = sum(values)
+                elif aggregation == "sum_variance":
+                    summary[metric] = math.sqrt(sum(v ** 2 for v in values))
+                elif aggregation == "mean":
+                    summary[metric] = statistics.mean(values)
+                elif aggregation == "max":
+                    summary[metric] = max(values)
+                elif aggregation == "min":
+                    summary[metric] = min(values)
+                elif aggregation == "pooled":
+                    means = [json_data['metrics'].get("average_latency", 0) for json_data in json_data_list if metric in json_data['metrics']]
+                    summary[metric] = pooled_stdev(means, values)
         
     def emit_rados_json_files(self):
         
@@ -178,7 +240,7 @@ class rados_json_results_transcriber:
             file = json_file['jfile']
             start_time = json_file['start_time']
             
-            rados_json_transcriber_obj = rados_json_transcriber(file, start_time, json_metadata)
+            rados_json_transcriber_obj = rados_json_transcriber(file, start_time, json_metadata, json_file['json_doc'])
             yield rados_json_transcriber_obj
         
     def emit_actions(self):
@@ -194,36 +256,46 @@ class rados_json_results_transcriber:
         
         for oper in self.operation_list:
             for obj_size in self.block_size_list:
-                aver_ary = []
-                total_ary = []
                 tmp_doc = {}
                 tmp_doc['object_size'] = obj_size # set document's object size
                 tmp_doc['operation'] = oper # set documents operation
-                firstrecord = True
-                calcuate_percent_std_dev = False
-                for itera in self.iteration_list: # 
-                    aver_ary.append(self.sumdoc[itera][oper][obj_size]['average_iops'])
-    
-                    if firstrecord:
-                        importdoc["_source"]['date'] = self.sumdoc[itera][oper][obj_size]['date']
-                        firstrecord = True
-        
+                
+                iteration_summaries = [self.sumdoc[itera][oper][obj_size] for itera in self.iteration_list if self.sumdoc[itera][oper][obj_size]]
+                if not iteration_summaries:
+                    continue
+                importdoc["_source"]['date'] = iteration_summaries[0]['date']
+                
+                aver_ary = [summary.get('average_iops', 0) for summary in iteration_summaries]
                 average = statistics.mean(aver_ary)
                 if average > 0.0:
                     tmp_doc['average_iops'] = average
-                    if len(aver_ary) > 1:
-                        calcuate_percent_std_dev = True 
                 else:
                     tmp_doc['average_iops'] = 0
                     
                 tmp_doc['total-iops'] = tmp_doc['average_iops']
+                #per iteration values, in iteration order, for regression analysis
+                tmp_doc['iteration-iops'] = aver_ary
                 
-                if calcuate_percent_std_dev:
+                if average > 0.0 and len(aver_ary) > 1:
                     tmp_doc['std-dev-%s' % obj_size] = round(((statistics.stdev(aver_ary) / average) * 100), 3)
+                
+                #latency and bandwidth, averaged across iterations apart from the extremes
+                for metric in self.instance_aggregation:
+                    if metric == "average_iops":
+                        continue
+                    values = [summary[metric] for summary in iteration_summaries if metric in summary]
+                    if not values:
+                        continue
+                    if metric == "max_latency":
+                        tmp_doc[metric] = max(values)
+                    elif metric == "min_latency":
+                        tmp_doc[metric] = min(values)
+                    else:
+                        tmp_doc[metric] = statistics.mean(values)
+                
+                tmp_doc['instances'] = iteration_summaries[0]['instances']
+                tmp_doc['iterations'] = len(iteration_summaries)
             
                 importdoc["_source"]['ceph_benchmark_test']['test_data'] = tmp_doc
-                importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+                importdoc["_id"] = stats.document_id(importdoc)
                 yield importdoc   
-        
-        
-        
\ No newline at end of file
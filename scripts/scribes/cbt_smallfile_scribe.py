@@ -0,0 +1,235 @@
+import yaml, os, time, json, hashlib, math
+import datetime, csv, logging, statistics
+from collections import defaultdict
+from utils.pipeline_stats import stats
+
+logger = logging.getLogger("index_cbt")
+
+class latency_histogram:
+    #log-bucketed response time histogram, keeps memory bounded no matter
+    #how many samples a thread produced while giving ~1% accurate percentiles
+
+    def __init__(self, resolution=1.01):
+        self.log_base = math.log(resolution)
+        self.resolution = resolution
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min: self.min = value
+        if self.max is None or value > self.max: self.max = value
+        if value > 0:
+            self.buckets[int(math.floor(math.log(value) / self.log_base))] += 1
+        else:
+            self.buckets[None] += 1
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min): self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max): self.max = other.max
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0
+        target = self.count * pct / 100.0
+        seen = self.buckets.get(None, 0)
+        if seen >= target:
+            return 0
+        for bucket in sorted(b for b in self.buckets if b is not None):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                #report the upper edge of the bucket, clamped to what was observed
+                return min(self.resolution ** (bucket + 1), self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {}
+        return {
+            "samples": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99)
+            }
+
+def parse_rsptimes_file(rsptimes_file):
+    #smallfile writes one "operation, start offset, response time" line per request
+    histograms = defaultdict(latency_histogram)
+    with open(rsptimes_file) as csvfile:
+        for row in stats.timed_iter("csv_parse", csv.reader(csvfile, delimiter=',')):
+            if len(row) < 3:
+                continue
+            try:
+                rsp_time = float(row[2])
+            except ValueError:
+                continue
+            histograms[row[0].strip()].add(rsp_time)
+    return histograms
+
+def rsptimes_file_info(rsptimes_file):
+    #rsptimes_<thread>_<host>_<operation>_<epoch>.csv
+    name = os.path.basename(rsptimes_file)[len("rsptimes_"):].rsplit(".", 1)[0]
+    thread, remainder = name.split("_", 1)
+    host, operation, _ = remainder.rsplit("_", 2)
+    return thread, host, operation
+
+class smallfile_transcriber:
+
+    def __init__(self, result_dir, result_file, metadata):
+        self.result_dir = result_dir
+        self.result_file = os.path.join(result_dir, result_file)
+        self.metadata = metadata
+        self.summary = {}
+        self.latency = defaultdict(latency_histogram)
+
+    def get_rsptimes_files(self):
+        for dirpath, dirs, files in os.walk(self.result_dir):
+            for filename in files:
+                if filename.startswith("rsptimes_") and filename.endswith(".csv"):
+                    yield os.path.join(dirpath, filename)
+
+    def emit_actions(self):
+        importdoc = {}
+        importdoc["_index"] = "cbt_smallfile-result-index"
+        importdoc["_type"] = "smallfileresultdata"
+        importdoc["_op_type"] = "create"
+        importdoc["_source"] = self.metadata
+
+        logger.debug("Indexing %s" % self.result_file)
+        with open(self.result_file) as f, stats.timer("json_parse"):
+            smf_doc = json.load(f)
+
+        params = smf_doc.get('params', {})
+        results = smf_doc.get('results', {})
+        operation = params.get('operation', self.metadata['ceph_benchmark_test']['test_config'].get('operation'))
+        file_size = params.get('file_size', self.metadata['ceph_benchmark_test']['test_config'].get('file_size'))
+        start_time = float(results.get('startTime', os.path.getmtime(self.result_file)))
+        importdoc["_source"]['date'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(start_time))
+
+        #one document per smallfile thread
+        for host, host_result in results.get('in-host', {}).items():
+            for thread, thread_result in host_result.get('threads', {}).items():
+                tmp_doc = {
+                    "smallfile": {
+                        "host": host,
+                        "thread": thread,
+                        "operation": operation,
+                        "file_size": file_size,
+                        }
+                    }
+                for metric in ("elapsed", "files", "records", "filesPerSec", "IOPS", "MiBps"):
+                    if metric in thread_result:
+                        tmp_doc['smallfile'][metric] = float(thread_result[metric])
+                importdoc["_source"]['ceph_benchmark_test']['test_data'] = tmp_doc
+                importdoc["_id"] = stats.document_id(importdoc)
+                yield importdoc
+
+        #stream the per-thread response time files into per operation histograms
+        for rsptimes_file in self.get_rsptimes_files():
+            logger.debug("Processing %s" % rsptimes_file)
+            try:
+                file_histograms = parse_rsptimes_file(rsptimes_file)
+            except (IOError, OSError) as e:
+                logger.warn("Unable to read %s, %s" % (rsptimes_file, e))
+                continue
+            try:
+                thread, host, _ = rsptimes_file_info(rsptimes_file)
+            except ValueError:
+                thread, host = "UNKNOWN", "UNKNOWN"
+            for rsp_operation, histogram in file_histograms.items():
+                self.latency[rsp_operation].merge(histogram)
+                tmp_doc = {
+                    "smallfile": {
+                        "host": host,
+                        "thread": thread,
+                        "operation": rsp_operation,
+                        "file_size": file_size,
+                        "latency": histogram.summary()
+                        }
+                    }
+                importdoc["_source"]['ceph_benchmark_test']['test_data'] = tmp_doc
+                importdoc["_id"] = stats.document_id(importdoc)
+                yield importdoc
+
+        self.summary = {
+            "operation": operation,
+            "file_size": file_size,
+            "start_time": start_time,
+            "elapsed": float(results.get('elapsed', 0)),
+            "files": float(results.get('files', 0)),
+            "filesPerSec": float(results.get('filesPerSec', 0)),
+            "IOPS": float(results.get('IOPS', 0)),
+            "MiBps": float(results.get('MiBps', 0)),
+            "threads": int(results.get('totalthreads', 0)),
+            "hosts": int(results.get('totalhosts', 0)),
+            "latency": self.latency.get(operation, latency_histogram()),
+            }
+
+class smallfile_results_transcriber:
+
+    def __init__(self, metadata):
+        self.transcriber_list = []
+        self.metadata = metadata
+
+    def add_transcriber(self, smallfile_transcriber_obj):
+        self.transcriber_list.append(smallfile_transcriber_obj)
+
+    def emit_actions(self):
+        importdoc = {}
+        importdoc["_index"] = "cbt_smallfile-summary-index"
+        importdoc["_type"] = "smallfilesummarydata"
+        importdoc["_op_type"] = "create"
+        importdoc["_source"] = self.metadata
+
+        #summaries are gathered while the result transcribers are emitted
+        sumdoc = defaultdict(list)
+        for transcriber in self.transcriber_list:
+            if transcriber.summary:
+                sumdoc[(transcriber.summary['operation'], transcriber.summary['file_size'])].append(transcriber.summary)
+
+        for (operation, file_size), summary_list in sumdoc.items():
+            summary_list.sort(key=lambda s: s['start_time'])
+            fps_ary = [s['filesPerSec'] for s in summary_list]
+            latency = latency_histogram()
+            for s in summary_list:
+                latency.merge(s['latency'])
+
+            tmp_doc = {}
+            tmp_doc['operation'] = operation
+            tmp_doc['object_size'] = file_size
+            tmp_doc['files-per-sec'] = statistics.mean(fps_ary)
+            tmp_doc['total-iops'] = statistics.mean([s['IOPS'] for s in summary_list])
+            #per iteration values, in iteration order, for regression analysis
+            tmp_doc['iteration-iops'] = [s['IOPS'] for s in summary_list]
+            tmp_doc['MiBps'] = statistics.mean([s['MiBps'] for s in summary_list])
+            tmp_doc['elapsed'] = statistics.mean([s['elapsed'] for s in summary_list])
+            tmp_doc['threads'] = summary_list[0]['threads']
+            tmp_doc['hosts'] = summary_list[0]['hosts']
+            tmp_doc['iterations'] = len(summary_list)
+            if len(fps_ary) > 1 and tmp_doc['files-per-sec'] > 0:
+                tmp_doc['std-dev-%s' % file_size] = round(((statistics.stdev(fps_ary) / tmp_doc['files-per-sec']) * 100), 3)
+            if latency.count:
+                tmp_doc['latency'] = latency.summary()
+
+            #test window, used to line the summary up with pbench samples
+            start_time = summary_list[0]['start_time']
+            end_time = max(s['start_time'] + s['elapsed'] for s in summary_list)
+            tmp_doc['test_start'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(start_time))
+            tmp_doc['test_end'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(end_time))
+
+            importdoc["_source"]['date'] = tmp_doc['test_start']
+            importdoc["_source"]['ceph_benchmark_test']['test_data'] = tmp_doc
+            importdoc["_id"] = stats.document_id(importdoc)
+            yield importdoc
@@ -1,13 +1,67 @@
 
-import os, sys, json, time, types, csv, copy, hashlib
-import xmltodict
+import os, re, sys, json, time, types, csv, copy, hashlib
 import logging
 import datetime
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
 from time import gmtime, strftime
 from datetime import timedelta
 
 logger = logging.getLogger("index_cosbench")
 
+def parse_workload_config(xml_file):
+    #stage name -> workers of the stage's first work, read with iterparse so
+    #each workstage is dropped as soon as it has been looked at
+    stage_workers = OrderedDict()
+    for event, elem in ElementTree.iterparse(xml_file, events=("end",)):
+        if elem.tag == "workstage":
+            work = elem.find("work")
+            stage_workers[elem.get("name")] = work.get("workers") if work is not None else None
+            elem.clear()
+    return stage_workers
+
+def lookup_stage_workers(stage_workers, stage):
+    #workload csv stages look like "s1-init", the xml only knows "init"
+    if stage in stage_workers:
+        return stage_workers[stage]
+    stage_name = stage.split("-", 1)[-1]
+    if stage_name in stage_workers:
+        return stage_workers[stage_name]
+    workers = None
+    for name, stage_worker_count in stage_workers.items():
+        if name in stage:
+            workers = stage_worker_count
+    return workers
+
+def parse_stage_value(value):
+    if "%" in value:
+        return float(value.strip('%'))
+    elif "N/A" in value:
+        return 0.0
+    return float(value)
+
+class stage_clock():
+    #stage csv rows only carry HH:MM:SS. the date starts at the stage start
+    #time and rolls over when the clock wraps past midnight, the formatted
+    #day is kept so each row only needs its time checked
+    time_format = re.compile(r"^\d\d:\d\d:\d\d$")
+
+    def __init__(self, start_time):
+        start = datetime.datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S.%fZ' )
+        self.day = start.date()
+        self.day_string = self.day.strftime('%Y-%m-%d')
+        self.previous_time = start.strftime('%H:%M:%S')
+
+    def convert(self, current_time):
+        if not self.time_format.match(current_time):
+            #let strptime normalize anything unusual, and raise on garbage
+            current_time = datetime.datetime.strptime(current_time, '%H:%M:%S').strftime('%H:%M:%S')
+        if self.previous_time > current_time:
+            self.day += timedelta(days=1)
+            self.day_string = self.day.strftime('%Y-%m-%d')
+        self.previous_time = current_time
+        return "%sT%s.000000Z" % (self.day_string, current_time)
+
 class cosbench_runhistory_transcriber():
     def __init__(self, test_id, file, workload_list):
         
@@ -66,134 +120,171 @@ class cosbench_runhistory_transcriber():
                     
                             #a = copy.deepcopy(run_history
                         
-                    if  run_history['_source']['Workload ID'] in self.workload_list:
-                        run_history['_id'] = hashlib.md5(json.dumps(run_history)).hexdigest()
+                    if self.workload_list is None or run_history['_source']['Workload ID'] in self.workload_list:
+                        run_history['_id'] = hashlib.md5(json.dumps(run_history).encode()).hexdigest()
                         yield run_history 
                 
+def find_workload_dirs(archive_dir, workload_list=None):
+    #[(workload id, directory name)] for the w<id>-<name> directories at the
+    #top of the archive, optionally only those in workload_list
+    workload_dirs = []
+    for wdir in os.listdir(archive_dir):
+        if not wdir.startswith("w") or not os.path.isdir(os.path.join(archive_dir, wdir)):
+            continue
+        wdirID = wdir.split("-")[0].strip('w')
+        if not wdirID.isdigit():
+            continue
+        if workload_list is None or int(wdirID) in workload_list:
+            workload_dirs.append((int(wdirID), wdir))
+    return sorted(workload_dirs)
+
 class cosbench_workload_transcriber():
-    def __init__(self, test_id, archive_dir, workload_list):
+    def __init__(self, test_id, archive_dir, workload_list, workload_dirs=None):
         self.archive_dir = archive_dir
         self.test_id = test_id
         self.ws_doc = {}
         self.workload_list = workload_list
-        self.workload_doc_list = []
+        self.workload_dirs = workload_dirs
+        #(workload, stage) -> start time and status of every row, filled in as rows are emitted
+        self.stage_index = {}
+
+    def get_workload_dirs(self):
+        if self.workload_dirs is None:
+            self.workload_dirs = find_workload_dirs(self.archive_dir, self.workload_list)
+        return self.workload_dirs
         
     def emit_actions(self):
         logger.info("Process selected workload stage reports")
         
-        for dirpath, dirs, files in os.walk("."):
-            for wdir in dirs:
-                if wdir.startswith("w"):
-                    wdirID = wdir.split("-")[0]
-                    wdirID = wdirID.strip('w')
-                    if int(wdirID) in self.workload_list:
-                        #workload_doc = copy.deepcopy(maindoc)
-                        self.ws_doc[wdir] = []
-                        #workload_doc['_source']['Workload ID'] = int(wdirID)
-                        #workload_doc['_source']['Workload'] = wdir
-                        with open("%s/%s.csv" % (wdir, wdir)) as csvfile:
-                            readCSV = csv.reader(csvfile, delimiter=',')
-                            header_list = []
-                            first_row = True
-                            b = ""
-                            for row in readCSV:
-                                workload_doc = {'_index': 'cosbench_workload_index',
-                                             '_type': "cosbench_workload",
-                                             '_op_type': 'create',
-                                             '_source': {
-                                                 'Workload ID': int(wdirID),
-                                                 'Workload': wdir,
-                                                 'test_id': self.test_id
-                                                 } 
-                                            }
+        for wdirID, wdir in self.get_workload_dirs():
+            wdir_path = os.path.join(self.archive_dir, wdir)
+            #workload_doc = copy.deepcopy(maindoc)
+            self.ws_doc[wdir] = []
+            #the xml is the same for every row of the workload
+            stage_workers = parse_workload_config(os.path.join(wdir_path, "workload-config.xml"))
+            workers_by_stage = {}
+            #workload_doc['_source']['Workload ID'] = int(wdirID)
+            #workload_doc['_source']['Workload'] = wdir
+            with open(os.path.join(wdir_path, "%s.csv" % wdir)) as csvfile:
+                readCSV = csv.reader(csvfile, delimiter=',')
+                header_list = []
+                first_row = True
+                b = ""
+                for row in readCSV:
+                    workload_doc = {'_index': 'cosbench_workload_index',
+                                 '_type': "cosbench_workload",
+                                 '_op_type': 'create',
+                                 '_source': {
+                                     'Workload ID': int(wdirID),
+                                     'Workload': wdir,
+                                     'test_id': self.test_id
+                                     } 
+                                }
                                 
-                                if first_row:
-                                    number_of_columns = len(row)
-                                    first_row = False
-                                    for column in range(number_of_columns):
-                                        header_list.append(row[column])
+                    if first_row:
+                        number_of_columns = len(row)
+                        first_row = False
+                        for column in range(number_of_columns):
+                            header_list.append(row[column])
+                    else:
+                        for column in range(number_of_columns):
+                            if "Detailed Status" in header_list[column]:
+                                for i in range(header_list.index("Detailed Status"), len(row)):
+                                    detailed_status = row[i]
+                                    status, time = detailed_status.split(' @ ')
+                                    thistime = datetime.datetime.strptime(time, '%Y-%m-%d %H:%M:%S' )
+                                    thistime = thistime.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+                                    fulldstatus = "Detailed Status - %s" % status
+                                    if "launching" in status or "aborted" in status or "failed" in status or "terminated" in status:
+                                        workload_doc['_source']['date'] = thistime
+                                        workload_doc['_source'][fulldstatus] = thistime
+                                    else:
+                                        workload_doc['_source'][fulldstatus] = thistime
+                            elif "Status" in header_list[column]:
+                                if "finished" in row[column]:
+                                    workload_doc['_source']['StatusID'] = 0
+                                elif "failed" in row[column]:
+                                    workload_doc['_source']['StatusID'] = 3
+                                elif "cancelled" in row[column]:
+                                    workload_doc['_source']['StatusID'] = 2
+                                elif "terminated" in row[column]:
+                                    workload_doc['_source']['StatusID'] = 1
                                 else:
-                                    for column in range(number_of_columns):
-                                        if "Detailed Status" in header_list[column]:
-                                            for i in xrange(header_list.index("Detailed Status"), len(row)):
-                                                detailed_status = row[i]
-                                                status, time = detailed_status.split(' @ ')
-                                                thistime = datetime.datetime.strptime(time, '%Y-%m-%d %H:%M:%S' )
-                                                thistime = thistime.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-                                                fulldstatus = "Detailed Status - %s" % status
-                                                if "launching" in status or "aborted" in status or "failed" in status or "terminated" in status:
-                                                    workload_doc['_source']['date'] = thistime
-                                                    workload_doc['_source'][fulldstatus] = thistime
-                                                else:
-                                                    workload_doc['_source'][fulldstatus] = thistime
-                                        elif "Status" in header_list[column]:
-                                            if "finished" in row[column]:
-                                                workload_doc['_source']['StatusID'] = 0
-                                            elif "failed" in row[column]:
-                                                workload_doc['_source']['StatusID'] = 3
-                                            elif "cancelled" in row[column]:
-                                                workload_doc['_source']['StatusID'] = 2
-                                            elif "terminated" in row[column]:
-                                                workload_doc['_source']['StatusID'] = 1
-                                            else:
-                                                workload_doc['_source']['StatusID'] = 4
+                                    workload_doc['_source']['StatusID'] = 4
         
-                                            workload_doc['_source'][header_list[column]] = row[column]
-                                        else:
-                                            if "Stage" in header_list[column]:
-                                                if row[column] not in self.ws_doc[wdir]:
-                                                    self.ws_doc[wdir].append(row[column]) 
+                                workload_doc['_source'][header_list[column]] = row[column]
+                            else:
+                                if "Stage" in header_list[column]:
+                                    if row[column] not in self.ws_doc[wdir]:
+                                        self.ws_doc[wdir].append(row[column]) 
                                                     
-                                            workload_doc['_source'][header_list[column]] = row[column]
+                                workload_doc['_source'][header_list[column]] = row[column]
                                   
-                                    with open("%s/workload-config.xml" % workload_doc['_source']['Workload']) as fd:
-                                        workloadxmldoc = xmltodict.parse(fd.read())
-        
-                                    #xml has stage list, find all
-                                    if isinstance(workloadxmldoc["workload"]["workflow"]["workstage"], list):
-                                        for j in workloadxmldoc["workload"]["workflow"]["workstage"]:
-                                            if j["@name"] in workload_doc['_source']["Stage"]:
-                                                if isinstance(j["work"], list):
-                                                    workload_doc['_source']['Workers'] = j["work"][0]["@workers"]
-                                                else:
-                                                    workload_doc['_source']['Workers'] = j["work"]["@workers"]
-                                                    
-                                    else: #no stage list, only one stage.
-                                        #print (workloadxmldoc["workload"]["workflow"]["workstage"]["@name"])
-                                        if workloadxmldoc["workload"]["workflow"]["workstage"]["@name"] in workload_doc['_source']["Stage"]:
-                                            workload_doc['_source']['Workers'] = workloadxmldoc["workload"]["workflow"]["workstage"]["work"]["@workers"]
+                        stage = workload_doc['_source']["Stage"]
+                        if stage not in workers_by_stage:
+                            workers_by_stage[stage] = lookup_stage_workers(stage_workers, stage)
+                        if workers_by_stage[stage] is not None:
+                            workload_doc['_source']['Workers'] = workers_by_stage[stage]
                                     
-                                    workload_doc["_id"] = hashlib.md5(json.dumps(workload_doc)).hexdigest()
-                                    self.workload_doc_list.append(workload_doc)
-                                    yield workload_doc
+                        workload_doc["_id"] = hashlib.md5(json.dumps(workload_doc).encode()).hexdigest()
+                        self.index_stage(wdir, stage, workload_doc['_source'])
+                        yield workload_doc
         
+    def index_stage(self, workload, stage, source):
+        key = (workload, stage)
+        if key not in self.stage_index:
+            self.stage_index[key] = {"start_time": None, "status": []}
+        stage_entry = self.stage_index[key]
+        stage_entry['status'].append(source.get('Status'))
+        if stage_entry['start_time'] is None and 'date' in source:
+            stage_entry['start_time'] = source['date']
+
 class cosbench_stage_transcriber():
-    def __init__(self, test_id, ws_doc, workload_doc_list):
+    def __init__(self, test_id, ws_doc, stage_index, wide=False, archive_dir=None):
         self.test_id = test_id
+        self.archive_dir = archive_dir if archive_dir is not None else os.getcwd()
         self.workload_stage_dict = ws_doc
-        self.workload_doc_list = workload_doc_list 
+        self.stage_index = stage_index
+        #one document per timestamp row instead of one per metric column
+        self.wide = wide
+
+    def emit_stage_row(self, stagedata_doc, header_list, row, clock):
+        importdoc = {
+            "_index": stagedata_doc['_index'],
+            "_type": stagedata_doc['_type'],
+            "_op_type": stagedata_doc['_op_type'],
+            "_source": dict(stagedata_doc['_source'])
+            }
+        for header_name, value in zip(header_list, row):
+            if "Timestamp" in header_name:
+                importdoc['_source']['date'] = clock.convert(value)
+            elif "@" in header_name:
+                #{"read": {"Op-Count": .., "Avg-ResTime": ..}, "write": {..}}
+                metric_type, op_type = header_name.split(" @ ")
+                importdoc['_source'].setdefault(op_type, {})[metric_type] = parse_stage_value(value)
+            else:
+                importdoc['_source'][header_name] = parse_stage_value(value)
+        importdoc['_id'] = hashlib.md5(json.dumps(importdoc).encode()).hexdigest()
+        return importdoc
         
     def emit_actions(self):
         logger.info("Process Stage data")
         for work, stages in self.workload_stage_dict.items():
             for stage in stages:
-                set_starttime = True
-                stage_status = []
                 process_stage = True
-                for i in self.workload_doc_list: 
-                    if stage in  i["_source"]['Stage'] and work in i["_source"]['Workload']:
-                        stage_status.append(i['_source']['Status'])
-                        if set_starttime: 
-                            stage_starttime = i["_source"]['date']
-                            current_date = datetime.datetime.strptime(stage_starttime, '%Y-%m-%dT%H:%M:%S.%fZ' )
-                            previous_time = current_date.strftime('%H:%M:%S')
-                            set_starttime = False
+                stage_entry = self.stage_index.get((work, stage))
+                if stage_entry is None or stage_entry['start_time'] is None:
+                    logger.warn("No start time for %s in workload %s, skipping stage" % (stage, work))
+                    process_stage = False
+                else:
+                    stage_status = stage_entry['status']
+                    clock = stage_clock(stage_entry['start_time'])
     
                 valid_stagedata = True
                 if process_stage:            
-                    stagefile = "%s/%s.csv" % (os.path.abspath(work), stage)
+                    stagefile = os.path.join(os.path.abspath(self.archive_dir), work, "%s.csv" % stage)
                     #stagedata_doc = copy.deepcopy(maindoc)
-                    stagedata_doc = {"_index": "cosbench_stage_index",
+                    stagedata_doc = {"_index": "cosbench_stage_wide_index" if self.wide else "cosbench_stage_index",
                                      "_type": "cosbench_stage",
                                      "_op_type": "create",
                                      "_source": {
@@ -245,41 +336,29 @@ class cosbench_stage_transcriber():
                                                 header_list.append(current_header)
                                         number_of_columns = len(header_list)
                                     row_count += 1
+                                elif len(row) != len(header_list):
+                                    logger.error("Corrupted data found, omitting data point")
+                                elif self.wide:
+                                    yield self.emit_stage_row(stagedata_doc, header_list, row, clock)
                                 else:
-                                    if len(row) == len(header_list):
-                                        for column in range(number_of_columns):
-                                            if "Timestamp" in header_list[column]:
-                                                current_time = row[column]
-                                                if previous_time > current_time:
-                                                    current_date += timedelta(days=1)
+                                    for column in range(number_of_columns):
+                                        if "Timestamp" in header_list[column]:
+                                            stagedata_doc['_source']['date'] = clock.convert(row[column])
+                                        else:
+                                            header_name = header_list[column]
+                                            if "@" in header_name:
+                                                metric_type, op_type = header_name.split(" @ ")
+                                                stagedata_doc['_source']['op-type'] = op_type
+                                                stagedata_doc['_source']['metric-type'] = metric_type 
+                                                stagedata_doc['_source']['stagedata_metric'] = header_list[column]
+
+                                            stagedata_doc['_source']['stagedata_value'] = parse_stage_value(row[column])
                                             
-                                                str_current_date = current_date.strftime('%Y-%m-%d')
-                                                new_datetime = "%s %s" % (str_current_date, current_time)
-                                                current_datetime = datetime.datetime.strptime(new_datetime, '%Y-%m-%d %H:%M:%S' )
-                                                current_datetime = current_datetime.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-                                                previous_time = current_time
-                                                stagedata_doc['_source']['date'] = current_datetime 
-                                            else:
-                                                header_name = header_list[column]
-                                                if "@" in header_name:
-                                                    metric_type, op_type = header_name.split(" @ ")
-                                                    stagedata_doc['_source']['op-type'] = op_type
-                                                    stagedata_doc['_source']['metric-type'] = metric_type 
-                                                    stagedata_doc['_source']['stagedata_metric'] = header_list[column]
-        
-                                                if "%"in row[column]:
-                                                    sd_value = row[column].strip('%')
-                                                elif "N/A" in row[column]:
-                                                    sd_value = 0 
-                                                else:
-                                                    sd_value = row[column] 
-                                                stagedata_doc['_source']['stagedata_value'] = float(sd_value)
-                                                
-                                                b = copy.deepcopy(stagedata_doc)
-                                                b['_id'] = hashlib.md5(json.dumps(b)).hexdigest()
-                                                yield b
-                                    else:
-                                        logger.error("Corrupted data found, omitting data point")
+                                            #the source only holds flat values, a shallow copy is enough
+                                            b = dict(stagedata_doc)
+                                            b['_source'] = dict(stagedata_doc['_source'])
+                                            b['_id'] = hashlib.md5(json.dumps(b).encode()).hexdigest()
+                                            yield b
                             
 #                         bulk_import(stagedata_actions)
 #                         yield stagedata_actions
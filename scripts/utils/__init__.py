@@ -1 +1 @@
-__all__ = ["common_logging"]
\ No newline at end of file
+__all__ = ["common_logging", "remote_session", "host_inventory", "host_directory", "host_map_cache", "ceph_client", "perf_counters", "summary_store", "fio_timeseries", "pipeline_stats", "synthetic_archive"]
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os, json, time, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("index_cbt")
+
+try:
+    import rados
+except ImportError:
+    rados = None
+
+#read-only commands whose output only changes along with the cluster maps,
+#they are memoized until refresh_epoch() sees a new monmap or osdmap epoch
+cacheable_commands = set([
+    "fsid",
+    "node ls",
+    "osd tree",
+    "osd metadata",
+    "mon metadata",
+    "mds metadata",
+    "mgr metadata",
+    "osd pool ls",
+    "osd crush dump"
+    ])
+
+class ceph_client():
+    def __init__(self, cluster=None, conffile="/etc/ceph/ceph.conf", keyring="/etc/ceph/ceph.client.admin.keyring", timeout=6, max_concurrent=8):
+
+        self.Connection_status = False
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.epoch = None
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+        self.latency = {}
+        self.latency_lock = threading.Lock()
+        self.osd_host_list = []
+        self.osd_list = []
+
+        if cluster is not None:
+            #an already connected cluster handle, or a fake_cluster for offline use
+            self.cluster = cluster
+            self.Connection_status = True
+        elif rados is None:
+            logger.warn("rados not available")
+        elif not os.path.isfile(conffile):
+            logger.warn("%s not found!" % conffile)
+        elif not os.path.isfile(keyring):
+            logger.warn("%s not found!" % keyring)
+        else:
+            self.cluster = rados.Rados(conffile=conffile,
+                                       conf=dict(keyring=keyring),
+                                       )
+            try:
+                self.cluster.connect(timeout=1)
+                self.Connection_status = True
+            except Exception as e:
+                logger.warn("Ceph Client Connection error: %s" % e)
+
+    def record_latency(self, prefix, duration, failed):
+        with self.latency_lock:
+            if prefix not in self.latency:
+                self.latency[prefix] = {"count": 0, "failures": 0, "cache_hits": 0, "total": 0.0, "max": 0.0}
+            stat = self.latency[prefix]
+            if duration is None:
+                stat['cache_hits'] += 1
+                return
+            stat['count'] += 1
+            stat['total'] += duration
+            stat['max'] = max(stat['max'], duration)
+            if failed:
+                stat['failures'] += 1
+
+    def mon_command(self, command, **args):
+        cmd_doc = {"prefix": command, "format": "json"}
+        cmd_doc.update(args)
+        cmd = json.dumps(cmd_doc)
+
+        start = time.time()
+        failed = True
+        try:
+            ret, output, error = self.cluster.mon_command(cmd, b'', timeout=self.timeout)
+            if ret != 0:
+                logger.error("Error issuing command, %s: %s" % (command, error))
+                return None
+            failed = False
+            return json.loads(output)
+        except Exception as e:
+            logger.error("Error issuing command, %s: %s" % (command, e))
+        finally:
+            self.record_latency(command, time.time() - start, failed)
+
+    def issue_command(self, command, **args):
+        if command not in cacheable_commands:
+            return self.mon_command(command, **args)
+
+        key = (command, json.dumps(args, sort_keys=True))
+        with self.cache_lock:
+            if key in self.cache:
+                self.record_latency(command, None, False)
+                return self.cache[key]
+
+        output = self.mon_command(command, **args)
+        if output is not None:
+            with self.cache_lock:
+                self.cache[key] = output
+        return output
+
+    def issue_commands(self, command_list):
+        #independent mon commands are sent together instead of one after another
+        if not command_list:
+            return {}
+        pool = ThreadPoolExecutor(max_workers=min(self.max_concurrent, len(command_list)))
+        try:
+            results = pool.map(self.issue_command, command_list)
+            return dict(zip(command_list, results))
+        finally:
+            pool.shutdown(wait=True)
+
+    def refresh_epoch(self):
+        outputs = self.issue_commands(["mon dump", "osd stat"])
+        mon_dump = outputs["mon dump"] or {}
+        osd_stat = outputs["osd stat"] or {}
+        #some releases nest the osd summary under "osdmap"
+        osd_stat = osd_stat.get('osdmap', osd_stat)
+
+        epoch = (mon_dump.get('epoch'), osd_stat.get('epoch'))
+        if epoch != self.epoch:
+            if self.epoch is not None:
+                logger.debug("cluster epoch changed from %s to %s, dropping cached results" % (self.epoch, epoch))
+            with self.cache_lock:
+                self.cache = {}
+            self.epoch = epoch
+        return mon_dump, osd_stat
+
+    def get_latency_stats(self):
+        with self.latency_lock:
+            summary = {}
+            for prefix, stat in self.latency.items():
+                summary[prefix] = dict(stat)
+                summary[prefix]['average'] = stat['total'] / stat['count'] if stat['count'] else 0
+            return summary
+
+    def log_latency_stats(self):
+        for prefix, stat in sorted(self.get_latency_stats().items()):
+            logger.debug("mon command %s - %s sent, %s cached, %s failed, avg %.3fs, max %.3fs" % (
+                prefix, stat['count'], stat['cache_hits'], stat['failures'], stat['average'], stat['max']))
+
+class fake_cluster():
+    #answers mon commands from canned responses in place of rados.Rados,
+    #responses maps a command prefix to the decoded json it should return
+    def __init__(self, responses, delay=0):
+        self.responses = responses
+        self.delay = delay
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def mon_command(self, cmd, inbuf, timeout=None):
+        prefix = json.loads(cmd)['prefix']
+        with self.lock:
+            self.commands.append(prefix)
+        if self.delay:
+            time.sleep(self.delay)
+        if prefix not in self.responses:
+            return -22, b'', "unrecognized command %s" % prefix
+        return 0, json.dumps(self.responses[prefix]).encode('utf-8'), ""
@@ -1,15 +1,14 @@
 #! /usr/bin/python
 
-import rados
 import sys
 import os
 import logging
 import json, yaml
 import getopt
 import socket
-import paramiko
-from paramiko import SSHClient
 from utils.common_logging import setup_loggers
+from utils import remote_session
+from utils.ceph_client import ceph_client
 from elasticsearch import client
 
 logger = logging.getLogger("index_cbt")
@@ -37,6 +36,8 @@ def main():
     
     setup_loggers(logging.DEBUG)
     new_client = ceph_client()
+    if not new_client.Connection_status:
+        sys.exit(1)
     remoteclient = ssh_remote_command()
     
     
@@ -142,52 +143,14 @@ def get_ceph_service_pid(remoteclient, host, service, id):
     
 class ssh_remote_command():
     def __init__(self):
-          self.sshclient = SSHClient()
+          self.session_pool = remote_session.remote_session_pool(username="root")
     
     def issue_command(self, host, command):
-        
-        try:
-            self.sshclient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            key_path = os.path.expanduser("~/.ssh/authorized_keys")
-            self.sshclient.connect(host, username="root", key_filename=key_path)
-            stdin, stdout, stderr = self.sshclient.exec_command(command)
-            
-            #SSprint stdin.readlines()
-            
-            output = stdout.readlines()
-            #remove trailing \n
-            formated_output = []
-            for i in output:
-                formated_output.append(i.strip('\n'))
-                
-            return formated_output
-        
-        except Exception as e:
-            logger.error("Connection Failed: %s" % e)
+        output = self.session_pool.issue_command(host, command)
+        if output is None:
+            logger.error("Connection Failed: %s" % host)
+        return output
     
-class ceph_client():
-    def __init__(self):
-        self.cluster = rados.Rados(conffile="/etc/ceph/ceph.conf",
-                      conf=dict(keyring='/etc/ceph/ceph.client.admin.keyring'),
-                      )
-        try:
-            self.cluster.connect()
-        except Exception as e:
-            logger.exception("Connection error: %s" % e.strerror )
-            sys.exit(1)
-            
-        self.osd_host_list = []
-        self.osd_list = []
-    
-    def issue_command(self, command):
-        cmd = json.dumps({"prefix": command, "format": "json"})
-        try:
-            _, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
-            return json.loads(output)
-        except Exception as e:
-            logger.exception("Error issuing command")
-            sys.exit(1)
-        
 class cbt_rbd_modifer():
     """
         cbt__rbd_modifer updates the cbt rbd benchmark
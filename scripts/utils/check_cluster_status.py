@@ -1,13 +1,21 @@
 #! /usr/bin/python
 
-import rados, os, logging, json, sys
+import os, logging, json, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.ceph_client import ceph_client
 import logging as logger
 
 def main():
     
     logger.basicConfig(level=logging.DEBUG)
     new_client = ceph_client()
+    if not new_client.Connection_status:
+        logger.error("Unable to connect to the ceph cluster")
+        sys.exit(1)
     ceph_status = new_client.issue_command("status")
+    if ceph_status is None:
+        sys.exit(1)
     health_status = ceph_status['health']
     health_stat = _finditem(health_status, "status")
     health_message = _finditem(health_status, "message")
@@ -34,34 +42,6 @@ def _finditem(obj, key):
        if isinstance(v,dict):
            return _finditem(v, key)
            
-class ceph_client():
-    def __init__(self):
-        
-        if not os.path.exists("/etc/ceph/ceph.conf"):
-            logger.error("/etc/ceph/ceph.conf does not exist")
-        
-            
-        self.cluster = rados.Rados(conffile="/etc/ceph/ceph.conf",
-                      conf=dict(keyring='/etc/ceph/ceph.client.admin.keyring'),
-                      )
-        try:
-            self.cluster.connect()
-        except Exception as e:
-            logger.exception("Connection error: %s" % e.strerror )
-            sys.exit(1)
-            
-        self.osd_host_list = []
-        self.osd_list = []
-    
-    def issue_command(self, command):
-        cmd = json.dumps({"prefix": command, "format": "json"})
-        try:
-            _, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
-            return json.loads(output)
-        except Exception as e:
-            logger.exception("Error issuing command")
-            sys.exit(1)
-            
 if __name__ == '__main__':
     main()
 
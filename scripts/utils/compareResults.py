@@ -1,149 +1,265 @@
 #! /usr/bin/python
 
-import os, sys, json, time, types, copy, hashlib
+import os, sys, json, time, types, copy, hashlib, getopt
+import numpy
 from time import gmtime, strftime
 from elasticsearch import Elasticsearch, helpers
 from decimal import Decimal
 from collections import deque
 import itertools as it
 
+from summary_store import summary_store
+
 def main():
     #get args 
-    
-    print ("test")
-    if len(sys.argv) > 2:
-        t1 = sys.argv[1]
-        t2 = sys.argv[2]
-        host = sys.argv[3]
-        esport = sys.argv[4]
-    else:
-        print ("need more args,  host, port") 
-        sys.exit()
-
-    #setup elasticsearch connection
-    globals()['es'] = Elasticsearch(
-        [host],
-        scheme="http",
-        port=esport,
-        )
+    arguments = argument_handler()
 
+    if arguments.trend:
+        store = summary_store(arguments.store_file)
+        print_trends(store)
+        store.close()
+        return
 
+    #setup elasticsearch connection, without one the comparison is only printed
+    globals()['es'] = None
+    if arguments.host:
+        globals()['es'] = Elasticsearch(
+            [arguments.host],
+            scheme="http",
+            port=arguments.esport,
+            )
 
     #setup elasticsearch main doc
     comparison_results_doc = {}
     comparison_results_doc["_index"] = "cbt-librbdfio-comparison"
     comparison_results_doc["_type"] = "comparisondata"
-    
-    #find all test results 
-#    result = es.search(index="cbt_librbdfio-summary-index", doc_type="fiologfile", size=10000, body={"query": {"match_all": {}}})
-#    print("Test list %d documents found" % result['hits']['total'])
-    
-    # create list of test ids, then create a list of all possible cominations of test results
-#    test_array = []
-#    for item in  result['hits']['hits']:
-#        if item['_source']['test_id'] not in test_array:
-#                test_array.append(item['_source']['test_id'])
-
-#    test_combo = list(it.combinations(test_array, 2))
-    #test_combo = list(it.permutations(test_array, 2))
 
     #evaluate the percent difference between all combinations of test results
-#    for test in test_combo:
-#        compare_result(test[0], test[1], comparison_results_doc)
-    compare_result(t1, t2, comparison_results_doc)
-
-
-def compare_result(test1, test2, headerdoc):
-
-    result_doc = copy.deepcopy(headerdoc)
-    result_doc["_source"] = {}
-    result_doc["_source"]['test1'] = test1
-    result_doc["_source"]['test2'] = test2
-    result_doc["_op_type"] = "create"
-
-    print ("Comparing %s Versus %s " % (test1, test2))
-
-    test1_doc = {}
-    test2_doc = {}
-    operations_array = []
-    object_size_array = []
-
-
-    #get test 1 results
-    index_list="cbt_librbdfio-summary-indextest1-fixed,cbt_radosbench-summary-index"
-    test1_results = es.search(index=index_list, size=10000,  body={"query": {"match": {"ceph_benchmark_test.common.test_info.test_id.keyword": test1}}})
-    print("Test1  %d documents found" % test1_results['hits']['total'])
-
-    #get test 2 results
-    test2_results = es.search(index=index_list, size=10000, body={"query": {"match": {"ceph_benchmark_test.common.test_info.test_id.keyword": test2}}})
-    print("Test2 %d documents found" % test2_results['hits']['total'])
-
-
-    #process test 1 results
-    ft = True
-    for doc in test1_results['hits']['hits']:
-        
-        if "total-iops" in doc['_source']["ceph_benchmark_test"]["test_data"]:
-            operation = doc['_source']["ceph_benchmark_test"]["test_data"]['operation']
-            object_size = doc['_source']["ceph_benchmark_test"]["test_data"]['object_size']
-            total_iops = float(doc['_source']["ceph_benchmark_test"]["test_data"]['total-iops'])
-            if ft:
-                result_doc["_source"]['date'] = doc["_source"]['date']
-                ft = True
-            #print json.dumps(test1_doc, indent=1)
-            if operation not in operations_array:
-                operations_array.append(str(operation))
-            if object_size not in object_size_array:
-                object_size_array.append(object_size)
-    
-            if operation not in test1_doc:
-                test1_doc[operation] = {}
-        
-            test1_doc[operation][object_size] = total_iops
-
-    #process test 2 results
-    for doc in test2_results['hits']['hits']:
-        
-        if "total-iops" in doc['_source']["ceph_benchmark_test"]["test_data"]:
-            operation = doc['_source']["ceph_benchmark_test"]["test_data"]['operation']
-            object_size = doc['_source']["ceph_benchmark_test"]["test_data"]['object_size']
-            total_iops = float(doc['_source']["ceph_benchmark_test"]["test_data"]['total-iops'])
-            
-            if operation not in operations_array:
-                operations_array.append(str(operation))
-            if object_size not in object_size_array:
-                object_size_array.append(object_size)
-            
-            if operation not in test2_doc:
-                test2_doc[operation] = {}
-            test2_doc[operation][object_size] = total_iops
-    
-    object_size_array.sort()
-
-    #perform analysis of results
-    actions = []
-    average_delta_list = []
-    for operation in operations_array:
-        for object_size in object_size_array: 
-            rdelta = round(((test2_doc[operation][object_size] - test1_doc[operation][object_size]) / test1_doc[operation][object_size]) * 100, 3)
-            #print "%s = (%s - %s / %s) * 100" % (rdelta, test2_doc[operation][object_size], test1_doc[operation][object_size], test1_doc[operation][object_size])
-            average_delta_list.append(rdelta) 
-            c_results = copy.deepcopy(result_doc)
-            c_results['_source']['operation'] = operation
-            c_results['_source']['%sKB' % object_size] = rdelta
-
-            c_results["_id"] = hashlib.md5(str(c_results).encode()).hexdigest()
-            a = copy.deepcopy(c_results)
-            actions.append(a)
-            
-    c_results = copy.deepcopy(result_doc)
-    average_delta = round((sum(average_delta_list)/len(average_delta_list)), 3)
-    c_results['_source']['average_delta'] = average_delta
-    c_results["_id"] = hashlib.md5(str(c_results).encode()).hexdigest()
-    a = copy.deepcopy(c_results)
-    actions.append(a)
-
-    deque(helpers.parallel_bulk(es, actions, chunk_size=250, thread_count=1, request_timeout=60), maxlen=0)
+    if arguments.all_orders:
+        test_combo = list(it.permutations(arguments.test_list, 2))
+    else:
+        test_combo = list(it.combinations(arguments.test_list, 2))
+    results = dates = None
+    if arguments.store_file:
+        store = summary_store(arguments.store_file)
+        results, dates = store.get_summary_results(arguments.test_list)
+        store.close()
+    compare_results(arguments.test_list, comparison_results_doc, test_combo, results, dates)
+
+summary_index_list = "cbt_librbdfio-summary-indextest1-fixed,cbt_radosbench-summary-index"
+test_id_field = "ceph_benchmark_test.common.test_info.test_id.keyword"
+test_data_field = "ceph_benchmark_test.test_data"
+
+def get_summary_results(test_id_list, index_list=summary_index_list, page_size=1000):
+    #{test_id: {operation: {object_size: total-iops}}} and {test_id: date}, the
+    #composite aggregation pages through every test/operation/size bucket so
+    #only the numbers come back, however many summary documents there are
+    body = {
+        "size": 0,
+        "query": {"bool": {"filter": [
+            {"terms": {test_id_field: list(test_id_list)}},
+            {"exists": {"field": "%s.total-iops" % test_data_field}}
+            ]}},
+        "aggs": {
+            "summary": {
+                "composite": {
+                    "size": page_size,
+                    "sources": [
+                        {"test_id": {"terms": {"field": test_id_field}}},
+                        {"operation": {"terms": {"field": "%s.operation.keyword" % test_data_field}}},
+                        {"object_size": {"terms": {"field": "%s.object_size" % test_data_field}}}
+                        ]
+                    },
+                "aggs": {
+                    "total_iops": {"avg": {"field": "%s.total-iops" % test_data_field}},
+                    "date": {"min": {"field": "date"}}
+                    }
+                }
+            }
+        }
+
+    results = {}
+    dates = {}
+    while True:
+        response = es.search(index=index_list, body=body)
+        aggregation = response['aggregations']['summary']
+        for bucket in aggregation['buckets']:
+            key = bucket['key']
+            test_results = results.setdefault(key['test_id'], {})
+            test_results.setdefault(str(key['operation']), {})[key['object_size']] = bucket['total_iops']['value']
+
+            date = bucket['date'].get('value_as_string')
+            if date and (key['test_id'] not in dates or date < dates[key['test_id']]):
+                dates[key['test_id']] = date
+
+        if 'after_key' not in aggregation or len(aggregation['buckets']) < page_size:
+            break
+        body['aggs']['summary']['composite']['after'] = aggregation['after_key']
+
+    return results, dates
+
+def build_result_matrix(results, test_id_list):
+    #dense tests x operation x object_size array of total-iops, nan wherever
+    #a test has no result for that operation and size
+    operations_array = sorted(set(operation for test_doc in results.values() for operation in test_doc))
+    object_size_array = sorted(set(object_size for test_doc in results.values()
+                                   for sizes in test_doc.values() for object_size in sizes))
+    operation_index = dict((operation, index) for index, operation in enumerate(operations_array))
+    object_size_index = dict((object_size, index) for index, object_size in enumerate(object_size_array))
+
+    matrix = numpy.full((len(test_id_list), len(operations_array), len(object_size_array)), numpy.nan)
+    for test_index, test_id in enumerate(test_id_list):
+        for operation, sizes in results.get(test_id, {}).items():
+            for object_size, total_iops in sizes.items():
+                matrix[test_index, operation_index[operation], object_size_index[object_size]] = total_iops
+    return matrix, operations_array, object_size_array
+
+def delta_matrix(matrix):
+    #percent delta of every test against every other test as the baseline,
+    #indexed [test1, test2, operation, object_size]
+    baseline = matrix[:, numpy.newaxis, :, :]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        delta = (matrix[numpy.newaxis, :, :, :] - baseline) / baseline * 100
+    delta[~numpy.isfinite(delta)] = numpy.nan
+    return numpy.round(delta, 3)
+
+def average_delta_matrix(delta):
+    #[test1, test2] mean over every operation and size the two tests share
+    valid = ~numpy.isnan(delta)
+    counts = valid.sum(axis=(2, 3))
+    totals = numpy.where(valid, delta, 0).sum(axis=(2, 3))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        average = totals / counts
+    return numpy.round(average, 3), counts
+
+def emit_comparison_actions(headerdoc, test_id_list, test_combo, delta, average, counts, operations_array, object_size_array, dates):
+    test_index = dict((test_id, index) for index, test_id in enumerate(test_id_list))
+    for test1, test2 in test_combo:
+        i, j = test_index[test1], test_index[test2]
+        print ("Comparing %s Versus %s " % (test1, test2))
+        if not counts[i, j]:
+            print ("No common results between %s and %s" % (test1, test2))
+            continue
+
+        result_doc = copy.deepcopy(headerdoc)
+        result_doc["_source"] = {}
+        result_doc["_source"]['test1'] = test1
+        result_doc["_source"]['test2'] = test2
+        result_doc["_op_type"] = "create"
+        if test1 in dates:
+            result_doc["_source"]['date'] = dates[test1]
+
+        for operation_index, operation in enumerate(operations_array):
+            for object_size_index, object_size in enumerate(object_size_array):
+                rdelta = delta[i, j, operation_index, object_size_index]
+                if numpy.isnan(rdelta):
+                    continue
+                c_results = copy.deepcopy(result_doc)
+                c_results['_source']['operation'] = operation
+                c_results['_source']['%sKB' % object_size] = float(rdelta)
+                c_results["_id"] = hashlib.md5(str(c_results).encode()).hexdigest()
+                yield c_results
+
+        c_results = copy.deepcopy(result_doc)
+        c_results['_source']['average_delta'] = float(average[i, j])
+        c_results["_id"] = hashlib.md5(str(c_results).encode()).hexdigest()
+        yield c_results
+
+def compare_results(test_id_list, headerdoc, test_combo=None, results=None, dates=None):
+    #one query for every test, every pair is then a slice of the same arrays
+    if test_combo is None:
+        test_combo = list(it.combinations(test_id_list, 2))
+    if results is None:
+        results, dates = get_summary_results(test_id_list)
+
+    for test_id in test_id_list:
+        print("%s %d results found" % (test_id, sum(len(sizes) for sizes in results.get(test_id, {}).values())))
+
+    matrix, operations_array, object_size_array = build_result_matrix(results, test_id_list)
+    delta = delta_matrix(matrix)
+    average, counts = average_delta_matrix(delta)
+
+    actions = emit_comparison_actions(headerdoc, test_id_list, test_combo, delta, average, counts,
+                                      operations_array, object_size_array, dates or {})
+    if es is None:
+        for action in actions:
+            print (json.dumps(action['_source']))
+    else:
+        deque(helpers.parallel_bulk(es, actions, chunk_size=250, thread_count=1, request_timeout=60), maxlen=0)
+    return delta, average
+
+def print_trends(store):
+    #total-iops of every stored test oldest first, with the change from the test before it
+    for operation, object_size in store.get_trend_keys():
+        print ("%s %s" % (operation, object_size))
+        previous = None
+        for date, test_id, total_iops in store.get_trend(operation, object_size):
+            if total_iops is None:
+                continue
+            change = " %+.3f%%" % ((total_iops - previous) / previous * 100) if previous else ""
+            print ("    %s %s %.2f%s" % (date, test_id, total_iops, change))
+            previous = total_iops
+
+def compare_result(test1, test2, headerdoc, results=None, dates=None):
+    return compare_results([test1, test2], headerdoc, [(test1, test2)], results, dates)
+
+class argument_handler():
+    def __init__(self):
+        self.test_list = []
+        self.host = ""
+        self.esport = ""
+        self.all_orders = False
+        self.store_file = None
+        self.trend = False
+
+        usage = """
+                Usage:
+                    compareResults.py -l <test1,test2,test3> -h <host> -p <port>
+                    compareResults.py -l <test1,test2,test3> -s <summary store>
+                    compareResults.py -T -s <summary store>
+                    compareResults.py <test1> <test2> <host> <port>
+
+                    -l or --test-list - comma seperated list of tests, every pair is compared
+                    -h or --host - Elasticsearch host ip or hostname
+                    -p or --port - Elasticsearch port (elasticsearch default is 9200)
+                    -a or --all-orders - compare each pair both ways round
+                    -s or --store - read the results from a local summary store written by index_cbt,
+                                    without -h and -p the comparison is printed instead of indexed
+                    -T or --trend - print the total-iops of every test in the summary store for each
+                                    operation and object size, oldest first
+                """
+        try:
+            opts, args = getopt.getopt(sys.argv[1:], 'l:h:p:s:aT', ['test-list=', 'host=', 'port=', 'store=', 'all-orders', 'trend'])
+        except getopt.GetoptError:
+            print (usage)
+            sys.exit(1)
+
+        for opt, arg in opts:
+            if opt in ('-l', '--test-list'):
+                self.test_list = [test_id for test_id in arg.split(',') if test_id]
+            if opt in ('-h', '--host'):
+                self.host = arg
+            if opt in ('-p', '--port'):
+                self.esport = arg
+            if opt in ('-a', '--all-orders'):
+                self.all_orders = True
+            if opt in ('-s', '--store'):
+                self.store_file = arg
+            if opt in ('-T', '--trend'):
+                self.trend = True
+
+        if not opts and len(args) == 4:
+            #original form, two test ids followed by host and port
+            self.test_list = args[:2]
+            self.host, self.esport = args[2:]
+
+        if self.trend:
+            if not self.store_file:
+                print (usage)
+                sys.exit(1)
+        elif len(self.test_list) < 2 or bool(self.host) != bool(self.esport) or not (self.host or self.store_file):
+            print (usage)
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+import os, logging
+import numpy
+
+logger = logging.getLogger("index_cbt")
+
+#fio log lines are "time (ms), value, data direction, block size[, offset]".
+#cbt sets log_avg_msec, so each value is already an average over its window
+def load_fio_log(log_file):
+    try:
+        data = numpy.loadtxt(log_file, delimiter=',', usecols=(0, 1), ndmin=2)
+    except (IOError, OSError, ValueError) as e:
+        logger.warn("Unable to read fio log %s, %s" % (log_file, e))
+        return numpy.empty((0, 2))
+    return data
+
+def log_metric(log_file):
+    #<prefix>_<metric>.<job>.log[.<host>]
+    return os.path.basename(log_file).split('_')[1].split('.')[0]
+
+def per_second(data, length=None):
+    #sum of values and number of samples in every whole second since the job started
+    if not len(data):
+        return numpy.zeros(length or 0), numpy.zeros(length or 0)
+    seconds = (data[:, 0] // 1000).astype(int)
+    minlength = length or 0
+    return (numpy.bincount(seconds, weights=data[:, 1], minlength=minlength),
+            numpy.bincount(seconds, minlength=minlength))
+
+def log_job(log_file):
+    #the job a log belongs to, the same for all of its metrics
+    dir_name, file_name = os.path.split(log_file)
+    prefix, rest = file_name.split('_', 1)
+    return (dir_name, prefix, rest.split('.', 1)[1])
+
+def cluster_series(iops_logs, lat_logs):
+    #cluster wide iops and iops weighted mean latency for every second of one test.
+    #every job log starts at its job's start, so the jobs of a test line up on elapsed time
+    iops_data = dict((log_job(log_file), load_fio_log(log_file)) for log_file in iops_logs)
+    lat_data = [(log_job(log_file), load_fio_log(log_file)) for log_file in lat_logs]
+    length = max([int(data[:, 0].max() // 1000) + 1 for data in list(iops_data.values()) + [data for job, data in lat_data] if len(data)] or [0])
+
+    iops = numpy.zeros(length)
+    job_iops = {}
+    for job, data in iops_data.items():
+        totals, samples = per_second(data, length)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            job_iops[job] = numpy.where(samples > 0, totals / samples, 0)
+        iops += job_iops[job]
+
+    lat_weighted = numpy.zeros(length)
+    lat_weights = numpy.zeros(length)
+    for job, data in lat_data:
+        totals, samples = per_second(data, length)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            job_latency = numpy.where(samples > 0, totals / samples, 0)
+        #a job without an iops log counts once for every second it has samples
+        weights = numpy.where(samples > 0, job_iops.get(job, 1), 0)
+        lat_weighted += job_latency * weights
+        lat_weights += weights
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        latency = numpy.where(lat_weights > 0, lat_weighted / lat_weights, numpy.nan)
+
+    return iops, latency
+
+def steady_state_bounds(iops, warmup=None, cooldown=None, ramp_fraction=0.5):
+    #explicit warmup/cooldown seconds win, otherwise the steady state runs from
+    #the first to the last second that reaches ramp_fraction of the median
+    if not len(iops):
+        return 0, 0
+    if warmup is None or cooldown is None:
+        active = iops[iops > 0]
+        if not len(active):
+            return 0, 0
+        above = numpy.nonzero(iops >= ramp_fraction * numpy.median(active))[0]
+    start = warmup if warmup is not None else int(above[0])
+    end = len(iops) - cooldown if cooldown is not None else int(above[-1]) + 1
+    return start, max(start, end)
+
+def stall_runs(iops, threshold):
+    #lengths of every run of consecutive seconds below threshold
+    below = numpy.concatenate(([0], (iops < threshold).astype(int), [0]))
+    edges = numpy.diff(below)
+    return numpy.nonzero(edges == -1)[0] - numpy.nonzero(edges == 1)[0]
+
+class steady_state():
+    #steady state per second values of one test configuration, pooled over
+    #every iteration of it
+    def __init__(self, warmup=None, cooldown=None, stall_fraction=0.1):
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.stall_fraction = stall_fraction
+        self.iops = []
+        self.latency = []
+        self.stalls = []
+        self.seconds = 0
+
+    def add_series(self, iops, latency):
+        start, end = steady_state_bounds(iops, self.warmup, self.cooldown)
+        if end <= start:
+            return
+        steady_iops = iops[start:end]
+        steady_latency = latency[start:end]
+        self.iops.append(steady_iops)
+        self.latency.append(steady_latency[~numpy.isnan(steady_latency)])
+        #stalls are judged against the series' own level, not the pooled one
+        self.stalls.append(stall_runs(steady_iops, self.stall_fraction * numpy.median(steady_iops)))
+        self.seconds += end - start
+
+    def summary(self, percentiles=(1, 5, 50, 95, 99)):
+        iops = numpy.concatenate(self.iops) if self.iops else numpy.empty(0)
+        latency = numpy.concatenate(self.latency) if self.latency else numpy.empty(0)
+        stalls = numpy.concatenate(self.stalls) if self.stalls else numpy.empty(0, dtype=int)
+        summary = {
+            "series": len(self.iops),
+            "seconds": int(self.seconds),
+            "stall_count": int(len(stalls)),
+            "stall_seconds": int(stalls.sum()),
+            "longest_stall": int(stalls.max()) if len(stalls) else 0
+            }
+        for name, values in (("iops", iops), ("latency", latency)):
+            if not len(values):
+                continue
+            mean = float(values.mean())
+            stdev = float(values.std(ddof=1)) if len(values) > 1 else 0.0
+            summary[name] = {
+                "mean": mean,
+                "stdev": stdev,
+                "cv": stdev / mean * 100 if mean else 0.0,
+                "max": float(values.max())
+                }
+            for percentile, value in zip(percentiles, numpy.percentile(values, percentiles)):
+                summary[name]["p%s" % percentile] = float(value)
+        return summary, iops
+
+def ks_statistic(a, b):
+    #two sample kolmogorov-smirnov distance between the per second values
+    if not len(a) or not len(b):
+        return None
+    a = numpy.sort(a)
+    b = numpy.sort(b)
+    values = numpy.concatenate((a, b))
+    cdf_a = numpy.searchsorted(a, values, side='right') / float(len(a))
+    cdf_b = numpy.searchsorted(b, values, side='right') / float(len(b))
+    return float(numpy.abs(cdf_a - cdf_b).max())
+
+def compare_steady_state(baseline, candidate, stall_tolerance=0):
+    #percent delta of every statistic, candidate against baseline
+    baseline_summary, baseline_iops = baseline.summary()
+    candidate_summary, candidate_iops = candidate.summary()
+
+    delta = {}
+    for name in ("iops", "latency"):
+        if name not in baseline_summary or name not in candidate_summary:
+            continue
+        delta[name] = {}
+        for stat, value in baseline_summary[name].items():
+            if value:
+                delta[name][stat] = round((candidate_summary[name][stat] - value) / value * 100, 3)
+
+    return {
+        "baseline": baseline_summary,
+        "candidate": candidate_summary,
+        "delta": delta,
+        "ks_iops": ks_statistic(baseline_iops, candidate_iops),
+        "new_stalls": candidate_summary['stall_count'] - baseline_summary['stall_count'] > stall_tolerance
+        }
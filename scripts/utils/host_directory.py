@@ -0,0 +1,81 @@
+import logging
+
+logger = logging.getLogger("index_cbt")
+
+class host_directory():
+    #exact lookups over a host_map, built once and shared by every analyzer.
+    #a host can be found by its host_map key (fqdn), its short name, any of
+    #its interface addresses or any extra alias registered for it
+    def __init__(self, host_map, aliases=None):
+        self.host_map = host_map
+        self.alias_index = {}
+        self.ambiguous_aliases = set()
+        self.pid_index = {}
+
+        for host, host_info in host_map.items():
+            self.add_alias(host, host)
+            self.add_alias(host.split('.')[0], host)
+
+            for address_list in host_info.get('interfaces', {}).values():
+                for address in address_list:
+                    self.add_alias(address.split('/')[0], host)
+
+            self.pid_index[host] = {}
+            for child in host_info.get('children', []):
+                pid = str(child.get('service_pid', "-1"))
+                if pid != "-1":
+                    self.pid_index[host][pid] = (child['service_type'], child['service_id'])
+
+        if aliases:
+            for alias, host in aliases.items():
+                if host in host_map:
+                    self.add_alias(alias, host)
+
+    def add_alias(self, alias, host):
+        if not alias:
+            return
+        #a host_map key always names its own host
+        if alias == host:
+            self.alias_index[alias] = host
+            self.ambiguous_aliases.discard(alias)
+            return
+        if alias in self.ambiguous_aliases:
+            return
+        current = self.alias_index.get(alias)
+        if current is None:
+            self.alias_index[alias] = host
+        elif current != host and current != alias:
+            #e.g. the same short name in two domains, refuse to guess
+            logger.debug("%s is ambiguous between %s and %s" % (alias, current, host))
+            del self.alias_index[alias]
+            self.ambiguous_aliases.add(alias)
+
+    def resolve(self, name):
+        if name is None:
+            return None
+        host = self.alias_index.get(name)
+        if host is None and '.' in name:
+            host = self.alias_index.get(name.split('.')[0])
+        return host
+
+    def get_host_info(self, name):
+        host = self.resolve(name)
+        if host is None:
+            return {}
+        return self.host_map[host]
+
+    def get_host_type(self, name):
+        host_info = self.get_host_info(name)
+        return host_info.get('host_type_list', "UNKNOWN")
+
+    def get_service(self, name, pid):
+        host = self.resolve(name)
+        if host is None:
+            return None
+        return self.pid_index[host].get(str(pid))
+
+    def get_service_id(self, name, pid):
+        service = self.get_service(name, pid)
+        if service is None:
+            return -1
+        return service[1]
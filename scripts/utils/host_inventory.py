@@ -0,0 +1,123 @@
+import os, logging
+
+logger = logging.getLogger("index_cbt")
+
+#everything discovery needs from a host, gathered in a single remote invocation
+#with each section introduced by a marker line
+section_marker = "@@inventory@@"
+inventory_script = "; ".join([
+    "echo '%s fqdn'" % section_marker,
+    "hostname -f",
+    "echo '%s lscpu'" % section_marker,
+    "lscpu",
+    "echo '%s ip'" % section_marker,
+    "ip a",
+    "echo '%s ps'" % section_marker,
+    "ps -eo pid=,args= | grep -E '[c]eph-(osd|mon|mds|mgr)|[r]adosgw'",
+    "true"
+    ])
+
+ceph_process_types = {
+    "ceph-osd": "osd",
+    "ceph-mon": "mon",
+    "ceph-mds": "mds",
+    "ceph-mgr": "mgr",
+    "radosgw": "rgw"
+    }
+
+def split_sections(output):
+    sections = {}
+    current = None
+    for line in output:
+        if line.startswith(section_marker):
+            current = line[len(section_marker):].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return sections
+
+def parse_lscpu(output):
+    cpu_info_dict = {}
+    for line in output:
+        seperated_line = line.split(":", 1)
+        if len(seperated_line) < 2:
+            continue
+        cpu_prop = seperated_line[0].strip()
+        cpu_prop_value = seperated_line[1].strip()
+
+        if "NUMA node" in cpu_prop and "CPU(s)" in cpu_prop:
+            cpu_info_dict[cpu_prop] = []
+            split_values = cpu_prop_value.split(",")
+            for value in split_values:
+                cpu_info_dict[cpu_prop].append(value)
+        elif "Flags" not in cpu_prop:
+            cpu_info_dict[cpu_prop] = cpu_prop_value
+    return cpu_info_dict
+
+def parse_ip_addr(output):
+    interface_dict = {}
+    interface_name = None
+    for line in output:
+        seperated_line = line.split(" ")
+
+        #Get interface name
+        if seperated_line[0].strip(":").isdigit() and len(seperated_line) > 1:
+            interface_name = seperated_line[1]
+            interface_dict[interface_name] = []
+
+        #Get IPv4 for interface
+        if "inet" in seperated_line and interface_name is not None:
+            ipindex = seperated_line.index("inet") + 1
+            if ipindex < len(seperated_line):
+                interface_dict[interface_name].append(seperated_line[ipindex])
+    #return a dict of all interfaces:IPaddresses
+    return interface_dict
+
+def parse_ceph_processes(output):
+    #{service_type: {service_id: pid}} from "pid args" lines
+    daemon_dict = {}
+    for line in output:
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        pid = fields[0]
+        service_type = ceph_process_types.get(os.path.basename(fields[1]))
+        if service_type is None:
+            continue
+
+        service_id = None
+        args = fields[2:]
+        for index, arg in enumerate(args):
+            if arg in ("--id", "-i") and index + 1 < len(args):
+                service_id = args[index + 1]
+            elif arg.startswith("--id="):
+                service_id = arg.split("=", 1)[1]
+            elif arg in ("--name", "-n") and index + 1 < len(args):
+                service_id = args[index + 1].split(".", 1)[-1]
+
+        if service_id is not None:
+            daemon_dict.setdefault(service_type, {})[service_id] = pid
+    return daemon_dict
+
+def parse_inventory(output):
+    sections = split_sections(output)
+    if "fqdn" not in sections:
+        return None
+
+    fqdn = sections["fqdn"][0].strip() if sections["fqdn"] else None
+    return {
+        "fqdn": fqdn,
+        "cpu_info": parse_lscpu(sections.get("lscpu", [])),
+        "interfaces": parse_ip_addr(sections.get("ip", [])),
+        "daemons": parse_ceph_processes(sections.get("ps", []))
+        }
+
+def probe_host(remoteclient, host, timeout=None):
+    output = remoteclient.issue_command(host, inventory_script, timeout=timeout, label="inventory")
+    if not output:
+        return None
+
+    inventory = parse_inventory(output)
+    if inventory is None:
+        logger.warn("Unexpected inventory output from %s" % host)
+    return inventory
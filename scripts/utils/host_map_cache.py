@@ -0,0 +1,104 @@
+import os, time, json, logging
+
+logger = logging.getLogger("index_cbt")
+
+def cluster_fingerprint(ceph_client, client_list):
+    #fsid and map epochs change whenever daemons are added, removed or moved,
+    #the client list comes from cbt_config.yaml
+    mon_dump, osd_stat = ceph_client.refresh_epoch()
+
+    return {
+        "fsid": mon_dump.get('fsid'),
+        "monmap_epoch": mon_dump.get('epoch'),
+        "osdmap_epoch": osd_stat.get('epoch'),
+        "clients": sorted(client_list or [])
+        }
+
+class host_map_cache():
+    #persistent per-cluster record of what discovery found for every host,
+    #keyed by the host name the cluster (or cbt_config.yaml) reports
+    def __init__(self, cache_dir=None, pid_ttl=3600):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "automated_ceph_test")
+        self.cache_dir = cache_dir
+        self.pid_ttl = pid_ttl
+        self.fingerprint = None
+        self.hosts = {}
+
+    def cache_file(self, fsid):
+        return os.path.join(self.cache_dir, "host_map-%s.json" % fsid)
+
+    def load(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.hosts = {}
+        if not fingerprint['fsid']:
+            return False
+
+        cache_file = self.cache_file(fingerprint['fsid'])
+        if not os.path.isfile(cache_file):
+            return False
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            logger.warn("Ignoring unreadable host map cache %s, %s" % (cache_file, e))
+            return False
+
+        self.hosts = cached.get('hosts', {})
+        #an exact match means the cluster layout has not changed since the last run
+        return cached.get('fingerprint') == fingerprint
+
+    def is_fresh(self, host, daemon_list, is_client):
+        cached = self.hosts.get(host)
+        if cached is None or cached['errors']:
+            return False
+        if cached['is_client'] != is_client:
+            return False
+        if sorted(map(tuple, cached['daemons'])) != sorted(map(tuple, daemon_list)):
+            return False
+        #pids change whenever a daemon restarts, even if the layout does not
+        return time.time() - cached['discovered'] < self.pid_ttl
+
+    def all_fresh(self):
+        return bool(self.hosts) and all(
+            self.is_fresh(host, cached['daemons'], cached['is_client']) for host, cached in self.hosts.items())
+
+    def get(self, host):
+        cached = self.hosts[host]
+        return cached['fqdn'], cached['entry'], []
+
+    def get_daemon_map(self):
+        return dict((host, [tuple(d) for d in cached['daemons']]) for host, cached in self.hosts.items())
+
+    def get_client_list(self):
+        return [host for host, cached in self.hosts.items() if cached['is_client']]
+
+    def update(self, host, daemon_list, is_client, result):
+        host_fqdn, host_entry, errors = result
+        self.hosts[host] = {
+            "fqdn": host_fqdn,
+            "entry": host_entry,
+            "errors": errors,
+            "daemons": [list(d) for d in daemon_list],
+            "is_client": is_client,
+            "discovered": time.time()
+            }
+
+    def prune(self, current_hosts):
+        for host in list(self.hosts):
+            if host not in current_hosts:
+                del self.hosts[host]
+
+    def save(self):
+        if not self.fingerprint or not self.fingerprint['fsid']:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            cache_file = self.cache_file(self.fingerprint['fsid'])
+            tmp_file = "%s.tmp" % cache_file
+            with open(tmp_file, 'w') as f:
+                f.write(json.dumps({"fingerprint": self.fingerprint, "hosts": self.hosts}, indent=1))
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            logger.warn("Unable to save host map cache, %s" % e)
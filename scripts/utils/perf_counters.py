@@ -0,0 +1,273 @@
+import json, fnmatch, logging
+
+logger = logging.getLogger("index_cbt")
+
+#every admin socket command for a host runs in one remote invocation, the
+#output of each is introduced by a marker line naming the osd and command
+frame_marker = "@@perf@@"
+
+def admin_socket_script(request_list):
+    script = []
+    for osd, command in request_list:
+        script.append("echo '%s %s %s'" % (frame_marker, osd, command))
+        script.append("ceph daemon osd.%s %s 2>/dev/null" % (osd, command))
+    script.append("echo '%s end'" % frame_marker)
+    return "; ".join(script)
+
+def parse_admin_socket_frames(output, host=None):
+    #{(osd, command): decoded json or None}
+    frames = {}
+    current = None
+    lines = []
+
+    def close_frame():
+        if current is None:
+            return
+        if not lines:
+            #the osd is down or has no admin socket on this host
+            logger.debug("no %s output for osd.%s on %s" % (current[1], current[0], host))
+            frames[current] = None
+            return
+        try:
+            frames[current] = json.loads("".join(lines))
+        except ValueError as e:
+            logger.warn("Unable to parse %s for osd.%s on %s: %s" % (current[1], current[0], host, e))
+            frames[current] = None
+
+    for line in output:
+        if line.startswith(frame_marker):
+            close_frame()
+            lines = []
+            header = line[len(frame_marker):].strip().split(" ", 1)
+            current = (header[0], header[1]) if len(header) == 2 else None
+        elif current is not None:
+            lines.append(line)
+    close_frame()
+    return frames
+
+#perf counter type bits, as reported by "perf schema"
+PERFCOUNTER_TIME = 0x1
+PERFCOUNTER_U64 = 0x2
+PERFCOUNTER_LONGRUNAVG = 0x4
+PERFCOUNTER_COUNTER = 0x8
+PERFCOUNTER_HISTOGRAM = 0x10
+
+def counter_kinds(perf_schema):
+    #"section.name" -> counter, average, gauge or histogram
+    kinds = {}
+    for section, section_schema in perf_schema.items():
+        for name, schema in section_schema.items():
+            key = "%s.%s" % (section, name)
+            counter_type = schema.get('type', 0)
+            if counter_type & PERFCOUNTER_HISTOGRAM:
+                kinds[key] = "histogram"
+            elif counter_type & PERFCOUNTER_LONGRUNAVG:
+                kinds[key] = "average"
+            elif counter_type & PERFCOUNTER_COUNTER or schema.get('metric_type') == "counter":
+                kinds[key] = "counter"
+            else:
+                kinds[key] = "gauge"
+    return kinds
+
+def flatten_perf_dump(perf_dump, whitelist=None):
+    #plain numbers stay numbers, avgcount/sum pairs become (avgcount, sum)
+    counters = {}
+    for section, section_counters in perf_dump.items():
+        if not isinstance(section_counters, dict):
+            continue
+        for name, value in section_counters.items():
+            key = "%s.%s" % (section, name)
+            if whitelist and not any(fnmatch.fnmatchcase(key, pattern) for pattern in whitelist):
+                continue
+            if isinstance(value, dict):
+                if "avgcount" in value and "sum" in value:
+                    counters[key] = (value['avgcount'], value['sum'])
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                counters[key] = value
+    return counters
+
+class counter_processor():
+    #keeps the previous sample of every osd and turns the next one into
+    #per interval values. only what changed over the interval is reported
+    def __init__(self, whitelist=None):
+        self.whitelist = whitelist
+        self.previous = {}
+        self.kinds = {}
+
+    def has_schema(self, osd):
+        return osd in self.kinds
+
+    def set_schema(self, osd, perf_schema):
+        #a schema frame that is missing or didn't decode is asked for again next tick
+        if perf_schema is None:
+            return
+        self.kinds[osd] = counter_kinds(perf_schema)
+
+    def process(self, osd, perf_dump, timestamp):
+        counters = flatten_perf_dump(perf_dump, self.whitelist)
+        previous = self.previous.get(osd)
+        self.previous[osd] = (timestamp, counters)
+        if previous is None:
+            #first sample only sets the baseline
+            return None
+
+        previous_timestamp, previous_counters = previous
+        interval = timestamp - previous_timestamp
+        if interval <= 0:
+            return None
+
+        kinds = self.kinds.get(osd, {})
+        rates = {}
+        latencies = {}
+        gauges = {}
+        resets = 0
+        for key, value in counters.items():
+            previous_value = previous_counters.get(key)
+            if previous_value is None:
+                continue
+
+            if isinstance(value, tuple):
+                delta_count = value[0] - previous_value[0]
+                delta_sum = value[1] - previous_value[1]
+                if delta_count < 0 or delta_sum < 0:
+                    resets += 1
+                elif delta_count > 0:
+                    latencies[key] = {
+                        "ops": delta_count,
+                        "ops_per_sec": delta_count / interval,
+                        "avg": delta_sum / delta_count
+                        }
+                continue
+
+            if value == previous_value:
+                continue
+            #without a schema everything numeric is treated as a counter
+            if kinds.get(key, "counter") == "gauge":
+                gauges[key] = value
+            elif value < previous_value:
+                resets += 1
+            else:
+                delta = value - previous_value
+                rates[key] = {"delta": delta, "rate": delta / interval}
+
+        if resets:
+            #the osd restarted, or a counter was reset with "perf reset"
+            logger.debug("osd.%s: %s counters went backwards" % (osd, resets))
+
+        return {
+            "interval": interval,
+            "counters": rates,
+            "latency": latencies,
+            "gauges": gauges,
+            "counter_resets": resets
+            }
+
+def axis_upper_bounds(axis):
+    #upper edge of every bucket along one histogram axis, None for the last
+    #bucket which is open ended. bucket 0 holds everything below min
+    if axis.get('ranges'):
+        return [bucket.get('max') if index < len(axis['ranges']) - 1 else None
+                for index, bucket in enumerate(axis['ranges'])]
+
+    axis_min = axis.get('min', 0)
+    quant_size = axis.get('quant_size', 1)
+    bounds = [axis_min]
+    for index in range(1, axis['buckets'] - 1):
+        if axis.get('scale_type') == "log2":
+            bounds.append(axis_min + quant_size * (1 << (index - 1)))
+        else:
+            bounds.append(axis_min + quant_size * index)
+    bounds.append(None)
+    return bounds
+
+def histogram_delta(values, previous_values):
+    #None when the shape changed or a bucket went backwards (osd restart)
+    if len(values) != len(previous_values):
+        return None
+    delta = []
+    for row, previous_row in zip(values, previous_values):
+        if len(row) != len(previous_row):
+            return None
+        delta_row = [count - previous_count for count, previous_count in zip(row, previous_row)]
+        if any(count < 0 for count in delta_row):
+            return None
+        delta.append(delta_row)
+    return delta
+
+def sparse_encode(values):
+    #[[row, column, count], ...] for the non zero cells only
+    return [[row_index, column_index, count]
+            for row_index, row in enumerate(values)
+            for column_index, count in enumerate(row) if count]
+
+def histogram_percentiles(values, bounds, percentiles):
+    #values are summed over the second axis, percentiles are the upper edge of
+    #the first axis bucket where the running total crosses the percentile
+    totals = [sum(row) for row in values]
+    total = sum(totals)
+    results = {}
+    if not total:
+        return results
+
+    for percentile in percentiles:
+        target = total * percentile / 100.0
+        running = 0
+        for index, count in enumerate(totals):
+            running += count
+            if running >= target:
+                bound = bounds[index] if index < len(bounds) else None
+                if bound is None:
+                    #open ended last bucket, report its lower edge
+                    bound = bounds[index - 1] if index > 0 else 0
+                results["p%s" % str(percentile).replace(".", "_")] = bound
+                break
+    return results
+
+class histogram_processor():
+    #turns successive "perf histogram dump" outputs into per interval
+    #histograms, sparse encoded, with percentiles along the latency axis
+    def __init__(self, whitelist=None, percentiles=(50, 90, 95, 99, 99.9)):
+        self.whitelist = whitelist
+        self.percentiles = percentiles
+        self.previous = {}
+
+    def process(self, osd, histogram_dump):
+        if not histogram_dump:
+            return None
+        histograms = {}
+        for section, section_histograms in histogram_dump.items():
+            if not isinstance(section_histograms, dict):
+                continue
+            for name, histogram in section_histograms.items():
+                key = "%s.%s" % (section, name)
+                if self.whitelist and not any(fnmatch.fnmatchcase(key, pattern) for pattern in self.whitelist):
+                    continue
+                if 'axes' in histogram and 'values' in histogram:
+                    histograms[key] = histogram
+
+        previous = self.previous.get(osd)
+        self.previous[osd] = dict((key, histogram['values']) for key, histogram in histograms.items())
+        if previous is None:
+            return None
+
+        results = {}
+        for key, histogram in histograms.items():
+            if key not in previous:
+                continue
+            delta = histogram_delta(histogram['values'], previous[key])
+            if delta is None:
+                logger.debug("osd.%s: histogram %s was reset" % (osd, key))
+                continue
+            ops = sum(sum(row) for row in delta)
+            if not ops:
+                continue
+
+            axes = [dict((field, axis.get(field)) for field in ('name', 'min', 'quant_size', 'buckets', 'scale_type'))
+                    for axis in histogram['axes']]
+            results[key] = {
+                "ops": ops,
+                "axes": axes,
+                "cells": sparse_encode(delta),
+                "percentiles": histogram_percentiles(delta, axis_upper_bounds(histogram['axes'][0]), self.percentiles)
+                }
+        return results
@@ -0,0 +1,218 @@
+import time, json, hashlib, threading, logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("index_cbt")
+
+#time spent on elasticsearch's behalf rather than a transcriber's
+client_context = ("elasticsearch", None)
+
+#stages that contain the others, they are reported without the nested stages
+#and "emit" without them is reported as doc_build
+outer_stages = {"discover": "discover", "emit": "doc_build"}
+
+def transcriber_source(transcriber):
+    for attribute in ('csv_file', 'json_file', 'result_file', 'config_file', 'raw_log', 'run_history_file'):
+        source = getattr(transcriber, attribute, None)
+        if isinstance(source, str):
+            return source
+    return None
+
+class pipeline_stats():
+    #counters and timers for every stage of the indexing pipeline, broken down
+    #by the transcriber and source file being worked on. does nothing until
+    #enabled so the scribes can call it unconditionally
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.start = None
+        self.stages = {}
+        self.nested = {}
+        self.context = ("pipeline", None)
+
+    def enable(self):
+        self.enabled = True
+        self.start = time.time()
+
+    def reset(self):
+        #a forked worker starts over with its own counters, and a lock
+        #that no thread of the parent can be holding
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.nested = {}
+        self.context = ("pipeline", None)
+
+    def snapshot(self):
+        #the raw counters, for a worker process to hand back to its parent
+        with self.lock:
+            return (dict((key, list(value)) for key, value in self.stages.items()), dict(self.nested))
+
+    def merge(self, snapshot):
+        stages, nested = snapshot
+        with self.lock:
+            for key, (count, seconds, nbytes) in stages.items():
+                entry = self.stages.setdefault(key, [0, 0.0, 0])
+                entry[0] += count
+                entry[1] += seconds
+                entry[2] += nbytes
+            for key, seconds in nested.items():
+                self.nested[key] = self.nested.get(key, 0.0) + seconds
+
+    def set_context(self, transcriber, source=None):
+        self.context = (transcriber, source)
+
+    def add(self, stage, seconds, count=1, nbytes=0, source=None, context=None):
+        if not self.enabled:
+            return
+        transcriber, context_source = context or self.context
+        key = (stage, transcriber, source or context_source)
+        with self.lock:
+            if key not in self.stages:
+                self.stages[key] = [0, 0.0, 0]
+            entry = self.stages[key]
+            entry[0] += count
+            entry[1] += seconds
+            entry[2] += nbytes
+            if stage not in outer_stages:
+                nested_key = (transcriber, context_source)
+                self.nested[nested_key] = self.nested.get(nested_key, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage, source=None, nbytes=0, context=None):
+        if not self.enabled:
+            yield
+            return
+        context = context or self.context
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start, nbytes=nbytes, source=source, context=context)
+
+    def timed_iter(self, stage, iterable):
+        #times every step of an iterator, the consumer's own work is not counted
+        if not self.enabled:
+            return iterable
+        return self.timed_generator(stage, iter(iterable))
+
+    def timed_generator(self, stage, iterator):
+        while True:
+            context = self.context
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.time() - start, count=0, context=context)
+                return
+            self.add(stage, time.time() - start, context=context)
+            yield item
+
+    def document_id(self, doc):
+        if not self.enabled:
+            return hashlib.md5(str(doc).encode()).hexdigest()
+        start = time.time()
+        doc_id = hashlib.md5(str(doc).encode()).hexdigest()
+        self.add("id_hash", time.time() - start)
+        return doc_id
+
+    def instrument_client(self, es):
+        #bulk requests and their serialization run on the bulk helper's threads
+        bulk = es.bulk
+
+        def timed_bulk(*args, **kwargs):
+            body = kwargs.get('body', args[0] if args else "")
+            if isinstance(body, (list, tuple)):
+                nbytes = sum(len(line) for line in body)
+            else:
+                nbytes = len(body or "")
+            start = time.time()
+            try:
+                return bulk(*args, **kwargs)
+            finally:
+                self.add("bulk_send", time.time() - start, nbytes=nbytes, context=client_context)
+
+        es.bulk = timed_bulk
+        es.transport.serializer = timed_serializer(es.transport.serializer, self, client_context)
+
+    def report(self):
+        stages = {}
+        transcribers = {}
+        sources = {}
+        outer = {}
+
+        def accumulate(summary, stage, count, seconds, nbytes):
+            entry = summary.setdefault(stage, {"count": 0, "seconds": 0.0, "bytes": 0})
+            entry['count'] += count
+            entry['seconds'] += seconds
+            entry['bytes'] += nbytes
+
+        with self.lock:
+            entries = [(key, list(value)) for key, value in self.stages.items()]
+            nested = dict(self.nested)
+
+        for (stage, transcriber, source), (count, seconds, nbytes) in entries:
+            if stage in outer_stages:
+                outer[(outer_stages[stage], transcriber, source)] = (count, seconds)
+                continue
+            accumulate(stages, stage, count, seconds, nbytes)
+            accumulate(transcribers.setdefault(transcriber, {}), stage, count, seconds, nbytes)
+            if source:
+                accumulate(sources.setdefault(source, {"transcriber": transcriber}), stage, count, seconds, nbytes)
+
+        for (stage, transcriber, source), (count, seconds) in outer.items():
+            own_seconds = max(0.0, seconds - nested.get((transcriber, source), 0.0))
+            accumulate(stages, stage, count, own_seconds, 0)
+            accumulate(transcribers.setdefault(transcriber, {}), stage, count, own_seconds, 0)
+            if source:
+                accumulate(sources.setdefault(source, {"transcriber": transcriber}), stage, count, own_seconds, 0)
+
+        return {
+            "wall_time": time.time() - self.start if self.start else 0.0,
+            "documents": stages.get("doc_build", {}).get("count", 0),
+            "stages": stages,
+            "transcribers": transcribers,
+            "sources": sources
+            }
+
+    def log_summary(self, top=10, log=None):
+        log = log or logger
+        report = self.report()
+        wall_time = report['wall_time'] or 1.0
+        log.info("Pipeline stats - %s documents in %.2fs" % (report['documents'], report['wall_time']))
+        #bulk_send and serialize run on several threads and can exceed the wall time
+        for stage, entry in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+            log.info("  %-12s %10.3fs %6.1f%% %10s calls %10.2f MB" % (
+                stage, entry['seconds'], entry['seconds'] / wall_time * 100, entry['count'], entry['bytes'] / 1048576.0))
+
+        def busiest(summary):
+            return sorted(summary.items(), key=lambda item: -sum(
+                entry['seconds'] for stage, entry in item[1].items() if isinstance(entry, dict) and stage not in ("bulk_send", "serialize")))
+
+        for transcriber, transcriber_stages in busiest(report['transcribers'])[:top]:
+            log.info("  %s: %s" % (transcriber, ", ".join(
+                "%s %.3fs" % (stage, entry['seconds']) for stage, entry in sorted(transcriber_stages.items()))))
+        for source, source_stages in busiest(report['sources'])[:top]:
+            log.info("  %s: %s" % (source, ", ".join(
+                "%s %.3fs" % (stage, entry['seconds']) for stage, entry in sorted(source_stages.items()) if isinstance(entry, dict))))
+        return report
+
+    def write_report(self, report_file):
+        with open(report_file, 'w') as f:
+            f.write(json.dumps(self.report(), indent=4, sort_keys=True))
+
+class timed_serializer():
+    def __init__(self, serializer, stats, context):
+        self.serializer = serializer
+        self.stats = stats
+        self.context = context
+
+    def dumps(self, data):
+        start = time.time()
+        output = self.serializer.dumps(data)
+        self.stats.add("serialize", time.time() - start, nbytes=len(output), context=self.context)
+        return output
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+#the one instance shared by index_cbt, the analyzers and the scribes
+stats = pipeline_stats()
@@ -0,0 +1,238 @@
+#! /usr/bin/python
+
+import sys, json, copy, hashlib, getopt
+import numpy
+from elasticsearch import Elasticsearch, helpers
+from collections import deque
+import itertools as it
+
+from compareResults import summary_index_list, test_id_field, test_data_field
+from summary_store import summary_store
+
+def main():
+    arguments = argument_handler()
+
+    globals()['es'] = None
+    if arguments.host:
+        globals()['es'] = Elasticsearch(
+            [arguments.host],
+            scheme="http",
+            port=arguments.esport,
+            )
+
+    headerdoc = {}
+    headerdoc["_index"] = "cbt-regression-analysis"
+    headerdoc["_type"] = "regressiondata"
+
+    test_combo = list(it.combinations(arguments.test_list, 2))
+    if arguments.store_file:
+        store = summary_store(arguments.store_file)
+        values, dates = store.get_iteration_values(arguments.test_list)
+        store.close()
+    else:
+        values, dates = get_iteration_values(arguments.test_list)
+    analysis = analyze_regressions(arguments.test_list, test_combo, values,
+                                   resamples=arguments.resamples, confidence=arguments.confidence,
+                                   threshold=arguments.threshold, seed=arguments.seed)
+
+    for result in analysis:
+        if result['verdict'] == "regression":
+            print ("REGRESSION %s -> %s %s %s: %.3f%% (%.3f%% to %.3f%%)" % (
+                result['test1'], result['test2'], result['operation'], result['object_size'],
+                result['delta'], result['ci_low'], result['ci_high']))
+
+    actions = emit_actions(headerdoc, analysis, dates)
+    if es is None:
+        for action in actions:
+            print (json.dumps(action['_source']))
+        return
+    deque(helpers.parallel_bulk(es, actions, chunk_size=250, thread_count=1, request_timeout=60), maxlen=0)
+
+def get_iteration_values(test_id_list, index_list=summary_index_list, page_size=1000):
+    #{test_id: {operation: {object_size: [total-iops of each iteration]}}}, summary
+    #documents written before iteration-iops existed fall back to their mean
+    fields = ["%s.%s" % (test_data_field, field) for field in ("operation", "object_size", "total-iops", "iteration-iops")]
+    results = es.search(
+        index=index_list,
+        size=page_size,
+        scroll='2m',
+        _source=fields + ["date", test_id_field.replace(".keyword", "")],
+        body={"query": {"bool": {"filter": [
+            {"terms": {test_id_field: list(test_id_list)}},
+            {"exists": {"field": "%s.total-iops" % test_data_field}}
+            ]}}})
+
+    #one summary per test, operation, object size and index, the way the summary
+    #store keys them. a reindexed duplicate would otherwise count its iterations twice
+    documents = {}
+    dates = {}
+    page_data = results
+    try:
+        while page_data['hits']['hits']:
+            for doc in page_data['hits']['hits']:
+                source = doc['_source']
+                test_id = source['ceph_benchmark_test']['common']['test_info']['test_id']
+                test_data = source['ceph_benchmark_test']['test_data']
+                key = (test_id, str(test_data['operation']), test_data['object_size'], doc['_index'])
+                if key in documents:
+                    continue
+                iteration_iops = test_data.get('iteration-iops') or [test_data['total-iops']]
+                documents[key] = [float(value) for value in iteration_iops]
+                if 'date' in source and (test_id not in dates or source['date'] < dates[test_id]):
+                    dates[test_id] = source['date']
+            page_data = es.scroll(scroll_id=page_data['_scroll_id'], scroll='2m')
+    finally:
+        es.clear_scroll(scroll_id=page_data['_scroll_id'])
+
+    values = {}
+    for (test_id, operation, object_size, index), iteration_iops in sorted(documents.items()):
+        sizes = values.setdefault(test_id, {}).setdefault(operation, {})
+        sizes.setdefault(object_size, []).extend(iteration_iops)
+
+    return values, dates
+
+def build_iteration_array(values, test_id_list):
+    #tests x operation x object_size x iteration, nan padded, plus the
+    #number of iterations in every cell
+    operations_array = sorted(set(operation for test_doc in values.values() for operation in test_doc))
+    object_size_array = sorted(set(object_size for test_doc in values.values()
+                                   for sizes in test_doc.values() for object_size in sizes))
+    max_iterations = max([len(iops) for test_doc in values.values()
+                          for sizes in test_doc.values() for iops in sizes.values()] or [1])
+
+    samples = numpy.full((len(test_id_list), len(operations_array), len(object_size_array), max_iterations), numpy.nan)
+    counts = numpy.zeros(samples.shape[:3], dtype=int)
+    for test_index, test_id in enumerate(test_id_list):
+        for operation_index, operation in enumerate(operations_array):
+            for object_size_index, object_size in enumerate(object_size_array):
+                iops = values.get(test_id, {}).get(operation, {}).get(object_size, [])
+                samples[test_index, operation_index, object_size_index, :len(iops)] = iops
+                counts[test_index, operation_index, object_size_index] = len(iops)
+    return samples, counts, operations_array, object_size_array
+
+def bootstrap_means(samples, counts, resamples, rng):
+    #resampled means of every cell at once, [test, operation, object_size, resample].
+    #each cell draws only from its own iterations, padding is never picked
+    draw = rng.random(counts.shape + (resamples, samples.shape[-1]))
+    picks = numpy.floor(draw * numpy.maximum(counts, 1)[..., numpy.newaxis, numpy.newaxis]).astype(int)
+    drawn = numpy.take_along_axis(samples[..., numpy.newaxis, :], picks, axis=-1)
+    in_cell = numpy.arange(samples.shape[-1]) < counts[..., numpy.newaxis, numpy.newaxis]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(in_cell, drawn, 0).sum(axis=-1) / counts[..., numpy.newaxis]
+
+def analyze_regressions(test_id_list, test_combo, values, resamples=2000, confidence=0.95, threshold=2.0, seed=None):
+    rng = numpy.random.default_rng(seed)
+    samples, counts, operations_array, object_size_array = build_iteration_array(values, test_id_list)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        means = numpy.nansum(samples, axis=-1) / counts
+    boot = bootstrap_means(samples, counts, resamples, rng)
+
+    lower_percentile = (1 - confidence) / 2 * 100
+    upper_percentile = 100 - lower_percentile
+    test_index = dict((test_id, index) for index, test_id in enumerate(test_id_list))
+
+    analysis = []
+    for test1, test2 in test_combo:
+        i, j = test_index[test1], test_index[test2]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            delta = (means[j] - means[i]) / means[i] * 100
+            boot_delta = (boot[j] - boot[i]) / boot[i] * 100
+            ci_low, ci_high = numpy.percentile(boot_delta, [lower_percentile, upper_percentile], axis=-1)
+
+        for operation_index, operation in enumerate(operations_array):
+            for object_size_index, object_size in enumerate(object_size_array):
+                cell = (operation_index, object_size_index)
+                n1, n2 = counts[i][cell], counts[j][cell]
+                if not n1 or not n2 or not numpy.isfinite(delta[cell]):
+                    continue
+
+                if n1 < 2 or n2 < 2:
+                    verdict = "insufficient iterations"
+                elif ci_high[cell] < 0 and delta[cell] <= -threshold:
+                    verdict = "regression"
+                elif ci_low[cell] > 0 and delta[cell] >= threshold:
+                    verdict = "improvement"
+                else:
+                    verdict = "no change"
+
+                analysis.append({
+                    "test1": test1,
+                    "test2": test2,
+                    "operation": operation,
+                    "object_size": object_size,
+                    "delta": round(float(delta[cell]), 3),
+                    "ci_low": round(float(ci_low[cell]), 3),
+                    "ci_high": round(float(ci_high[cell]), 3),
+                    "confidence": confidence,
+                    "iterations1": int(n1),
+                    "iterations2": int(n2),
+                    "verdict": verdict
+                    })
+    return analysis
+
+def emit_actions(headerdoc, analysis, dates):
+    for result in analysis:
+        importdoc = copy.deepcopy(headerdoc)
+        importdoc["_op_type"] = "create"
+        importdoc["_source"] = dict(result)
+        if result['test1'] in dates:
+            importdoc["_source"]['date'] = dates[result['test1']]
+        importdoc["_id"] = hashlib.md5(str(importdoc).encode()).hexdigest()
+        yield importdoc
+
+class argument_handler():
+    def __init__(self):
+        self.test_list = []
+        self.host = ""
+        self.esport = ""
+        self.resamples = 2000
+        self.confidence = 0.95
+        self.threshold = 2.0
+        self.seed = None
+        self.store_file = None
+
+        usage = """
+                Usage:
+                    regression_analyzer.py -l <test1,test2,test3> -h <host> -p <port>
+
+                    -l or --test-list - comma seperated list of tests, every pair is analyzed
+                    -h or --host - Elasticsearch host ip or hostname
+                    -p or --port - Elasticsearch port (elasticsearch default is 9200)
+                    -b or --resamples - bootstrap resamples per comparison (default 2000)
+                    -c or --confidence - confidence level of the interval (default 0.95)
+                    -t or --threshold - smallest percent delta reported as a change (default 2.0)
+                    -s or --seed - random seed, for repeatable intervals
+                    -S or --store - read the results from a local summary store written by index_cbt,
+                                    without -h and -p the analysis is printed instead of indexed
+                """
+        try:
+            opts, _ = getopt.getopt(sys.argv[1:], 'l:h:p:b:c:t:s:S:', ['test-list=', 'host=', 'port=', 'resamples=', 'confidence=', 'threshold=', 'seed=', 'store='])
+        except getopt.GetoptError:
+            print (usage)
+            sys.exit(1)
+
+        for opt, arg in opts:
+            if opt in ('-l', '--test-list'):
+                self.test_list = [test_id for test_id in arg.split(',') if test_id]
+            if opt in ('-h', '--host'):
+                self.host = arg
+            if opt in ('-p', '--port'):
+                self.esport = arg
+            if opt in ('-b', '--resamples'):
+                self.resamples = int(arg)
+            if opt in ('-c', '--confidence'):
+                self.confidence = float(arg)
+            if opt in ('-t', '--threshold'):
+                self.threshold = float(arg)
+            if opt in ('-s', '--seed'):
+                self.seed = int(arg)
+            if opt in ('-S', '--store'):
+                self.store_file = arg
+
+        if len(self.test_list) < 2 or bool(self.host) != bool(self.esport) or not (self.host or self.store_file):
+            print (usage)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
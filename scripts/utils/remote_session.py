@@ -0,0 +1,252 @@
+import os, time, logging, threading, subprocess, getpass, signal
+
+logger = logging.getLogger("index_cbt")
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+
+class remote_command_error(Exception):
+    pass
+
+
+class openssh_session():
+    #one multiplexed OpenSSH control master per host, every command after the
+    #first runs as a new channel on the already authenticated connection
+    def __init__(self, host, username=None, connect_timeout=10, persist=300, control_dir=None):
+        self.host = host
+        self.username = username
+        self.connect_timeout = connect_timeout
+        self.persist = persist
+        if control_dir is None:
+            control_dir = "/tmp/act-ssh-%s" % getpass.getuser()
+        #sessions for different hosts are created concurrently by the discovery workers
+        os.makedirs(control_dir, 0o700, exist_ok=True)
+        #%C is a hash of the connection, keeps the socket path short
+        self.control_path = os.path.join(control_dir, "%C")
+
+    def ssh_command(self, *args):
+        command = ['ssh',
+                   '-o', 'BatchMode=yes',
+                   '-o', 'ControlMaster=auto',
+                   '-o', 'ControlPath=%s' % self.control_path,
+                   '-o', 'ControlPersist=%s' % self.persist,
+                   '-o', 'ConnectTimeout=%d' % self.connect_timeout]
+        if self.username:
+            command += ['-l', self.username]
+        return command + list(args)
+
+    def run(self, command, timeout=None):
+        proc = subprocess.Popen(self.ssh_command(self.host, command),
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            output, error = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise remote_command_error("timed out after %s seconds" % timeout)
+        #255 is reserved by ssh for connection failures
+        if proc.returncode == 255:
+            raise remote_command_error(error.decode('utf-8', 'replace').strip())
+        return output.decode('utf-8', 'replace')
+
+    def is_active(self):
+        #ControlMaster=auto brings a new master up if the old one went away,
+        #so there is no need to pay for an "ssh -O check" before each command
+        return True
+
+    def close(self):
+        subprocess.call(self.ssh_command('-O', 'exit', self.host),
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class paramiko_session():
+    #one paramiko transport per host, commands are opened as channels on it
+    def __init__(self, host, username=None, key_filename=None, connect_timeout=10):
+        if paramiko is None:
+            raise remote_command_error("paramiko not available")
+        self.host = host
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect(host, username=username, key_filename=key_filename, timeout=connect_timeout)
+
+    def run(self, command, timeout=None):
+        _, stdout, _ = self.client.exec_command(command, timeout=timeout)
+        try:
+            output = stdout.read()
+        except Exception as e:
+            raise remote_command_error(str(e))
+        return output.decode('utf-8', 'replace')
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        self.client.close()
+
+
+class local_session():
+    #runs commands on this machine in place of a remote host, lets the remote
+    #execution paths be exercised without an ssh server
+    def __init__(self, host, shell="/bin/sh"):
+        self.host = host
+        self.shell = shell
+        self.closed = False
+
+    def run(self, command, timeout=None):
+        proc = subprocess.Popen([self.shell, '-c', command], start_new_session=True,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            output, _ = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            #take down the whole process group, not just the shell
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            raise remote_command_error("timed out after %s seconds" % timeout)
+        return output.decode('utf-8', 'replace')
+
+    def is_active(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+session_types = {
+    "openssh": openssh_session,
+    "paramiko": paramiko_session,
+    "local": local_session
+    }
+
+
+class remote_session_pool():
+    def __init__(self, session_type="openssh", max_channels_per_host=8, max_commands=64, idle_timeout=300, **session_args):
+        self.session_class = session_types[session_type]
+        self.session_args = session_args
+        self.max_channels_per_host = max_channels_per_host
+        self.idle_timeout = idle_timeout
+
+        self.sessions = {}
+        self.last_used = {}
+        self.in_use = {}
+        self.host_locks = {}
+        self.host_channels = {}
+        self.pool_lock = threading.Lock()
+        self.command_slots = threading.BoundedSemaphore(max_commands)
+
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def get_host_lock(self, host):
+        with self.pool_lock:
+            if host not in self.host_locks:
+                self.host_locks[host] = threading.Lock()
+                self.host_channels[host] = threading.BoundedSemaphore(self.max_channels_per_host)
+                self.in_use[host] = 0
+            return self.host_locks[host]
+
+    def get_session(self, host):
+        #connections are opened under a per host lock so a slow handshake
+        #does not block commands to other hosts
+        with self.get_host_lock(host):
+            session = self.sessions.get(host)
+            if session is not None and not session.is_active():
+                logger.debug("session to %s is no longer active, reconnecting" % host)
+                session = None
+            if session is None:
+                session = self.session_class(host, **self.session_args)
+                self.sessions[host] = session
+            return session
+
+    def evict_idle(self):
+        now = time.time()
+        with self.pool_lock:
+            idle_hosts = [host for host in self.sessions
+                          if self.in_use[host] == 0 and now - self.last_used.get(host, now) > self.idle_timeout]
+            idle_sessions = [self.sessions.pop(host) for host in idle_hosts]
+        for session in idle_sessions:
+            logger.debug("closing idle session to %s" % session.host)
+            session.close()
+
+    def record(self, host, label, duration, failed):
+        with self.stats_lock:
+            host_stats = self.stats.setdefault(host, {})
+            if label not in host_stats:
+                host_stats[label] = {"count": 0, "failures": 0, "total": 0.0, "min": None, "max": 0.0}
+            stat = host_stats[label]
+            stat['count'] += 1
+            stat['total'] += duration
+            stat['max'] = max(stat['max'], duration)
+            stat['min'] = duration if stat['min'] is None else min(stat['min'], duration)
+            if failed:
+                stat['failures'] += 1
+
+    def run(self, host, command, timeout=None, label=None):
+        if label is None:
+            label = command.split()[0] if command.split() else command
+        self.evict_idle()
+        self.get_host_lock(host)
+
+        with self.command_slots, self.host_channels[host]:
+            with self.pool_lock:
+                self.in_use[host] += 1
+            start = time.time()
+            failed = True
+            try:
+                try:
+                    output = self.get_session(host).run(command, timeout)
+                except remote_command_error:
+                    raise
+                except Exception as e:
+                    #drop the session so the next command reconnects
+                    with self.pool_lock:
+                        session = self.sessions.pop(host, None)
+                    if session is not None:
+                        session.close()
+                    raise remote_command_error(str(e))
+                failed = False
+                return output
+            finally:
+                self.record(host, label, time.time() - start, failed)
+                with self.pool_lock:
+                    self.in_use[host] -= 1
+                    self.last_used[host] = time.time()
+
+    def issue_command(self, host, command, timeout=None, label=None):
+        #same contract as the ssh_remote_command classes, a list of lines or None
+        try:
+            output = self.run(host, command, timeout, label)
+        except remote_command_error as e:
+            logger.warn("Remote command failed on %s: %s" % (host, e))
+            return None
+
+        if output:
+            return output.splitlines()
+        else:
+            logger.warn("nothing returned from remote command")
+
+    def get_stats(self):
+        with self.stats_lock:
+            summary = {}
+            for host, host_stats in self.stats.items():
+                summary[host] = {}
+                for label, stat in host_stats.items():
+                    summary[host][label] = dict(stat)
+                    summary[host][label]['average'] = stat['total'] / stat['count']
+            return summary
+
+    def log_stats(self):
+        for host, host_stats in sorted(self.get_stats().items()):
+            for label, stat in sorted(host_stats.items()):
+                logger.debug("%s %s - %s commands, %s failed, avg %.3fs, max %.3fs" % (
+                    host, label, stat['count'], stat['failures'], stat['average'], stat['max']))
+
+    def close(self):
+        with self.pool_lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            session.close()
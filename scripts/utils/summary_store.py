@@ -0,0 +1,131 @@
+import os, json, sqlite3, logging
+
+logger = logging.getLogger("index_cbt")
+
+#summary documents are recognised by the field every summary scribe writes
+summary_field = "total-iops"
+
+schema = """
+CREATE TABLE IF NOT EXISTS summary (
+    test_id TEXT NOT NULL,
+    source_index TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    object_size INTEGER NOT NULL,
+    total_iops REAL,
+    date TEXT,
+    test_data TEXT,
+    PRIMARY KEY (test_id, source_index, operation, object_size)
+);
+CREATE TABLE IF NOT EXISTS iteration (
+    test_id TEXT NOT NULL,
+    source_index TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    object_size INTEGER NOT NULL,
+    iteration INTEGER NOT NULL,
+    iops REAL,
+    PRIMARY KEY (test_id, source_index, operation, object_size, iteration)
+);
+CREATE INDEX IF NOT EXISTS summary_operation ON summary (operation, object_size);
+CREATE INDEX IF NOT EXISTS summary_date ON summary (date);
+"""
+
+class summary_store():
+    #local sqlite copy of the benchmark summary documents, so comparisons and
+    #trend reports can run without elasticsearch. re-indexing a test replaces
+    #its rows instead of duplicating them
+    def __init__(self, store_file, commit_every=500):
+        self.store_file = store_file
+        self.commit_every = commit_every
+        self.pending = 0
+        self.recorded = 0
+
+        store_dir = os.path.dirname(os.path.abspath(store_file))
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        self.connection = sqlite3.connect(store_file)
+        self.connection.executescript(schema)
+
+    def record(self, action):
+        source = action.get('_source', {})
+        try:
+            test_id = source['ceph_benchmark_test']['common']['test_info']['test_id']
+            test_data = source['ceph_benchmark_test']['test_data']
+        except (KeyError, TypeError):
+            return False
+        if not isinstance(test_data, dict) or summary_field not in test_data:
+            return False
+
+        key = (test_id, action.get('_index', ""), str(test_data['operation']), test_data['object_size'])
+        self.connection.execute("INSERT OR REPLACE INTO summary VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                key + (test_data[summary_field], source.get('date'), json.dumps(test_data)))
+        self.connection.execute("DELETE FROM iteration WHERE test_id = ? AND source_index = ? AND operation = ? AND object_size = ?", key)
+        self.connection.executemany("INSERT INTO iteration VALUES (?, ?, ?, ?, ?, ?)",
+                                    [key + (index, iops) for index, iops in enumerate(test_data.get('iteration-iops', []))])
+
+        self.recorded += 1
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+        return True
+
+    def record_actions(self, actions):
+        #passes every action through, keeping a copy of the summaries. the
+        #scribes reuse their document between yields so it is stored right away
+        for action in actions:
+            self.record(action)
+            yield action
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+        if self.recorded:
+            logger.info("%s summary documents stored in %s" % (self.recorded, self.store_file))
+
+    def test_filter(self, test_id_list):
+        return "test_id IN (%s)" % ", ".join("?" * len(test_id_list)), list(test_id_list)
+
+    def get_summary_results(self, test_id_list):
+        #same shape as compareResults.get_summary_results
+        where, args = self.test_filter(test_id_list)
+        results = {}
+        dates = {}
+        cursor = self.connection.execute(
+            "SELECT test_id, operation, object_size, AVG(total_iops), MIN(date) FROM summary "
+            "WHERE %s GROUP BY test_id, operation, object_size" % where, args)
+        for test_id, operation, object_size, total_iops, date in cursor:
+            results.setdefault(test_id, {}).setdefault(operation, {})[object_size] = total_iops
+            if date and (test_id not in dates or date < dates[test_id]):
+                dates[test_id] = date
+        return results, dates
+
+    def get_iteration_values(self, test_id_list):
+        #same shape as regression_analyzer.get_iteration_values, summaries
+        #without iteration values fall back to their total
+        where, args = self.test_filter(test_id_list)
+        values = {}
+        dates = {}
+        cursor = self.connection.execute(
+            "SELECT s.test_id, s.operation, s.object_size, s.total_iops, s.date, i.iops FROM summary s "
+            "LEFT JOIN iteration i USING (test_id, source_index, operation, object_size) "
+            "WHERE s.%s ORDER BY s.test_id, s.source_index, s.operation, s.object_size, i.iteration" % where, args)
+        for test_id, operation, object_size, total_iops, date, iops in cursor:
+            sizes = values.setdefault(test_id, {}).setdefault(operation, {})
+            sizes.setdefault(object_size, []).append(total_iops if iops is None else iops)
+            if date and (test_id not in dates or date < dates[test_id]):
+                dates[test_id] = date
+        return values, dates
+
+    def get_trend_keys(self):
+        #every operation and object size with stored results
+        return self.connection.execute(
+            "SELECT DISTINCT operation, object_size FROM summary ORDER BY operation, object_size").fetchall()
+
+    def get_trend(self, operation, object_size):
+        #[(date, test_id, total_iops)] oldest first, for trend reports
+        return self.connection.execute(
+            "SELECT MIN(date), test_id, AVG(total_iops) FROM summary WHERE operation = ? AND object_size = ? "
+            "GROUP BY test_id ORDER BY MIN(date)", (operation, object_size)).fetchall()
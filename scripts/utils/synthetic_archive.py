@@ -0,0 +1,386 @@
+#! /usr/bin/python
+
+import os, sys, json, time, random, getopt
+import datetime, statistics
+import yaml
+
+#writes cbt and cosbench archives in the layout the analyzers and scribes
+#expect, so the indexers can be measured without a lab run
+
+def write_lines(file_name, lines):
+    with open(file_name, 'w') as f:
+        f.write("\n".join(lines))
+        f.write("\n")
+
+def write_yaml(file_name, doc):
+    with open(file_name, 'w') as f:
+        yaml.safe_dump(doc, f, default_flow_style=False)
+
+class cbt_archive_writer():
+    def __init__(self, archive_dir, clients=2, osd_hosts=3, volumes=2, iterations=1, duration=60,
+                 modes=("randread", "randwrite"), op_sizes=(4096, 65536), rados_op_sizes=(4194304,),
+                 rados_instances=1, pbench_tools=("iostat", "sar", "pidstat"), pbench_hosts=None,
+                 benchmarks=("librbdfio", "radosbench"), seed=0):
+        self.archive_dir = archive_dir
+        self.clients = ["client%s" % index for index in range(1, clients + 1)]
+        self.osd_hosts = ["osd%s" % index for index in range(1, osd_hosts + 1)]
+        self.volumes = volumes
+        self.iterations = iterations
+        self.duration = duration
+        self.modes = list(modes)
+        self.op_sizes = list(op_sizes)
+        self.rados_op_sizes = list(rados_op_sizes)
+        self.rados_instances = rados_instances
+        self.pbench_tools = list(pbench_tools)
+        #every client and osd host runs the pbench tools unless limited
+        self.pbench_hosts = (self.clients + self.osd_hosts)[:pbench_hosts] if pbench_hosts is not None else self.clients + self.osd_hosts
+        self.benchmarks = list(benchmarks)
+        self.random = random.Random(seed)
+        self.start_time = time.time() - iterations * duration * 10
+        self.test_count = 0
+
+    def write(self):
+        results_dir = os.path.join(self.archive_dir, "results")
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        self.write_cbt_config()
+
+        for iteration in range(self.iterations):
+            iteration_dir = os.path.join(results_dir, "%08d" % iteration)
+            if "librbdfio" in self.benchmarks:
+                for mode in self.modes:
+                    for op_size in self.op_sizes:
+                        self.write_fio_test(self.test_dir(iteration_dir), iteration, mode, op_size)
+            if "radosbench" in self.benchmarks:
+                for op_size in self.rados_op_sizes:
+                    self.write_rados_test(self.test_dir(iteration_dir), iteration, op_size)
+        return self.archive_dir
+
+    def test_dir(self, iteration_dir):
+        self.test_count += 1
+        test_dir = os.path.join(iteration_dir, "id-%08x" % self.random.getrandbits(32))
+        os.makedirs(test_dir)
+        return test_dir
+
+    def next_start(self):
+        #tests run one after another, with a short gap between them
+        start = self.start_time
+        self.start_time += self.duration + 10
+        return start
+
+    def write_cbt_config(self):
+        benchmarks = {}
+        if "librbdfio" in self.benchmarks:
+            benchmarks['librbdfio'] = {
+                "time": self.duration,
+                "mode": self.modes,
+                "op_size": self.op_sizes,
+                "volumes_per_client": self.volumes,
+                "log_avg_msec": 1000
+                }
+        if "radosbench" in self.benchmarks:
+            benchmarks['radosbench'] = {
+                "time": self.duration,
+                "op_size": self.rados_op_sizes,
+                "concurrent_procs": self.rados_instances,
+                "write_only": False,
+                "readmode": "seq"
+                }
+        write_yaml(os.path.join(self.archive_dir, "cbt_config.yaml"), {
+            "cluster": {
+                "user": "root",
+                "head": self.clients[0],
+                "clients": self.clients,
+                "osds": self.osd_hosts,
+                "mons": {self.osd_hosts[0]: {"a": "127.0.0.1:6789"}},
+                "iterations": self.iterations
+                },
+            "benchmarks": benchmarks
+            })
+
+    def write_fio_test(self, test_dir, iteration, mode, op_size):
+        write_yaml(os.path.join(test_dir, "benchmark_config.yaml"), {"cluster": {
+            "benchmark": "librbdfio",
+            "iteration": iteration,
+            "mode": mode,
+            "op_size": op_size,
+            "time": self.duration,
+            "volumes_per_client": self.volumes
+            }})
+
+        start = self.next_start()
+        base_iops = 200000.0 * 4096 / op_size / (len(self.clients) * self.volumes)
+        for client in self.clients:
+            for volume in range(self.volumes):
+                prefix = "output.%s.%s" % (volume, client)
+                iops = [max(0.0, self.random.gauss(base_iops, base_iops * 0.05)) for _ in range(self.duration)]
+                direction = 0 if "read" in mode else 1
+
+                write_lines(os.path.join(test_dir, "%s_iops.1.log" % prefix),
+                            ["%d, %d, %d, %d" % (second * 1000 + 1000, value, direction, op_size) for second, value in enumerate(iops)])
+                write_lines(os.path.join(test_dir, "%s_lat.1.log" % prefix),
+                            ["%d, %d, %d, %d" % (second * 1000 + 1000, 1e9 / max(value, 1.0), direction, op_size) for second, value in enumerate(iops)])
+
+                mean_iops = sum(iops) / len(iops)
+                job = {"jobname": "librbdfio-%s" % volume, "read": {"iops": 0.0, "bw": 0}, "write": {"iops": 0.0, "bw": 0}}
+                job["read" if direction == 0 else "write"] = {"iops": mean_iops, "bw": int(mean_iops * op_size / 1024)}
+                with open(os.path.join(test_dir, "json_%s" % prefix), 'w') as f:
+                    f.write(json.dumps({
+                        "fio version": "fio-3.1",
+                        "timestamp": int(start + self.duration),
+                        "timestamp_ms": int((start + self.duration) * 1000),
+                        "time": time.ctime(start + self.duration),
+                        "global options": {"bs": "%sB" % op_size, "runtime": str(self.duration), "rw": mode, "ioengine": "rbd"},
+                        "jobs": [job]
+                        }, indent=2))
+
+        self.write_pbench(test_dir, start)
+
+    def write_rados_test(self, test_dir, iteration, op_size):
+        write_yaml(os.path.join(test_dir, "benchmark_config.yaml"), {"cluster": {
+            "benchmark": "radosbench",
+            "iteration": iteration,
+            "op_size": op_size,
+            "time": self.duration,
+            "concurrent_procs": self.rados_instances,
+            "write_only": False,
+            "readmode": "seq"
+            }})
+
+        for phase in ("write", "seq"):
+            phase_dir = os.path.join(test_dir, phase)
+            os.makedirs(phase_dir)
+            start = self.next_start()
+            for client in self.clients:
+                for instance in range(self.rados_instances):
+                    self.write_rados_output(phase_dir, phase, "%s.%s" % (instance, client), op_size, start)
+            self.write_pbench(phase_dir, start)
+
+    def write_rados_output(self, phase_dir, phase, name, op_size, start):
+        bandwidth = 400.0 / (len(self.clients) * self.rados_instances)
+        header = "  sec Cur ops   started  finished  avg MB/s  cur MB/s last lat(s)  avg lat(s)"
+        if phase == "write":
+            lines = ["hints = 1",
+                     "Maintaining 16 concurrent writes of %s bytes to objects of size %s for up to %s seconds or 0 objects" % (op_size, op_size, self.duration),
+                     "Object prefix: benchmark_data_%s" % name,
+                     header]
+        else:
+            lines = ["hints = 1", header]
+
+        #every instance runs a little faster or slower, the json summary is
+        #computed from the same per second samples as the text output
+        mean_bandwidth = bandwidth * self.random.gauss(1.0, 0.03)
+        finished = 0
+        bandwidth_samples = []
+        latency_samples = []
+        for second in range(self.duration):
+            if second and second % 20 == 0:
+                #rados bench repeats a timestamp and the header every 20 seconds
+                stamp = datetime.datetime.utcfromtimestamp(start + second).strftime('%Y-%m-%d %H:%M:%S.%f')
+                lines.append("%s min lat: %.6f max lat: %.6f avg lat: %.6f" % (
+                    stamp, min(latency_samples), max(latency_samples), statistics.mean(latency_samples)))
+                lines.append(header)
+            current = max(0.01, self.random.gauss(mean_bandwidth, mean_bandwidth * 0.1))
+            #16 ops in flight, so latency follows throughput
+            latency = 16 * op_size / (current * 1048576) * self.random.lognormvariate(0, 0.1)
+            bandwidth_samples.append(current)
+            latency_samples.append(latency)
+            finished += int(current * 1048576 / op_size)
+            average = finished * op_size / 1048576.0 / max(second, 1)
+            lines.append("%5d %7d %9d %9d %9.4f %9.4f %11s %11.6f" % (
+                second, 16, finished + 16, finished, average, current, "-" if not second else "%.6f" % latency,
+                statistics.mean(latency_samples)))
+        lines.append("Total time run:         %s" % self.duration)
+        write_lines(os.path.join(phase_dir, "output.%s" % name), lines)
+
+        iops_samples = [current * 1048576 / op_size for current in bandwidth_samples]
+        with open(os.path.join(phase_dir, "json_output.%s" % name), 'w') as f:
+            f.write(json.dumps({
+                "Total time run": str(self.duration),
+                "Bandwidth (MB/sec)": "%.3f" % statistics.mean(bandwidth_samples),
+                "Stddev Bandwidth": "%.3f" % statistics.pstdev(bandwidth_samples),
+                "Average IOPS": str(int(statistics.mean(iops_samples))),
+                "Stddev IOPS": "%.3f" % statistics.pstdev(iops_samples),
+                "Average Latency(s)": "%.6f" % statistics.mean(latency_samples),
+                "Stddev Latency(s)": "%.6f" % statistics.pstdev(latency_samples),
+                "Max latency(s)": "%.6f" % max(latency_samples),
+                "Min latency(s)": "%.6f" % min(latency_samples)
+                }))
+
+    def write_pbench(self, test_dir, start):
+        #tools-default/<host>/<tool>/csv/<metric>.csv, one row per second
+        for host in self.pbench_hosts:
+            for tool in self.pbench_tools:
+                csv_dir = os.path.join(test_dir, "tools-default", host, tool, "csv")
+                os.makedirs(csv_dir)
+                if tool == "iostat":
+                    files = {"disk_IOPS": ["sda-read", "sda-write", "sdb-read", "sdb-write"]}
+                elif tool == "sar":
+                    files = {"network_l2_network_Mbits_sec": ["eth0-rx", "eth0-tx"]}
+                elif tool == "pidstat":
+                    process = "/usr/bin/fio" if host in self.clients else "/usr/bin/ceph-osd"
+                    files = {"cpu_usage_percent_cpu": ["%s-%s" % (1000 + index, process) for index in range(2)]}
+                else:
+                    files = {"%s_stats" % tool: ["value"]}
+
+                for file_name, columns in files.items():
+                    lines = [",".join(["timestamp_ms"] + columns)]
+                    for second in range(self.duration):
+                        lines.append(",".join(["%d" % ((start + second) * 1000)] +
+                                              ["%.2f" % self.random.uniform(0, 100) for _ in columns]))
+                    write_lines(os.path.join(csv_dir, "%s.csv" % file_name), lines)
+
+class cosbench_archive_writer():
+    def __init__(self, archive_dir, workloads=4, stages=("init", "prepare", "main", "cleanup"),
+                 duration=60, interval=5, operations=("read", "write"), seed=0):
+        self.archive_dir = archive_dir
+        self.workloads = workloads
+        self.stages = list(stages)
+        self.duration = duration
+        self.interval = interval
+        self.operations = list(operations)
+        self.random = random.Random(seed)
+        self.start_time = datetime.datetime(2018, 1, 1, 10, 0, 0)
+
+    def write(self):
+        if not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+
+        history = ["Id,Name,Submitted-At,State,Detailed State"]
+        for workload in range(1, self.workloads + 1):
+            name = "test%s" % workload
+            submitted = self.start_time
+            history.append("w%s,%s,%s,finished,finished" % (workload, name, submitted.strftime('%Y-%m-%d %H:%M:%S')))
+            self.write_workload(workload, name)
+        write_lines(os.path.join(self.archive_dir, "run-history.csv"), history)
+        return self.archive_dir
+
+    def write_workload(self, workload, name):
+        wdir = "w%s-%s" % (workload, name)
+        wdir_path = os.path.join(self.archive_dir, wdir)
+        os.makedirs(wdir_path)
+
+        xml = ['<?xml version="1.0" encoding="UTF-8" ?>', '<workload name="%s" description="">' % name,
+               '<storage type="s3"/>', '<workflow>']
+        for index, stage in enumerate(self.stages):
+            xml.append('<workstage name="%s">' % stage)
+            xml.append('<work name="%s" workers="%s" runtime="%s">' % (stage, 8 * (index + 1), self.duration))
+            for operation in self.operations:
+                xml.append('<operation type="%s" ratio="%s"/>' % (operation, 100 // len(self.operations)))
+            xml.append('</work>')
+            xml.append('</workstage>')
+        xml += ['</workflow>', '</workload>']
+        write_lines(os.path.join(wdir_path, "workload-config.xml"), xml)
+
+        rows = ["Stage,Op-Name,Status,Detailed Status"]
+        for index, stage in enumerate(self.stages):
+            stage_name = "s%s-%s" % (index + 1, stage)
+            launched = self.start_time
+            completed = launched + datetime.timedelta(seconds=self.duration)
+            rows.append("%s,%s,completed,submitted @ %s,launching @ %s,completed @ %s" % (
+                stage_name, "/".join(self.operations), (launched - datetime.timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S'),
+                launched.strftime('%Y-%m-%d %H:%M:%S'), completed.strftime('%Y-%m-%d %H:%M:%S')))
+            self.write_stage(os.path.join(wdir_path, "%s.csv" % stage_name), launched)
+            self.start_time = completed + datetime.timedelta(seconds=5)
+        write_lines(os.path.join(wdir_path, "%s.csv" % wdir), rows)
+
+    def write_stage(self, stage_file, launched):
+        metrics = ("Op-Count", "Byte-Count", "Avg-ResTime", "Avg-ProcTime", "Throughput", "Bandwidth", "Succ-Ratio")
+        header = ["Timestamp"]
+        sub_header = [""]
+        for metric in metrics:
+            header += [metric] + [""] * (len(self.operations) - 1)
+            sub_header += self.operations
+        lines = [",".join(header), ",".join(sub_header)]
+        for second in range(self.interval, self.duration + 1, self.interval):
+            row = [(launched + datetime.timedelta(seconds=second)).strftime('%H:%M:%S')]
+            for metric in metrics:
+                for _ in self.operations:
+                    if metric == "Succ-Ratio":
+                        row.append("100%")
+                    else:
+                        row.append("%.2f" % self.random.uniform(1, 1000))
+            lines.append(",".join(row))
+        write_lines(stage_file, lines)
+
+def main():
+    arguments = argument_handler()
+    if arguments.kind == "cosbench":
+        writer = cosbench_archive_writer(arguments.archive_dir, workloads=arguments.workloads,
+                                         duration=arguments.duration, seed=arguments.seed)
+    else:
+        writer = cbt_archive_writer(arguments.archive_dir, clients=arguments.clients, volumes=arguments.volumes,
+                                    iterations=arguments.iterations, duration=arguments.duration,
+                                    rados_instances=arguments.rados_instances, pbench_hosts=arguments.pbench_hosts,
+                                    pbench_tools=arguments.pbench_tools, seed=arguments.seed)
+    print ("%s archive written to %s" % (arguments.kind, writer.write()))
+
+class argument_handler():
+    def __init__(self):
+        self.kind = "cbt"
+        self.archive_dir = ""
+        self.clients = 2
+        self.volumes = 2
+        self.iterations = 1
+        self.duration = 60
+        self.rados_instances = 1
+        self.pbench_hosts = None
+        self.pbench_tools = ["iostat", "sar", "pidstat"]
+        self.workloads = 4
+        self.seed = 0
+
+        usage = """
+                Usage:
+                    synthetic_archive.py -a <archive dir> [-k cbt|cosbench]
+
+                    -a or --archive_dir - directory the archive is written to
+                    -k or --kind - cbt (default) or cosbench
+                    -c or --clients - cbt client hosts (default 2)
+                    -v or --volumes - rbd volumes per client (default 2)
+                    -i or --iterations - cbt iterations (default 1)
+                    -t or --time - seconds every test runs for (default 60)
+                    -r or --rados_instances - rados bench instances per client (default 1)
+                    -H or --pbench_hosts - hosts with pbench data (default every client and osd host)
+                    -T or --pbench_tools - comma seperated pbench tools (default iostat,sar,pidstat)
+                    -w or --workloads - cosbench workloads (default 4)
+                    -s or --seed - random seed (default 0)
+                """
+        try:
+            opts, _ = getopt.getopt(sys.argv[1:], 'a:k:c:v:i:t:r:H:T:w:s:',
+                                    ['archive_dir=', 'kind=', 'clients=', 'volumes=', 'iterations=', 'time=',
+                                     'rados_instances=', 'pbench_hosts=', 'pbench_tools=', 'workloads=', 'seed='])
+        except getopt.GetoptError:
+            print (usage)
+            sys.exit(2)
+
+        for opt, arg in opts:
+            if opt in ('-a', '--archive_dir'):
+                self.archive_dir = arg
+            if opt in ('-k', '--kind'):
+                self.kind = arg
+            if opt in ('-c', '--clients'):
+                self.clients = int(arg)
+            if opt in ('-v', '--volumes'):
+                self.volumes = int(arg)
+            if opt in ('-i', '--iterations'):
+                self.iterations = int(arg)
+            if opt in ('-t', '--time'):
+                self.duration = int(arg)
+            if opt in ('-r', '--rados_instances'):
+                self.rados_instances = int(arg)
+            if opt in ('-H', '--pbench_hosts'):
+                self.pbench_hosts = int(arg)
+            if opt in ('-T', '--pbench_tools'):
+                self.pbench_tools = [tool for tool in arg.split(',') if tool]
+            if opt in ('-w', '--workloads'):
+                self.workloads = int(arg)
+            if opt in ('-s', '--seed'):
+                self.seed = int(arg)
+
+        if not self.archive_dir or self.kind not in ("cbt", "cosbench"):
+            print (usage)
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -62,6 +62,7 @@ pip install pyyaml
 pip install elasticsearch 
 pip install urllib3==1.23
 pip install statistics
+pip install numpy
 pip install xmltodict
 pip install linode_api4
 